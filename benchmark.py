@@ -0,0 +1,1205 @@
+#!/usr/local/bin/python3
+"""Benchmarks for bTCP.
+
+Every benchmark is a function taking the parsed command line arguments and
+printing its results. Run all of them, or only the ones named on the command
+line:
+
+    python3 benchmark.py
+    python3 benchmark.py loopback -s 16777216
+
+The protocol engine used by the benchmarks is the bTCP state machine of
+BTCPClientSocket and BTCPServerSocket, which runs on top of any lossy layer
+implementation.
+"""
+
+import argparse
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import resource
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from btcp.btcp_socket import BTCPSocket, BTCPStates
+from btcp.client_socket import BTCPClientSocket
+from btcp.constants import *
+from btcp.delta import receive_delta, send_delta
+from btcp.file_io import receive_file, send_file
+from btcp.lossy_layer import LossyLayer
+from btcp.loopback_layer import LoopbackLayer
+from btcp.pacing import limit_process
+from btcp.poster import packet_io
+from btcp.resume import ResumableReceiver, checkpoint_path, send_resumable
+from btcp.server_pool import ServerPool
+from btcp.server_socket import BTCPListenSocket, BTCPServerSocket
+from btcp.shm_layer import SharedMemoryLayer
+from btcp.simulation import simulate, simulate_messages, simulate_requests, simulate_striped
+
+
+TIMEOUT = 100
+
+
+def _read_all(server, size, limit):
+    """Server application: recv until size bytes arrived or the connection is
+    closed. Returns the data and the time the last of it arrived.
+    """
+    received = bytearray()
+    deadline = time.time() + limit
+    while len(received) < size and time.time() < deadline:
+        chunk = server.recv()
+        if not chunk:
+            break
+        received.extend(chunk)
+    return bytes(received), time.time()
+
+
+def _send_all(client, data, limit, write_size=None, **options):
+    """Client application: connect (with options passed on to connect), send
+    all data, in writes of write_size bytes if given, shut down. Returns the
+    time the connection attempt started."""
+    start = time.time()
+    if client.connect(**options):
+        view = memoryview(data)
+        sent = 0
+        deadline = start + limit
+        while sent < len(data) and time.time() < deadline:
+            piece = view[sent:sent + (write_size or len(data))]
+            accepted = client.send(piece)
+            sent += accepted
+            if accepted < len(piece):
+                time.sleep(0.001)
+        client.shutdown()
+    return start
+
+
+def run_engine(layer, data, window, timeout=TIMEOUT, limit=600.0, write_size=None,
+               nodelay=False, **options):
+    """Transfer data between a BTCPClientSocket and a BTCPServerSocket in
+    this process over the given lossy layer class, in real time. The data
+    is sent in writes of write_size bytes if given, with the client's
+    nodelay set as given. options are passed on to connect, e.g.
+    compression, the zlib level to compress at.
+
+    Returns the number of seconds from the start of the handshake until all
+    data has been received, or None if the transfer did not complete.
+    """
+    server = BTCPServerSocket(window, timeout, layer)
+    client = BTCPClientSocket(window, timeout, layer)
+    client.nodelay = nodelay
+    result = []
+    reader = threading.Thread(target=lambda: result.append(_read_all(server, len(data), limit)))
+    reader.start()
+    try:
+        start = _send_all(client, data, limit, write_size, **options)
+        reader.join()
+    finally:
+        client.close()
+        server.close()
+
+    received, finish = result[0]
+    if received != data:
+        return None
+    return finish - start
+
+
+def _receive_in_process(layer, window, timeout, size, limit, ready, results):
+    """Receiving half of run_engine_processes, run in the child process."""
+    server = BTCPServerSocket(window, timeout, layer)
+    ready.set()
+    received, finish = _read_all(server, size, limit)
+    # Give the final ack of the client a moment to arrive.
+    time.sleep(0.1)
+    server.close()
+    results.put((finish, hashlib.sha256(received).digest()))
+
+
+def run_engine_processes(layer, data, window, timeout=TIMEOUT, limit=600.0):
+    """Like run_engine, but with the server in a separate process."""
+    ready = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_receive_in_process,
+                                    args=(layer, window, timeout, len(data), limit,
+                                          ready, results))
+    child.start()
+    ready.wait()
+
+    client = BTCPClientSocket(window, timeout, layer)
+    try:
+        start = _send_all(client, data, limit)
+        finish, digest = results.get(True, limit + 10)
+    finally:
+        client.close()
+        child.join()
+
+    if digest != hashlib.sha256(data).digest():
+        return None
+    return finish - start
+
+
+def report(name, size, seconds):
+    """Print one line of benchmark output."""
+    if seconds is None:
+        print("{:40s} did not complete".format(name))
+    else:
+        print("{:40s} {:8.3f}s {:10.1f} MiB/s".format(
+            name, seconds, size / seconds / (1024 * 1024)))
+    sys.stdout.flush()
+
+
+def bench_loopback(args):
+    """Throughput of the protocol engine over UDP versus the in-process
+    loopback layer. The loopback layer skips the sockets and the kernel, so
+    the difference is what those cost; the rest is the protocol engine and
+    handing segments between its two network threads.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for name, layer in (("udp (LossyLayer)", LossyLayer),
+                        ("in-process (LoopbackLayer)", LoopbackLayer)):
+        report(name, args.size, run_engine(layer, data, args.window))
+
+
+def bench_shm(args):
+    """Throughput of the protocol engine between two processes on the same
+    host, over UDP on the loopback interface versus the shared memory ring.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for name, layer in (("udp (LossyLayer)", LossyLayer),
+                        ("shared memory (SharedMemoryLayer)", SharedMemoryLayer)):
+        report(name, args.size, run_engine_processes(layer, data, args.window))
+
+
+def bench_io(args):
+    """Latency and throughput of the packet_io thread that Btcp uses for its
+    UDP socket: round trip time of one segment bounced between two endpoints,
+    the rate at which one endpoint can push segments to the other, and the
+    latency of control segments sent while data floods the backlog.
+    """
+    segment = bytes(1010)
+    endpoints = []
+    for port in (CLIENT_PORT + 1, SERVER_PORT + 1):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.bind(("localhost", port))
+        received = queue.Queue(1000)
+        io = packet_io(received.put_nowait, udp_socket)
+        io.start()
+        endpoints.append((udp_socket, received, io, ("localhost", port)))
+    (a_socket, a_received, a_io, a_addr), (b_socket, b_received, b_io, b_addr) = endpoints
+
+    rounds = 5000
+    rtts = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        a_io.send(segment, b_addr)
+        data, addr = b_received.get(True, 2)
+        b_io.send(data, a_addr)
+        a_received.get(True, 2)
+        rtts.append(time.perf_counter() - start)
+    rtts.sort()
+    print("round trip: median {:.1f}us, p99 {:.1f}us".format(
+        rtts[rounds // 2] * 1e6, rtts[int(rounds * 0.99)] * 1e6))
+
+    count = 50000
+    got = []
+    def consume():
+        last = None
+        try:
+            for i in range(count):
+                b_received.get(True, 0.5)
+                last = time.perf_counter()
+        except queue.Empty:
+            i -= 1
+        got.append((i + 1, last))
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        a_io.send(segment, b_addr)
+    consumer.join()
+    delivered, last = got[0]
+    print("throughput: {}/{} segments delivered, {:.0f} segments/s".format(
+        delivered, count, delivered / (last - start)))
+
+    for udp_socket, received, io, addr in endpoints:
+        io.stop()
+        io.join()
+        udp_socket.close()
+
+    for control in (False, True):
+        _control_latency(control)
+
+
+def _control_latency(control):
+    """Send a control segment every 2ms while another thread floods the
+    same packet_io with data, and report how long the control segments took
+    to arrive, sent as data (one FIFO backlog) or with control=True.
+
+    Loopback UDP drops what doesn't fit instead of blocking, so this uses
+    Unix datagram sockets, which block when the receiver is behind and so
+    build a backlog.
+    """
+    directory = tempfile.mkdtemp()
+    paths = [os.path.join(directory, name) for name in ("a", "b")]
+    sockets = []
+    for path in paths:
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        unix_socket.bind(path)
+        sockets.append(unix_socket)
+    latencies = []
+    def dispatch(item):
+        data, addr = item
+        if len(data) == 8:
+            latencies.append(time.perf_counter() - struct.unpack("!d", data)[0])
+    a_io = packet_io(lambda item: None, sockets[0])
+    b_io = packet_io(dispatch, sockets[1])
+    a_io.start()
+    b_io.start()
+
+    segment = bytes(1010)
+    flooding = threading.Event()
+    flooding.set()
+    def flood():
+        while flooding.is_set():
+            for _ in range(50):
+                a_io.send(segment, paths[1])
+            time.sleep(0.0005)
+    flooder = threading.Thread(target=flood)
+    flooder.start()
+    for _ in range(500):
+        a_io.send(struct.pack("!d", time.perf_counter()), paths[1], control=control)
+        time.sleep(0.002)
+    flooding.clear()
+    flooder.join()
+    while a_io.backlog or a_io.control_backlog:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    latencies.sort()
+    print("control {}: latency median {:.2f}ms, p99 {:.2f}ms; queueing delay "
+          "control {:.2f}/{:.2f}ms, data {:.2f}/{:.2f}ms (mean/max)".format(
+              "with priority" if control else "as data",
+              latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3,
+              a_io.control_delay.mean * 1e3, a_io.control_delay.max * 1e3,
+              a_io.data_delay.mean * 1e3, a_io.data_delay.max * 1e3))
+    sys.stdout.flush()
+
+    for io in (a_io, b_io):
+        io.stop()
+        io.join()
+    for unix_socket in sockets:
+        unix_socket.close()
+    shutil.rmtree(directory)
+
+
+def _answer_requests(server, responder, request_size, response):
+    """Server application of run_requests: answer every request_size bytes
+    received on server with response, sent on responder, until the client
+    shuts down."""
+    pending = bytearray()
+    while True:
+        data = server.recv()
+        if not data:
+            return
+        pending.extend(data)
+        while len(pending) >= request_size:
+            del pending[:request_size]
+            view = memoryview(response)
+            while view:
+                view = view[responder.send(view):]
+                if view:
+                    time.sleep(0.001)
+
+
+def run_requests(layer, count, request_size, response_size, duplex, window, timeout=TIMEOUT):
+    """Real time version of btcp.simulation.simulate_requests: the latency
+    of count requests over the given lossy layer class, each answered over
+    the same connection (duplex) or over a second one the other way. Returns
+    the latencies and the number of ACKs sent apart from data.
+    """
+    server = BTCPServerSocket(window, timeout, layer)
+    client = BTCPClientSocket(window, timeout, layer)
+    sockets = [server, client]
+    if duplex:
+        responder, responses = server, client
+    else:
+        responses = BTCPServerSocket(window, timeout, layer,
+                                     local_address=(CLIENT_IP, CLIENT_PORT + 1),
+                                     remote_address=(SERVER_IP, SERVER_PORT + 1))
+        responder = BTCPClientSocket(window, timeout, layer,
+                                     local_address=(SERVER_IP, SERVER_PORT + 1),
+                                     remote_address=(CLIENT_IP, CLIENT_PORT + 1))
+        sockets += [responses, responder]
+        responder.connect()
+    client.connect()
+    response = random.Random(0).randbytes(response_size)
+    answering = threading.Thread(target=_answer_requests,
+                                 args=(server, responder, request_size, response))
+    answering.start()
+
+    acks_before = sum(socket.acks_sent for socket in sockets)
+    latencies = []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            client.send(bytes(request_size))
+            received = bytearray()
+            while len(received) < response_size:
+                data = responses.recv()
+                if not data:
+                    break
+                received.extend(data)
+            latencies.append(time.perf_counter() - start)
+        acks = sum(socket.acks_sent for socket in sockets) - acks_before
+        client.shutdown()
+        answering.join()
+        if not duplex:
+            responder.shutdown()
+    finally:
+        for socket in sockets:
+            socket.close()
+    return latencies, acks
+
+
+def bench_requests(args):
+    """Request/response latency (median and p99) with the response on the
+    same connection as the request versus on a second connection, with the
+    segments and the ACKs apart from data sent per request: in simulation
+    with a 10ms one way delay, without and with 5% loss, then in real time
+    over UDP and the in-process LoopbackLayer.
+    """
+    count = 200
+    for response_size in (1000, 20000):
+        for loss in (0, 0.05):
+            for duplex in (False, True):
+                result = simulate_requests(count, 100, response_size, duplex, args.window,
+                                           delay=0.01, loss=loss)
+                print("{:40s} median {:6.1f}ms p99 {:6.1f}ms, {:5.2f} segments, {:5.2f} ACKs{}".format(
+                    "{} B, loss {:.0%}, {}".format(response_size, loss,
+                                                   "duplex" if duplex else "two connections"),
+                    result.percentile(0.5) * 1000, result.percentile(0.99) * 1000,
+                    result.segments_sent / count, result.acks_sent / count,
+                    "" if result.correct else " (DATA MISMATCH)"))
+                sys.stdout.flush()
+    for layer in (LossyLayer, LoopbackLayer):
+        for duplex in (False, True):
+            latencies, acks = run_requests(layer, count, 100, 1000, duplex, args.window)
+            latencies.sort()
+            print("{:40s} median {:6.3f}ms p99 {:6.3f}ms, {:5.2f} ACKs".format(
+                "{}, {}".format(layer.__name__, "duplex" if duplex else "two connections"),
+                latencies[count // 2] * 1000, latencies[int(count * 0.99)] * 1000,
+                acks / count))
+            sys.stdout.flush()
+
+
+def run_messages(layer, count, size, interval, nodelay, window, timeout=TIMEOUT):
+    """Real time version of btcp.simulation.simulate_messages: the latency
+    of count messages of size bytes over the given lossy layer class, one
+    sent every interval seconds.
+    """
+    server = BTCPServerSocket(window, timeout, layer)
+    client = BTCPClientSocket(window, timeout, layer)
+    client.nodelay = nodelay
+    client.connect()
+    sent_at = []
+    arrived_at = []
+    def read():
+        received = 0
+        while len(arrived_at) < count:
+            data = server.recv()
+            if not data:
+                return
+            received += len(data)
+            now = time.perf_counter()
+            while len(arrived_at) < received // size:
+                arrived_at.append(now)
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        message = bytes(size)
+        for _ in range(count):
+            sent_at.append(time.perf_counter())
+            view = memoryview(message)
+            while view:
+                view = view[client.send(view):]
+                if view:
+                    time.sleep(0.001)
+            time.sleep(interval)
+        reader.join()
+        client.shutdown()
+    finally:
+        client.close()
+        server.close()
+    return [arrived - sent for sent, arrived in zip(sent_at, arrived_at)]
+
+
+def bench_nagle(args):
+    """Small writes with and without nodelay. Throughput and segments sent
+    for 100 byte writes: in simulation with a 10ms one way delay, the
+    application writing 1 MB/s and 100 KB/s, then in real time over UDP and
+    the in-process LoopbackLayer, writing as fast as it can. Then the
+    latency (median and p99) of a 100 byte message sent every 5ms, in
+    simulation without and with 5% loss, and of one every 1ms in real time.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for name, interval in (("1 MB/s", 0.0001), ("100 KB/s", 0.001)):
+        for nodelay in (False, True):
+            result = simulate(data, args.window, TIMEOUT / 1000, delay=0.01, write_size=100,
+                              write_interval=interval, nodelay=nodelay)
+            report("100 B writes, {}, {}, {} segments{}".format(
+                name, "nodelay" if nodelay else "coalesced", result.segments_sent,
+                "" if result.correct else " (DATA MISMATCH)"), args.size, result.duration)
+    for layer in (LossyLayer, LoopbackLayer):
+        for nodelay in (False, True):
+            report("100 B writes, {}, {}".format(layer.__name__,
+                                                 "nodelay" if nodelay else "coalesced"),
+                   args.size, run_engine(layer, data, args.window, write_size=100,
+                                         nodelay=nodelay))
+    count = 200
+    for loss in (0, 0.05):
+        for nodelay in (False, True):
+            result = simulate_messages(count, 100, 0.005, nodelay, args.window,
+                                       delay=0.01, loss=loss)
+            print("{:40s} median {:6.1f}ms p99 {:6.1f}ms, {:5.2f} segments, {:5.2f} ACKs{}".format(
+                "loss {:.0%}, {}".format(loss, "nodelay" if nodelay else "coalesced"),
+                result.percentile(0.5) * 1000, result.percentile(0.99) * 1000,
+                result.segments_sent / count, result.acks_sent / count,
+                "" if result.correct else " (DATA MISMATCH)"))
+            sys.stdout.flush()
+    for layer in (LossyLayer, LoopbackLayer):
+        for nodelay in (False, True):
+            latencies = sorted(run_messages(layer, count, 100, 0.001, nodelay, args.window))
+            print("{:40s} median {:6.3f}ms p99 {:6.3f}ms".format(
+                "{}, {}".format(layer.__name__, "nodelay" if nodelay else "coalesced"),
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.99)] * 1000))
+            sys.stdout.flush()
+
+
+def run_connections(layer, clients, size, window, timeout=TIMEOUT, limit=600.0):
+    """Have clients BTCPClientSocket send size // clients bytes each, all at
+    the same time, to one BTCPListenSocket in this process.
+
+    Returns the number of seconds from the first connection attempt until the
+    last byte arrived, or None if not every connection delivered its data
+    intact.
+    """
+    share = size // clients
+    data = [random.Random(i).randbytes(share) for i in range(clients)]
+    listener = BTCPListenSocket(window, timeout, backlog=clients, layer=layer)
+    received = {}
+
+    def serve():
+        # One thread accepts and drains all connections, so the number of
+        # server threads doesn't grow with the number of clients.
+        connections = []
+        open_connections = []
+        deadline = time.time() + limit
+        while (len(connections) < clients or open_connections) and time.time() < deadline:
+            connection = listener.accept(0 if open_connections else 0.01)
+            if connection is not None:
+                connections.append(connection)
+                open_connections.append(connection)
+                received[connection] = bytearray()
+            busy = False
+            for connection in list(open_connections):
+                # Check the state first: once closed, no more data arrives.
+                closed = connection._state == BTCPStates.CLOSED
+                try:
+                    while True:
+                        received[connection].extend(connection._recvbuf.get_nowait())
+                        busy = True
+                except queue.Empty:
+                    if closed:
+                        open_connections.remove(connection)
+            if not busy:
+                time.sleep(0.001)
+        for connection in connections:
+            connection.close()
+        result.append(time.time())
+
+    result = []
+    server = threading.Thread(target=serve)
+    server.start()
+    sockets = [BTCPClientSocket(window, timeout, layer,
+                                local_address=(CLIENT_IP, CLIENT_PORT + i))
+               for i in range(clients)]
+    threads = [threading.Thread(target=_send_all, args=(client, chunk, limit))
+               for client, chunk in zip(sockets, data)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+        server.join()
+    finally:
+        for client in sockets:
+            client.close()
+        listener.close()
+
+    # Received data is keyed by connection; match it up by content.
+    if sorted(bytes(chunk) for chunk in received.values()) != sorted(data):
+        return None
+    return result[0] - start
+
+
+def bench_connections(args):
+    """Aggregate throughput of one listening socket serving 1, 10, 100 and
+    1000 concurrent clients over the loopback layer, with the total amount of
+    data split evenly between the clients.
+    """
+    for clients in (1, 10, 100, 1000):
+        report("{} clients".format(clients), args.size,
+               run_connections(LoopbackLayer, clients, args.size, args.window))
+
+
+def _send_in_process(first, clients, share, window, timeout, server, limit):
+    """Client process of bench_workers: clients BTCPClientSockets on
+    consecutive ports starting at first, each sending share bytes to server."""
+    sockets = [BTCPClientSocket(window, timeout, LossyLayer,
+                                local_address=(CLIENT_IP, first + i), remote_address=server)
+               for i in range(clients)]
+    data = random.Random(first).randbytes(share)
+    threads = [threading.Thread(target=_send_all, args=(client, data, limit))
+               for client in sockets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in sockets:
+        client.close()
+
+
+def run_workers(workers, clients, size, window, timeout=TIMEOUT, limit=600.0, processes=4):
+    """Have clients connections, spread over processes client processes, send
+    size // clients bytes each to a ServerPool of workers processes.
+
+    Returns the number of seconds until the pool received all data, or None
+    if that didn't happen within limit.
+    """
+    server = (SERVER_IP, SERVER_PORT + 2)
+    share = size // clients
+    pool = ServerPool(workers, window, timeout, server, backlog=clients, interval=0.05)
+    pool.start()
+    # Give every worker the time to bind before the clients start.
+    time.sleep(0.5)
+
+    start = time.time()
+    senders = []
+    for p in range(processes):
+        count = clients // processes + (p < clients % processes)
+        first = CLIENT_PORT + 100 + p * (clients // processes + 1)
+        sender = multiprocessing.Process(target=_send_in_process,
+                                         args=(first, count, share, window, timeout,
+                                               server, limit))
+        sender.start()
+        senders.append(sender)
+
+    finish = None
+    while time.time() - start < limit:
+        pool.poll(0.05)
+        stats = pool.stats()
+        if stats["bytes"] >= share * clients:
+            finish = time.time()
+            break
+    for sender in senders:
+        sender.join()
+    pool.stop()
+    if finish is None or pool.stats()["bytes"] != share * clients:
+        return None
+    return finish - start
+
+
+def bench_workers(args):
+    """Aggregate goodput of a ServerPool with 1, 2 and 4 worker processes
+    sharing one port through SO_REUSEPORT, with 64 clients in 4 client
+    processes. Only scales with as many cores as the machine has.
+    """
+    print("{} cores".format(multiprocessing.cpu_count()))
+    for workers in (1, 2, 4):
+        report("{} workers".format(workers), args.size,
+               run_workers(workers, 64, args.size, args.window))
+
+
+def bench_stripes(args):
+    """Completion time of a striped transfer versus the number of stripes, in
+    simulation under the lossy profile of the test framework (10% loss, 25%
+    correlated) with a 10ms one way delay.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for stripes in (1, 2, 4, 8, 16):
+        result = simulate_striped(data, stripes, args.window, TIMEOUT / 1000, delay=0.01,
+                                  loss=0.1, loss_correlation=0.25)
+        report("{} stripes{}".format(stripes, "" if result.correct else " (DATA MISMATCH)"),
+               args.size, result.duration)
+
+
+def bench_checksum(args):
+    """Segments per second built and verified with every checksum algorithm
+    (and with the internet checksum also computed by in_cksum_parts), and
+    how many of 1000 segments with two 16 bit words swapped still pass
+    verification."""
+    generator = random.Random(0)
+    chunks = [generator.randbytes(PAYLOAD_SIZE - TRAILER_SIZE) for _ in range(1000)]
+    for name, algorithm in (("internet", INTERNET_CHECKSUM), ("crc32", CRC32_CHECKSUM),
+                            ("adler32", ADLER32_CHECKSUM)):
+        start = time.perf_counter()
+        segments = [BTCPSocket.build_segment(i, 0, data=chunk, algorithm=algorithm)
+                    for i, chunk in enumerate(chunks)]
+        assert all(BTCPSocket.verify_segment(segment) for segment in segments)
+        seconds = time.perf_counter() - start
+        undetected = 0
+        for segment in segments:
+            swapped = bytearray(segment)
+            swapped[20:22], swapped[40:42] = segment[40:42], segment[20:22]
+            undetected += BTCPSocket.verify_segment(bytes(swapped))
+        print("{:40s} {:10.0f} segments/s {:5d}/1000 swaps undetected".format(
+            name, len(segments) / seconds, undetected))
+    start = time.perf_counter()
+    for chunk in chunks:
+        BTCPSocket.in_cksum_parts(chunk, bytes(TRAILER_SIZE))
+    print("{:40s} {:10.0f} segments/s".format(
+        "internet (in_cksum_parts, checksum only)", len(chunks) / (time.perf_counter() - start)))
+    sys.stdout.flush()
+
+
+def bench_fec(args):
+    """Completion time with and without forward error correction, in
+    simulation with a 10ms one way delay, under the loss profiles of the test
+    framework: none, "loss 10% 25%", and that plus 10% duplicates and
+    reordering ("all bad", without corruption).
+    """
+    data = random.Random(0).randbytes(args.size)
+    profiles = (("no loss", {}),
+                ("loss 1%", {"loss": 0.01}),
+                ("loss 10% 25%", {"loss": 0.1, "loss_correlation": 0.25}),
+                ("all bad", {"loss": 0.1, "loss_correlation": 0.25, "duplicate": 0.1,
+                             "jitter": 0.01}))
+    for name, profile in profiles:
+        for fec in (False, True):
+            result = simulate(data, args.window, TIMEOUT / 1000, delay=0.01, fec=fec, **profile)
+            report("{}, FEC {}, {} retransmissions{}".format(
+                name, "on" if fec else "off", result.retransmissions,
+                "" if result.correct else " (DATA MISMATCH)"), args.size, result.duration)
+
+
+def bench_corruption(args):
+    """Completion time with and without payload size adaptation, in
+    simulation with a 10ms one way delay on a 1 MB/s link, at several bit
+    error rates, with the corruption rate the client estimated and the data
+    per segment it chose in the end.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for bit_error in (0, 1e-5, 3e-5, 1e-4):
+        for adaptive in (False, True):
+            result = simulate(data, args.window, TIMEOUT / 1000, delay=0.01, rate=1e6,
+                              bit_error=bit_error, adaptive=adaptive)
+            report("ber {:g}, {}, {:.0%} corrupt, {} B{}".format(
+                bit_error, "adaptive" if adaptive else "fixed", result.corruption_estimate,
+                result.chunk_size, "" if result.correct else " (DATA MISMATCH)"),
+                args.size, result.duration)
+
+
+def bench_nak(args):
+    """Completion time with and without NAKs, in simulation with a 10ms one
+    way delay, under loss and corruption profiles. Without NAKs, a loss is
+    noticed after three duplicate ACKs or the timeout.
+    """
+    data = random.Random(0).randbytes(args.size)
+    profiles = (("loss 1%", {"loss": 0.01}),
+                ("loss 10% 25%", {"loss": 0.1, "loss_correlation": 0.25}),
+                ("ber 1e-5", {"bit_error": 1e-5}),
+                ("ber 1e-4", {"bit_error": 1e-4}))
+    for name, profile in profiles:
+        for naks in (False, True):
+            result = simulate(data, args.window, TIMEOUT / 1000, delay=0.01, naks=naks,
+                              **profile)
+            report("{}, NAK {}, {} retransmissions{}".format(
+                name, "on" if naks else "off", result.retransmissions,
+                "" if result.correct else " (DATA MISMATCH)"), args.size, result.duration)
+
+
+def bench_tlp(args):
+    """Mean and worst completion time of small and medium transfers with and
+    without tail loss probes, over many simulated runs (seeds) with a 10ms one
+    way delay and loss. A lost segment at the end of a transfer has no later
+    segments to report it, so without probes it waits for the timeout.
+    """
+    for size, runs in ((4 * 1024, 200), (64 * 1024, 100), (1024 * 1024, 20)):
+        data = random.Random(0).randbytes(size)
+        for loss in (0.01, 0.1):
+            for probe in (False, True):
+                results = [simulate(data, args.window, TIMEOUT / 1000, delay=0.01, loss=loss,
+                                    seed=seed, tail_loss_probe=probe)
+                           for seed in range(runs)]
+                durations = [result.duration for result in results]
+                print("{:40s} mean {:7.3f}s max {:7.3f}s{}".format(
+                    "{} KiB, loss {:.0%}, TLP {}".format(size // 1024, loss,
+                                                         "on" if probe else "off"),
+                    sum(durations) / runs, max(durations),
+                    "" if all(result.correct for result in results) else " (DATA MISMATCH)"))
+                sys.stdout.flush()
+
+
+def bench_pacing(args):
+    """Completion time, largest burst, queueing delay (mean and max) and
+    segments lost with the window sent back to back, paced, and paced under
+    a rate limit of 95% of the link, in simulation with a 10ms one way delay
+    on a 1 MB/s link with an unlimited and a 32 KiB buffer. Then four striped
+    connections on links of their own, with and without a process-wide cap.
+    """
+    data = random.Random(0).randbytes(args.size)
+    def describe(name, result, lost):
+        return "{}, burst {}, queue {:.1f}/{:.1f}ms, {} lost{}".format(
+            name, result.max_burst, result.queue_delay * 1000,
+            result.max_queue_delay * 1000, lost, "" if result.correct else " (DATA MISMATCH)")
+    modes = (("back to back", {"pacing": False}),
+             ("paced", {}),
+             ("paced, 95% limit", {"rate_limit": 0.95e6}))
+    for buffer in (None, 32 * 1024):
+        for name, options in modes:
+            result = simulate(data, args.window, TIMEOUT / 1000, delay=0.01, rate=1e6,
+                              buffer=buffer, **options)
+            report(describe("{}, {}".format("no buffer limit" if buffer is None else
+                                            "32 KiB buffer", name),
+                            result, result.segments_lost), args.size, result.duration)
+    for cap in (None, 0.95e6):
+        for pacing in (False, True):
+            # The cap starts over with every simulated clock.
+            limit_process(cap)
+            result = simulate_striped(data, 4, args.window, TIMEOUT / 1000, delay=0.01,
+                                      rate=1e6, buffer=32 * 1024, pacing=pacing)
+            report(describe("4 stripes, {}, {}".format(
+                "uncapped" if cap is None else "process cap",
+                "paced" if pacing else "back to back"), result, result.segments_lost),
+                args.size, result.duration)
+    limit_process(None)
+
+
+def peak_rss():
+    """Peak resident set size of this process in MiB."""
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_input(path, size, block_size=1024 * 1024):
+    """Fill the file at path with size random bytes, a block at a time."""
+    generator = random.Random(size)
+    with open(path, "wb") as file:
+        for offset in range(0, size, block_size):
+            file.write(generator.randbytes(min(block_size, size - offset)))
+
+
+def _same_file(a, b, block_size=1024 * 1024):
+    with open(a, "rb") as file_a, open(b, "rb") as file_b:
+        while True:
+            block = file_a.read(block_size)
+            if block != file_b.read(block_size):
+                return False
+            if not block:
+                return True
+
+
+def _transfer_file(source, destination, window, streaming, results):
+    """Transfer the file source to destination over the loopback layer in a
+    fresh process, and report the time taken and the peak RSS of the process.
+
+    streaming selects send_file / receive_file; otherwise the file is read
+    whole and received data is collected as a list of chunks, the way the
+    apps used to do it.
+    """
+    server = BTCPServerSocket(window, TIMEOUT, LoopbackLayer)
+    client = BTCPClientSocket(window, TIMEOUT, LoopbackLayer)
+    if streaming:
+        reader = threading.Thread(target=receive_file, args=(server, destination))
+    else:
+        def collect():
+            chunks = []
+            while True:
+                chunk = server.recv()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            with open(destination, "wb") as file:
+                file.write(b''.join(chunks))
+        reader = threading.Thread(target=collect)
+    reader.start()
+    start = time.time()
+    if streaming:
+        if client.connect():
+            send_file(client, source)
+            client.shutdown()
+    else:
+        with open(source, "rb") as file:
+            _send_all(client, file.read(), 600.0)
+    reader.join()
+    seconds = time.time() - start
+    client.close()
+    server.close()
+    results.put((seconds, peak_rss()))
+
+
+def bench_files(args):
+    """Time and peak RSS of a file transfer in a fresh process, for files of
+    increasing size, streaming versus holding the whole file in memory. The
+    peak RSS of the streaming transfer should not grow with the file size.
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "input")
+        destination = os.path.join(directory, "output")
+        for size in (args.size // 4, args.size, args.size * 4):
+            _write_input(source, size)
+            for name, streaming in (("streaming", True), ("whole file", False)):
+                results = context.Queue()
+                child = context.Process(target=_transfer_file,
+                                        args=(source, destination, args.window, streaming,
+                                              results))
+                child.start()
+                seconds, rss = results.get()
+                child.join()
+                if not _same_file(source, destination):
+                    seconds = None
+                report("{} {:.1f} MiB, peak RSS {:.1f} MiB".format(
+                    name, size / (1024 * 1024), rss), size, seconds)
+
+
+class _JoiningLayer(LossyLayer):
+    """LossyLayer without scatter I/O: every segment is joined into one
+    bytes object before it goes to the kernel."""
+
+    send_segment_parts = None
+
+
+def _receive_file_process(destination, window, ready, results):
+    """Receiving process of bench_mapped."""
+    server = BTCPServerSocket(window, TIMEOUT)
+    ready.set()
+    server.accept()
+    receive_file(server, destination)
+    server.close()
+    results.put(time.time())
+
+
+def _sample_rss(peaks, stop):
+    """Keep the largest anonymous and file backed resident set sizes of this
+    process seen, in KiB, in peaks until stop is set."""
+    while not stop.is_set():
+        with open("/proc/self/status") as status:
+            for line in status:
+                for index, field in enumerate(("RssAnon:", "RssFile:")):
+                    if line.startswith(field):
+                        peaks[index] = max(peaks[index], int(line.split()[1]))
+        stop.wait(0.005)
+
+
+def _send_file_process(source, window, payload, mapped, results):
+    """Sending process of bench_mapped: send the file source over UDP in
+    segments with payload bytes of data, with send_file from the mapping, or
+    read into a reused buffer (which the client has to copy) and sent as
+    joined segments. Reports when the handshake started, the CPU time of
+    the process and its peak anonymous and file backed RSS in MiB."""
+    peaks = [0, 0]
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample_rss, args=(peaks, stop))
+    sampler.start()
+    client = BTCPClientSocket(window, TIMEOUT, LossyLayer if mapped else _JoiningLayer)
+    start = time.time()
+    if client.connect(max_payload=payload):
+        if mapped:
+            send_file(client, source)
+        else:
+            buffer = bytearray(window * PAYLOAD_SIZE)
+            with open(source, "rb", buffering=0) as file:
+                while True:
+                    read = file.readinto(buffer)
+                    if not read:
+                        break
+                    client.sendall(memoryview(buffer)[:read])
+        client.shutdown()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    stop.set()
+    sampler.join()
+    client.close()
+    results.put((start, usage.ru_utime + usage.ru_stime, peaks[0] / 1024, peaks[1] / 1024))
+
+
+def bench_mapped(args):
+    """Sending a file from its memory mapping, with segments that refer to
+    the mapped pages and go out with scatter I/O, versus copying the file
+    into the send buffer and every segment into one bytes object. Both over
+    UDP to a receiving process, with the default payload size and with 32 KiB
+    payloads; reported are the wall time, and the CPU time and peak RSS of
+    the sending process, anonymous memory and file backed pages (the mapped
+    file, which the kernel can reclaim) apart. The send buffer holds 1000
+    chunks, so copying into it costs up to 1000 payloads of anonymous memory.
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "input")
+        destination = os.path.join(directory, "output")
+        _write_input(source, args.size)
+        for (name, mapped), payload in itertools.product(
+                (("mapped", True), ("copied", False)), (PAYLOAD_SIZE, 32 * 1024)):
+            ready = context.Event()
+            finished = context.Queue()
+            results = context.Queue()
+            receiver = context.Process(target=_receive_file_process,
+                                       args=(destination, args.window, ready, finished))
+            receiver.start()
+            ready.wait()
+            sender = context.Process(target=_send_file_process,
+                                     args=(source, args.window, payload, mapped, results))
+            sender.start()
+            finish = finished.get(True, 600)
+            start, cpu, anonymous, mapped_pages = results.get(True, 600)
+            sender.join()
+            receiver.join()
+            seconds = finish - start if _same_file(source, destination) else None
+            report("{} {}B, CPU {:.2f}s, RSS {:.0f}+{:.0f} MiB".format(
+                name, payload, cpu, anonymous, mapped_pages), args.size, seconds)
+
+
+def _receive_resumable(path, window, interval, ready, results):
+    """Receiving process of bench_resume."""
+    receiver = ResumableReceiver(path, interval)
+    server = BTCPServerSocket(window, TIMEOUT)
+    server.handshake = receiver.handshake
+    ready.set()
+    server.accept()
+    complete = receiver.receive(server)
+    server.close()
+    results.put((time.time(), complete, receiver.resumed))
+
+
+def _run_resumable(context, source, destination, window, interval, limit=None):
+    """One transfer of source to a receiving process over UDP. With limit,
+    the receiver is killed as soon as limit bytes have been acknowledged, like
+    a transfer that dies. Returns (seconds, bytes resumed) for a complete
+    transfer, None otherwise.
+    """
+    ready = context.Event()
+    results = context.Queue()
+    child = context.Process(target=_receive_resumable,
+                            args=(destination, window, interval, ready, results))
+    child.start()
+    ready.wait()
+    client = BTCPClientSocket(window, TIMEOUT)
+    try:
+        start = time.time()
+        send_resumable(client, source, limit)
+        if limit is not None:
+            while client._sendbuf.qsize() or client._rest or client._base < client._next_seqnum:
+                time.sleep(0.001)
+            os.kill(child.pid, signal.SIGKILL)
+            child.join()
+            return None
+        client.shutdown()
+        finish, complete, resumed = results.get(True, 600)
+        child.join()
+    finally:
+        client.close()
+    return (finish - start, resumed) if complete else None
+
+
+def bench_resume(args):
+    """Time to complete a transfer after it died at 95%, resuming from the
+    receiver's checkpoint (written every size / 8 bytes) versus sending the
+    whole file again. The receiver runs in a separate process, which is
+    killed to interrupt the transfer.
+    """
+    context = multiprocessing.get_context("spawn")
+    interval = max(args.size // 8, 1)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "input")
+        destination = os.path.join(directory, "output")
+        _write_input(source, args.size)
+        for name, resume in (("resumed", True), ("sent again", False)):
+            _run_resumable(context, source, destination, args.window, interval,
+                           limit=args.size * 95 // 100)
+            if not resume:
+                os.unlink(checkpoint_path(destination))
+            result = _run_resumable(context, source, destination, args.window, interval)
+            if result is None or not _same_file(source, destination):
+                report(name, args.size, None)
+            else:
+                seconds, resumed = result
+                report("{} ({:.0f}% from checkpoint)".format(name, resumed * 100 / args.size),
+                       args.size, seconds)
+            os.unlink(destination)
+
+
+class _CountingLayer(LoopbackLayer):
+    """LoopbackLayer that adds up the size of every segment sent, in both
+    directions and over all connections."""
+
+    sent = 0
+    _lock = threading.Lock()
+
+
+    def send_segment_to(self, segment, address):
+        with _CountingLayer._lock:
+            _CountingLayer.sent += len(segment)
+        super().send_segment_to(segment, address)
+
+
+def _write_changed(source, path, fraction, run=16 * 1024):
+    """Copy the file source to path, overwriting fraction of its bytes with
+    random data, in runs of run bytes at random offsets (edits to a file
+    tend to be clustered, not spread out a few bytes at a time)."""
+    shutil.copyfile(source, path)
+    size = os.path.getsize(source)
+    generator = random.Random(size + 1)
+    with open(path, "r+b") as file:
+        for _ in range(int(size * fraction) // run):
+            file.seek(generator.randrange(max(size - run, 1)))
+            file.write(generator.randbytes(run))
+
+
+def _run_delta(old, new, destination, window, delta):
+    """Update destination, a copy of old, to new over the loopback layer,
+    either as a delta or by sending all of new. Returns the time taken and
+    the bytes of all segments sent, or (None, bytes) if the result is wrong.
+    """
+    shutil.copyfile(old, destination)
+    _CountingLayer.sent = 0
+    server = BTCPServerSocket(window, TIMEOUT, _CountingLayer)
+    client = BTCPClientSocket(window, TIMEOUT, _CountingLayer)
+
+    def receive():
+        server.accept()
+        if delta:
+            receive_delta(server, destination, destination)
+        else:
+            receive_file(server, destination)
+    reader = threading.Thread(target=receive)
+    reader.start()
+    start = time.time()
+    if delta:
+        if send_delta(client, new) is not None:
+            client.shutdown()
+    elif client.connect():
+        send_file(client, new)
+        client.shutdown()
+    reader.join()
+    seconds = time.time() - start
+    client.close()
+    server.close()
+    return (seconds if _same_file(new, destination) else None), _CountingLayer.sent
+
+
+def bench_delta(args):
+    """Wall time and bytes on the wire (all segments, both directions) to
+    bring the receiver's copy of a file up to date after 1% of it changed,
+    as a delta against that copy versus sending the whole file.
+
+        python3 benchmark.py delta -s 134217728
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        old = os.path.join(directory, "old")
+        new = os.path.join(directory, "new")
+        destination = os.path.join(directory, "destination")
+        _write_input(old, args.size)
+        _write_changed(old, new, 0.01)
+        for name, delta in (("delta", True), ("whole file", False)):
+            seconds, sent = _run_delta(old, new, destination, args.window, delta)
+            report("{}, {:.2f} MiB on the wire".format(name, sent / (1024 * 1024)),
+                   args.size, seconds)
+
+
+def _log_lines(size):
+    """size bytes of CSV access log lines, about as compressible as real
+    logs."""
+    generator = random.Random(size)
+    paths = ["/api/v1/users", "/api/v1/orders", "/static/app.js", "/health", "/login"]
+    lines = []
+    length = 0
+    while length < size:
+        line = "2026-10-{:02d}T{:02d}:{:02d}:{:02d}Z,10.0.{}.{},GET,{}/{},{},{}\n".format(
+            generator.randrange(1, 32), generator.randrange(24), generator.randrange(60),
+            generator.randrange(60), generator.randrange(4), generator.randrange(256),
+            generator.choice(paths), generator.randrange(10000),
+            generator.choice((200, 200, 200, 304, 404)), generator.randrange(100000))
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def bench_compression(args):
+    """Goodput (application bytes per second) over the loopback layer with
+    and without negotiated compression at several zlib levels, for log lines
+    and for random data. Random data should go through uncompressed, at
+    about the speed of an uncompressed connection.
+    """
+    for kind, data in (("logs", _log_lines(args.size)),
+                       ("random", random.Random(0).randbytes(args.size))):
+        for level in (None, 1, 6, 9):
+            name = "{}, {}".format(kind, "uncompressed" if level is None
+                                   else "zlib level {}".format(level))
+            report(name, len(data), run_engine(LoopbackLayer, data, args.window,
+                                               compression=level))
+
+
+def bench_mss(args):
+    """Throughput over UDP on the loopback interface with the default 1008
+    byte payloads versus larger negotiated ones, asked for outright and found
+    by probing. Larger segments mean fewer system calls and segments to
+    handle per byte.
+    """
+    data = random.Random(0).randbytes(args.size)
+    for name, options in (("payload 1008", {}),
+                          ("payload 8 KiB", {"max_payload": 8192}),
+                          ("payload 16 KiB", {"max_payload": 16384}),
+                          ("payload 64 KiB (MAX_PAYLOAD_SIZE)", {"max_payload": MAX_PAYLOAD_SIZE}),
+                          ("payload up to 64 KiB, probed",
+                           {"max_payload": MAX_PAYLOAD_SIZE, "probe": True})):
+        report(name, args.size, run_engine(LossyLayer, data, args.window, **options))
+
+
+BENCHMARKS = {
+    "checksum": bench_checksum,
+    "compression": bench_compression,
+    "connections": bench_connections,
+    "corruption": bench_corruption,
+    "delta": bench_delta,
+    "fec": bench_fec,
+    "files": bench_files,
+    "io": bench_io,
+    "loopback": bench_loopback,
+    "mapped": bench_mapped,
+    "mss": bench_mss,
+    "nagle": bench_nagle,
+    "nak": bench_nak,
+    "pacing": bench_pacing,
+    "requests": bench_requests,
+    "resume": bench_resume,
+    "shm": bench_shm,
+    "stripes": bench_stripes,
+    "tlp": bench_tlp,
+    "workers": bench_workers,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bTCP benchmarks")
+    parser.add_argument("benchmarks", nargs="*",
+                        help="Benchmarks to run: {}".format(", ".join(BENCHMARKS)))
+    parser.add_argument("-w", "--window",
+                        help="Define bTCP window size used",
+                        type=int, default=100)
+    parser.add_argument("-s", "--size",
+                        help="Number of bytes to transfer",
+                        type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    for name in args.benchmarks or BENCHMARKS:
+        print("== {} ==".format(name))
+        BENCHMARKS[name](args)
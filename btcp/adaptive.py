@@ -0,0 +1,63 @@
+"""
+Payload size adaptation under bit errors.
+
+A single flipped bit makes a whole segment fail its checksum, so the more
+data a segment carries, the more likely it is to be thrown away: at a bit
+error rate b, a segment of s bytes survives with probability (1 - b)^(8s).
+Smaller segments survive more often, but spend more of the link on headers.
+
+Both ends count the segments that fail their checksum and report the count
+(modulo 2^16) in the length field of every pure ACK. Data segments carrying
+an ACK need the length field for their data, so a failure is reported in a
+pure ACK right away. A sender with adaptive set compares the count to the
+number of segments it sent (ACKs included, as the peer counts those too),
+every ADAPT_INTERVAL segments, to estimate the fraction of segments
+corrupted; from that and the average size of those segments follows the bit
+error rate, and from that the payload size with the best goodput
+(best_payload). Adapted segments aren't padded, and neither are the ACKs of
+either end once one adapts: padded to a full segment, an ACK for every small
+segment would take as much of the way back as the data takes of the way
+there.
+
+What limits goodput decides what a segment costs. A sender limited by the
+link pays for its bytes, so every segment also costs its headers: smaller
+segments lose less to corruption but more to headers. A sender limited by
+its window (a number of segments, not bytes) pays a window slot per
+segment, whatever its size, and wants the most intact data per segment.
+"""
+
+
+import math
+from btcp.constants import *
+
+
+# UDP and IPv4 headers, spent on every segment besides the bTCP header.
+UDP_OVERHEAD = 28
+MIN_PAYLOAD = 64
+ADAPT_INTERVAL = 32
+# Weight of the corruption rate of the latest interval in the estimate.
+CORRUPTION_GAIN = 1 / 4
+
+
+def best_payload(corruption, segment_size, overhead, limit):
+    """The payload size (at least MIN_PAYLOAD, at most limit) with the best
+    goodput, when a fraction corruption of segments of segment_size bytes
+    fails its checksum and every segment costs overhead bytes besides its
+    payload, or a window slot if overhead is None.
+
+    Goodput is proportional to P / (P + H) * (1 - b)^(8P) for payload P and
+    overhead H (the headers get corrupted too, whatever P is). With c =
+    -8 ln(1 - b) = -ln(1 - corruption) / segment_size, its maximum is where
+    1 / P - 1 / (P + H) = c, the positive root of c P^2 + c H P - H. Per
+    window slot, goodput is P (1 - b)^(8P), at its maximum at P = 1 / c.
+    """
+    if corruption <= 0:
+        return limit
+    if corruption >= 1:
+        return MIN_PAYLOAD
+    c = -math.log1p(-corruption) / segment_size
+    if overhead is None:
+        size = 1 / c
+    else:
+        size = (-overhead + math.sqrt(overhead * overhead + 4 * overhead / c)) / 2
+    return max(MIN_PAYLOAD, min(limit, int(size)))
@@ -0,0 +1,312 @@
+"""
+asyncio interface to bTCP.
+
+AsyncBTCPClientSocket and AsyncBTCPServerSocket run the state machines of
+BTCPClientSocket and BTCPServerSocket on an asyncio event loop instead of in a
+network thread: the UDP socket is a datagram endpoint created with
+loop.create_datagram_endpoint, segments are handed to the state machine from
+datagram_received, and retransmission timers are scheduled with loop.call_at
+at the socket's next timeout instead of polling every TIMER_TICK ms.
+
+    server = AsyncBTCPServerSocket(window, timeout)
+    await server.accept()
+    async for chunk in server:
+        ...
+
+    client = AsyncBTCPClientSocket(window, timeout)
+    await client.connect()
+    await client.send(data)
+    await client.shutdown()
+"""
+
+
+import asyncio
+import functools
+import queue
+from btcp.btcp_socket import BTCPStates
+from btcp.client_socket import BTCPClientSocket
+from btcp.server_socket import BTCPServerSocket
+from btcp.constants import *
+
+
+class AsyncioClock:
+    """Clock of an asyncio event loop.
+
+    Only time() is offered: on the event loop, waiting is done by awaiting,
+    never by blocking, so the blocking methods of the sockets can't be used.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+
+
+    def time(self):
+        return self._loop.time()
+
+
+class BTCPDatagramProtocol(asyncio.DatagramProtocol):
+    """Runs the state machine of a bTCP socket on the event loop.
+
+    Every datagram is passed to lossy_layer_segment_received, after which
+    lossy_layer_tick gets called, so the socket can act on the new state right
+    away. lossy_layer_tick is also called at the socket's next_timeout, and
+    soon after kick is called. Coroutines wait for the state of the socket to
+    change by awaiting changed().
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.transport = None
+        self.btcp_socket = None
+        self._timer = None
+        self._kicked = False
+        self._waiters = []
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+
+    def datagram_received(self, data, addr):
+        if self.btcp_socket is not None:
+            self.btcp_socket.lossy_layer_segment_received(data, addr)
+            self.tick()
+
+
+    def error_received(self, exc):
+        # E.g. ICMP port unreachable while the peer is not up yet. The network
+        # is allowed to lose segments; retransmission deals with it.
+        pass
+
+
+    def connection_lost(self, exc):
+        self._cancel_timer()
+        self._wake()
+
+
+    def tick(self):
+        """Call lossy_layer_tick, re-arm the timer and wake up waiters."""
+        if self.btcp_socket is None:
+            return
+        self.btcp_socket.lossy_layer_tick()
+        self._schedule_timer()
+        self._wake()
+
+
+    def kick(self):
+        """Have tick called soon, e.g. because the application buffered data."""
+        if not self._kicked:
+            self._kicked = True
+            self._loop.call_soon(self._on_kick)
+
+
+    def _on_kick(self):
+        self._kicked = False
+        self.tick()
+
+
+    def _schedule_timer(self):
+        when = self.btcp_socket.next_timeout() if self.btcp_socket is not None else None
+        if self._timer is not None and self._timer.when() == when:
+            return
+        self._cancel_timer()
+        if when is not None:
+            self._timer = self._loop.call_at(when, self._on_timer)
+
+
+    def _on_timer(self):
+        self._timer = None
+        self.tick()
+
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+
+
+    async def changed(self):
+        """Wait until the next time the state of the socket may have changed."""
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        await waiter
+
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class AsyncioLayer:
+    """Lossy layer on the transport of an existing BTCPDatagramProtocol.
+
+    Constructed by the bTCP socket like any other lossy layer (use
+    functools.partial to bind the protocol); the datagram endpoint has to be
+    created before that, because creating it has to be awaited.
+    """
+
+    def __init__(self, protocol, btcp_socket, local_ip, local_port, remote_ip=None, remote_port=None):
+        self._protocol = protocol
+        self._remote = (remote_ip, remote_port)
+        self._protocol.btcp_socket = btcp_socket
+
+
+    def destroy(self):
+        """Close the datagram endpoint. Safe to call multiple times."""
+        if self._protocol is not None:
+            self._protocol.btcp_socket = None
+            if self._protocol.transport is not None:
+                self._protocol.transport.close()
+        self._protocol = None
+
+
+    def send_segment(self, segment):
+        self.send_segment_to(segment, self._remote)
+
+
+    def send_segment_to(self, segment, address):
+        if self._protocol is not None and self._protocol.transport is not None:
+            self._protocol.transport.sendto(segment, address)
+
+
+async def _open(socket_class, window, timeout, local_addr):
+    """Create a datagram endpoint at local_addr and a bTCP socket of
+    socket_class running on it."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: BTCPDatagramProtocol(loop), local_addr=local_addr)
+    btcp_socket = socket_class(window, timeout, functools.partial(AsyncioLayer, protocol),
+                               AsyncioClock(loop))
+    return btcp_socket, protocol
+
+
+class AsyncBTCPClientSocket:
+    """asyncio version of BTCPClientSocket: connect, send and shutdown are
+    coroutines. window and timeout (in ms) mean the same as for
+    BTCPClientSocket.
+    """
+
+    def __init__(self, window, timeout):
+        self._window = window
+        self._timeout = timeout
+        self._socket = None
+        self._protocol = None
+
+
+    async def connect(self):
+        """Perform the three-way handshake. Returns whether it succeeded."""
+        self._socket, self._protocol = await _open(BTCPClientSocket, self._window,
+                                                   self._timeout, (CLIENT_IP, CLIENT_PORT))
+        if not self._socket._start_connect():
+            return False
+        self._protocol.tick()
+        while self._socket._state == BTCPStates.SYN_SENT:
+            await self._protocol.changed()
+        return self._socket._state == BTCPStates.ESTABLISHED
+
+
+    def write(self, data):
+        """Buffer as much of data as fits without waiting and return the
+        number of bytes buffered, like BTCPClientSocket.send.
+        """
+        sent_bytes = self._socket.send(data)
+        if sent_bytes:
+            self._protocol.kick()
+        return sent_bytes
+
+
+    async def drain(self):
+        """Wait until there is room in the send buffer again."""
+        while self._socket._sendbuf.full() and self._socket._state == BTCPStates.ESTABLISHED:
+            await self._protocol.changed()
+
+
+    async def send(self, data):
+        """Buffer all of data for sending, waiting for room in the send buffer
+        whenever it is full. Returns the number of bytes buffered, which is
+        less than len(data) only if the connection went down.
+        """
+        view = memoryview(data)
+        sent_bytes = 0
+        while sent_bytes < len(data) and self._socket._state == BTCPStates.ESTABLISHED:
+            sent_bytes += self.write(view[sent_bytes:])
+            if sent_bytes < len(data):
+                await self.drain()
+        return sent_bytes
+
+
+    async def shutdown(self):
+        """Send the FIN once all data has been acknowledged and wait for the
+        termination to finish. Returns whether the connection is closed.
+        """
+        self._socket._start_shutdown()
+        self._protocol.kick()
+        while self._socket._state in (BTCPStates.ESTABLISHED, BTCPStates.FIN_SENT):
+            await self._protocol.changed()
+        return self._socket._state == BTCPStates.CLOSED
+
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+
+
+class AsyncBTCPServerSocket:
+    """asyncio version of BTCPServerSocket: accept and recv are coroutines,
+    and the socket can be iterated over with async for to get the received
+    data chunk by chunk until the client disconnects.
+    """
+
+    def __init__(self, window, timeout):
+        self._window = window
+        self._timeout = timeout
+        self._socket = None
+        self._protocol = None
+
+
+    async def accept(self):
+        """Wait for a client to complete the three-way handshake."""
+        if self._socket is None:
+            self._socket, self._protocol = await _open(BTCPServerSocket, self._window,
+                                                       self._timeout, (SERVER_IP, SERVER_PORT))
+        while self._socket._state in (BTCPStates.ACCEPTING, BTCPStates.SYN_RCVD):
+            await self._protocol.changed()
+        return True
+
+
+    async def recv(self):
+        """Return all data received so far, waiting for at least some to
+        arrive. Returns b'' once the client has disconnected.
+        """
+        while True:
+            data = bytearray()
+            try:
+                while True:
+                    data.extend(self._socket._recvbuf.get_nowait())
+            except queue.Empty:
+                pass
+            if data:
+                return bytes(data)
+            if self._socket._state in (BTCPStates.CLOSING, BTCPStates.CLOSED):
+                return b''
+            await self._protocol.changed()
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        data = await self.recv()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
@@ -1,5 +1,22 @@
+import collections
+import queue
 import struct
+import zlib
 from enum import Enum
+from random import getrandbits
+from btcp.adaptive import ADAPT_INTERVAL, CORRUPTION_GAIN, UDP_OVERHEAD, best_payload
+from btcp.fec import FEC_BLOCK, LOSS_GAIN, group_size, pack_group, payload_value
+from btcp.pacing import PACING_BURST, PACING_GAIN, TokenBucket, process_bucket
+from btcp.constants import *
+
+
+TRAILER = struct.Struct("!I")
+# Number of sequence numbers in the payload of a NAK.
+NAK = struct.Struct("!H")
+# Checksums computed over the whole segment but the trailer, by algorithm.
+TRAILER_CHECKSUMS = {CRC32_CHECKSUM: zlib.crc32, ADLER32_CHECKSUM: zlib.adler32}
+# Zero padding for segments, sliced instead of allocated every time.
+PADDING = memoryview(bytes(MAX_PAYLOAD_SIZE))
 
 
 class BTCPStates(Enum):
@@ -23,12 +40,115 @@ class BTCPStates(Enum):
     
 class BTCPSocket:
     """Base class for bTCP client and server sockets. Contains static helper
-    methods that will definitely be useful for both sending and receiving side.
+    methods that will definitely be useful for both sending and receiving side,
+    and the sending side itself: a connection carries data both ways, and
+    both ends send theirs the same way.
     """
     def __init__(self, window, timeout):
         self._window = window
         self._timeout = timeout
 
+        # The data buffer used by send() to send data from the application
+        # thread into the network thread. Bounded in size.
+        self._sendbuf = queue.Queue(maxsize=1000)
+        # Data taken from the send buffer but not sent yet: small writes
+        # being gathered into a full chunk, or what is left of a chunk that
+        # was cut to a smaller chunk size. The sequence number of the last
+        # segment sent short, and with nodelay, small writes are sent right
+        # away instead of waiting for each other (see _coalesce); _shutdown
+        # once the application is done sending, so they don't wait at all.
+        self._rest = b''
+        self._short_seqnum = -1
+        self.nodelay = False
+        self._shutdown = False
+
+        # Segments sent but not yet acknowledged, oldest first, as the parts
+        # build_segment_parts returns (so their data isn't copied), and when
+        # each was sent (None once it has been sent again). Only touched by
+        # the network thread (and by connect before the handshake).
+        self._unacked = collections.deque()
+        self._send_times = collections.deque()
+
+        # Sequence numbers are kept unbounded; only the wire format wraps.
+        self._isn = getrandbits(16)
+        self._base = self._isn + 1
+        self._next_seqnum = self._isn + 1
+        self._dupacks = 0
+        self._retransmit_deadline = None
+        self.retransmissions = 0
+        # Bytes of data (as buffered, so compressed on a compressed
+        # connection) the peer acknowledged so far.
+        self.bytes_acknowledged = 0
+
+        # Checksum algorithm of the segments we send, the payload size
+        # (trailer included) of our data segments, and how much data goes
+        # in them.
+        self._checksum = INTERNET_CHECKSUM
+        self._segment_payload = PAYLOAD_SIZE
+        self._payload_size = PAYLOAD_SIZE
+
+        # Forward error correction: whether to send parity segments, the
+        # (sequence number, payload) of the data segments of the current
+        # block, losses noticed since the last block, and the estimated loss
+        # rate the number of parity segments per block follows.
+        self.fec = False
+        self._fec_block = []
+        self._losses = 0
+        self.loss_estimate = 0.0
+        self.parity_sent = 0
+
+        # Payload size adaptation: whether to adapt, whether the peer sends
+        # unpadded data (so ours needn't be padded either), the last checksum
+        # failure count the peer reported, the segments (and bytes) sent and
+        # failures reported since the last adaptation, whether the window ran
+        # full in that time, moving averages of the segments sent and failures
+        # reported per interval, and the estimated fraction of segments
+        # corrupted on the way.
+        self.adaptive = False
+        self._peer_unpadded = False
+        self._window_limited = False
+        self._failures_reported = 0
+        self._interval_segments = 0
+        self._interval_bytes = 0
+        self._interval_failures = 0
+        self._average_segments = 0.0
+        self._average_failures = 0.0
+        self.corruption_estimate = 0.0
+
+        # The other way around: segments that failed their checksum here,
+        # reported to the peer in the length field of every pure ACK (see
+        # btcp/adaptive.py), whether to send NAKs, and when each (unbounded)
+        # sequence number was last named in one.
+        self.checksum_failures = 0
+        self.naks = True
+        self._naked = {}
+        self.naks_sent = 0
+        self.naks_received = 0
+
+        # Smoothed round trip time, measured on segments sent once, and tail
+        # loss probing: when no ACK arrives for TLP_FACTOR round trips, the
+        # last segment sent is sent again, so a lost tail gets noticed
+        # without waiting for the timeout. Once the peer sent data too, it
+        # may delay its ACKs (see _acknowledge).
+        self.srtt = None
+        self.tail_loss_probe = True
+        self._tlp_deadline = None
+        self.tail_probes = 0
+        self._two_way = False
+
+        # Pacing: whether to spread the window over the round trip time, a
+        # hard limit in bytes per second for this connection (None for
+        # none), the token buckets segments go through, when they let the
+        # next one go if they are holding it back, and the index in _unacked
+        # of the next segment to send again after a timeout.
+        self.pacing = True
+        self.rate_limit = None
+        self._pacer = None
+        self._limiter = None
+        self._buckets = []
+        self._pace_deadline = None
+        self._resend = None
+
 
     @staticmethod
     def in_cksum(segment):
@@ -68,7 +188,7 @@ class BTCPSocket:
 
         #invert the checksum if it is not equal to 0xFFFF
         if (cksum != 0xFFFF):
-            cksum = cksum.invert()
+            cksum = ~cksum & 0xFFFF
 
         return cksum
         
@@ -76,10 +196,32 @@ class BTCPSocket:
         #raise NotImplementedError("No implementation of in_cksum present. Read the comments & code of btcp_socket.py.")
 
 
+    @staticmethod
+    def in_cksum_parts(*parts):
+        """Compute the same checksum as in_cksum over the concatenation of
+        parts, without concatenating them, so parts can be memoryviews into a
+        larger buffer. Every part but the last must have an even length.
+        """
+        if not any(parts):
+            return 0x0000
+        cksum = 0
+        for part in parts:
+            words = len(part) // 2
+            cksum += sum(struct.unpack_from("!{}H".format(words), part))
+            if len(part) % 2:
+                cksum += part[-1] << 8
+        while cksum > 0xFFFF:
+            cksum = (cksum & 0xFFFF) + (cksum >> 16)
+        if cksum != 0xFFFF:
+            cksum = ~cksum & 0xFFFF
+        return cksum
+
+
     @staticmethod
     def build_segment_header(seqnum, acknum,
                              syn_set=False, ack_set=False, fin_set=False,
-                             window=0x01, length=0, checksum=0):
+                             window=0x01, length=0, checksum=0, compress_set=False,
+                             parity_set=False, algorithm=INTERNET_CHECKSUM, nak_set=False):
         """Pack the method arguments into a valid bTCP header using struct.pack
 
         This method is given because historically students had a lot of trouble
@@ -100,7 +242,8 @@ class BTCPSocket:
         you don't have to always set all flags explicitly true/false, or give
         a checksum of 0 when creating the header for checksum computation.
         """
-        flag_byte = syn_set << 2 | ack_set << 1 | fin_set
+        flag_byte = (nak_set << 7 | algorithm | parity_set << 4 | compress_set << 3
+                     | syn_set << 2 | ack_set << 1 | fin_set)
         return struct.pack("!HHBBHH",
                            seqnum, acknum, flag_byte, window, length, checksum)
 
@@ -122,3 +265,538 @@ class BTCPSocket:
         
         #pass
         #raise NotImplementedError("No implementation of unpack_segment_header present. Read the comments & code of btcp_socket.py. You should really implement the packing / unpacking of the header into field values before doing anything else!")
+
+
+    @staticmethod
+    def build_segment(seqnum, acknum,
+                      syn_set=False, ack_set=False, fin_set=False,
+                      window=0x01, data=b'', compress_set=False, parity_set=False,
+                      length=None, algorithm=INTERNET_CHECKSUM, payload_size=PAYLOAD_SIZE,
+                      nak_set=False):
+        """Build a complete segment: header with checksum, followed by data
+        padded with zeroes to payload_size bytes. Data longer than that (on a
+        connection that negotiated a larger payload size) isn't padded.
+        length, if given, goes into the length field instead of the length of
+        data.
+
+        With an algorithm other than INTERNET_CHECKSUM, the data is padded to
+        BTCPSocket.payload_size(algorithm, payload_size) bytes and followed by
+        the trailer instead.
+        """
+        return b''.join(BTCPSocket.build_segment_parts(
+            seqnum, acknum, syn_set, ack_set, fin_set, window, data, compress_set, parity_set,
+            length, algorithm, payload_size, nak_set))
+
+
+    @staticmethod
+    def build_segment_parts(seqnum, acknum,
+                            syn_set=False, ack_set=False, fin_set=False,
+                            window=0x01, data=b'', compress_set=False, parity_set=False,
+                            length=None, algorithm=INTERNET_CHECKSUM, payload_size=PAYLOAD_SIZE,
+                            nak_set=False):
+        """The segment build_segment builds, as a tuple of buffers to be sent
+        as one datagram: the header, data itself (not a copy, so it can be a
+        memoryview of a larger buffer), the zero padding and the trailer, if
+        any. The checksum is computed over the parts in place.
+        """
+        datalen = len(data)
+        if length is None:
+            length = datalen
+        if algorithm != INTERNET_CHECKSUM:
+            header = BTCPSocket.build_segment_header(seqnum, acknum, syn_set, ack_set, fin_set,
+                                                     window, length, 0, compress_set,
+                                                     parity_set, algorithm, nak_set)
+            padding = PADDING[:max(0, payload_size - TRAILER_SIZE - datalen)]
+            function = TRAILER_CHECKSUMS[algorithm]
+            value = function(padding, function(data, function(header)))
+            return header, data, padding, TRAILER.pack(value)
+        header = BTCPSocket.build_segment_header(seqnum, acknum, syn_set, ack_set, fin_set,
+                                                 window, length, 0, compress_set, parity_set,
+                                                 nak_set=nak_set)
+        # The zero padding doesn't change the checksum.
+        checksum = BTCPSocket.in_cksum_parts(header, data)
+        return (BTCPSocket.build_segment_header(seqnum, acknum, syn_set, ack_set, fin_set,
+                                                window, length, checksum, compress_set,
+                                                parity_set, nak_set=nak_set),
+                data, PADDING[:max(0, payload_size - datalen)])
+
+
+    @staticmethod
+    def payload_size(algorithm, size=PAYLOAD_SIZE):
+        """How much data a segment with a payload of size bytes, checksummed
+        with algorithm, can carry."""
+        return size if algorithm == INTERNET_CHECKSUM else size - TRAILER_SIZE
+
+
+    def _max_segment_size(self):
+        """Largest segment the lossy layer can carry."""
+        return getattr(self._lossy_layer, "max_segment_size", MAX_SEGMENT_SIZE)
+
+
+    def _set_segment_size(self, size):
+        """Tell the lossy layer the largest segment to expect, if it needs to
+        know (to size its receive buffers)."""
+        resize = getattr(self._lossy_layer, "set_segment_size", None)
+        if resize is not None:
+            resize(size)
+
+
+    def sendall(self, data):
+        """Send all of data, blocking while the send buffer is full. Unlike
+        send, this doesn't return until everything is buffered, or the
+        connection went down; returns the number of bytes buffered, which is
+        less than len(data) only in the latter case.
+        """
+        view = memoryview(data).cast("B")
+        sent_bytes = 0
+        while sent_bytes < len(view) and self._state == BTCPStates.ESTABLISHED:
+            sent_bytes += self.send(view[sent_bytes:])
+            if sent_bytes < len(view):
+                # Room is made by the network thread, as ACKs come in.
+                self._clock.sleep(0.001)
+        return sent_bytes
+
+
+    def _send_parts(self, parts):
+        """Send the segment made of the buffers parts. Lossy layers that can
+        send it without joining the parts first (scatter I/O) get them as
+        they are."""
+        send_parts = getattr(self._lossy_layer, "send_segment_parts", None)
+        if send_parts is not None:
+            send_parts(parts)
+        else:
+            self._lossy_layer.send_segment(b''.join(parts))
+
+
+    def _kick(self):
+        """Have the network thread call lossy_layer_tick right away, if the
+        lossy layer can be kicked; otherwise it happens on the next tick."""
+        kick = getattr(self._lossy_layer, "kick", None)
+        if kick is not None:
+            kick()
+
+
+    def _schedule(self, deadline):
+        """Tell the lossy layer lossy_layer_tick is due by deadline, if it
+        wants to know; most ask next_timeout instead."""
+        schedule = getattr(self._lossy_layer, "schedule", None)
+        if schedule is not None:
+            schedule(deadline)
+
+
+    def _acknowledge(self):
+        """Acknowledge data that arrived in order: right away, or on a
+        connection this socket sends data on too, within ACK_DELAY, unless a
+        data segment going the other way carries the ACK first."""
+        self._acks_owed += 1
+        if self.delayed_ack and self._next_seqnum > self._isn + 1 and self._acks_owed < 2:
+            if self._ack_deadline is None:
+                self._ack_deadline = self._clock.time() + ACK_DELAY
+                self._schedule(self._ack_deadline)
+            return
+        self._send_ack()
+
+
+    def _ack_sent(self):
+        """Everything that arrived has just been acknowledged, by an ACK or
+        by a data segment."""
+        self._acks_owed = 0
+        self._ack_deadline = None
+
+
+    def _coalesce(self, size, flush=False):
+        """Gather what send buffered into _rest, up to size bytes, and return
+        whether the next chunk may be sent. Small writes go out together:
+        while a chunk shorter than size waits for its ACK, whose arrival will
+        send it anyway, the next short one is held back for more to join it
+        (Nagle's algorithm, in Minshall's variant, so the short end of a large
+        write doesn't wait for the rest of it), unless nodelay or flush is
+        set."""
+        rest = self._rest
+        while len(rest) < size:
+            try:
+                chunk = self._sendbuf.get_nowait()
+            except queue.Empty:
+                break
+            # Chunks can be memoryviews, which don't concatenate.
+            rest = b''.join((rest, chunk)) if rest else chunk
+        self._rest = rest
+        if not rest:
+            return False
+        return (len(rest) >= size or self._short_seqnum < self._base
+                or self.nodelay or flush)
+
+
+    def _next_chunk(self, size):
+        """Take the next chunk to send, at most size bytes, from what
+        _coalesce gathered; it goes in the segment numbered _next_seqnum."""
+        chunk = self._rest[:size]
+        self._rest = self._rest[size:]
+        if len(chunk) < size:
+            self._short_seqnum = self._next_seqnum
+        return chunk
+
+
+    def _buffer(self, data):
+        """Put data into the send buffer in chunks of as much as a segment
+        carries, for as long as there is room. Returns the number of bytes
+        buffered."""
+        # Example with a finite buffer: a queue with at most 1000 chunks,
+        # for a maximum of 985KiB data buffered to get turned into packets.
+        view = memoryview(data)
+        datalen = len(view)
+        sent_bytes = 0
+        while sent_bytes < datalen:
+            # Loop over data using sent_bytes. Reassignments to data are too
+            # expensive when data is large. Read-only data (bytes, a file
+            # mapped read-only) can't change under us, so chunks of it are
+            # kept as views; anything else is copied.
+            chunk = view[sent_bytes:sent_bytes+self._payload_size]
+            if not view.readonly:
+                chunk = bytes(chunk)
+            try:
+                self._sendbuf.put_nowait(chunk)
+                sent_bytes += len(chunk)
+            except queue.Full:
+                break
+        if sent_bytes and len(self._unacked) < self._window:
+            # The window has room, so no ACK may come to clock this out.
+            self._kick()
+        return sent_bytes
+
+
+    def _handle_ack(self, acknum, duplicate=False):
+        """Register the cumulative acknowledgement acknum (unbounded) of our
+        data. With duplicate, the same acknum three times over means the
+        oldest segment got lost; not so for the acknum of the peer's data
+        segments, which repeat it for as long as we don't send."""
+        if self._base < acknum <= self._next_seqnum:
+            if self._resend is not None:
+                self._resend -= min(self._resend, acknum - self._base)
+            while self._base < acknum:
+                self.bytes_acknowledged += len(self._unacked.popleft()[1])
+                sent = self._send_times.popleft()
+                self._base += 1
+            if self._resend is not None and self._resend >= len(self._unacked):
+                self._resend = None
+            if sent is not None:
+                sample = self._clock.time() - sent
+                self.srtt = sample if self.srtt is None else self.srtt + (sample - self.srtt) / 8
+            self._dupacks = 0
+            self._retransmit_deadline = None
+            if self._unacked:
+                self._restart_timer()
+            self._arm_tail_probe()
+        elif duplicate and acknum == self._base and self._unacked:
+            self._dupacks += 1
+            if self._dupacks == 3:
+                # Fast retransmit of the oldest unacknowledged segment.
+                self._losses += 1
+                self._retransmit(0)
+
+
+    def _retransmit(self, index):
+        """Send the index-th unacknowledged segment again. Its ACK says
+        nothing about the round trip time any more."""
+        self.retransmissions += 1
+        self._send_times[index] = None
+        self._transmit(self._unacked[index])
+
+
+    def _restart_timer(self):
+        self._retransmit_deadline = self._clock.time() + self._timeout / 1000
+        self._schedule(self._retransmit_deadline)
+
+
+    def _arm_tail_probe(self):
+        """(Re)start the tail loss probe timer while segments are
+        outstanding: TLP_FACTOR round trips from now, plus ACK_DELAY once the
+        peer sends data and may delay its ACKs, if that comes before the
+        retransmission timeout."""
+        self._tlp_deadline = None
+        if self.tail_loss_probe and self._unacked and self.srtt is not None:
+            deadline = self._clock.time() + TLP_FACTOR * self.srtt
+            if self._two_way:
+                deadline += ACK_DELAY
+            if self._retransmit_deadline is None or deadline < self._retransmit_deadline:
+                self._tlp_deadline = deadline
+                self._schedule(deadline)
+
+
+    def _handle_send_timers(self):
+        """Go back N when the oldest segment wasn't acknowledged in time (the
+        window is sent again by _send_new_data, paced), or probe with the
+        last segment when no ACK arrived for a while, whose ACK (or NAK) tells
+        what got lost; once, until an ACK arrives."""
+        now = self._clock.time()
+        if self._retransmit_deadline is not None and now >= self._retransmit_deadline:
+            self._retransmit_deadline = self._tlp_deadline = None
+            if self._state == BTCPStates.ESTABLISHED and self._unacked:
+                self._losses += 1
+                self._resend = 0
+                self._restart_timer()
+        elif self._tlp_deadline is not None and now >= self._tlp_deadline:
+            self._tlp_deadline = None
+            if self._state == BTCPStates.ESTABLISHED and self._unacked:
+                self.tail_probes += 1
+                self._retransmit(-1)
+
+
+    def _handle_nak(self, payload):
+        """Send the segments a NAK names again right away, instead of waiting
+        for duplicate ACKs or the timeout."""
+        self.naks_received += 1
+        count, = NAK.unpack_from(payload)
+        count = min(count, (len(payload) - NAK.size) // 2)
+        for seqnum in struct.unpack_from("!{}H".format(count), payload, NAK.size):
+            seqnum = self.unwrap_seqnum(seqnum, self._base)
+            if self._base <= seqnum < self._next_seqnum:
+                self._losses += 1
+                self._retransmit(seqnum - self._base)
+                if seqnum == self._base:
+                    # Already done: don't fast retransmit it on duplicate ACKs.
+                    self._dupacks = max(self._dupacks, 3)
+
+
+    def _count_failures(self, failures):
+        """Register the number of segments that failed their checksum at the
+        peer, as reported in the length field of a pure ACK, and adapt the
+        payload size every ADAPT_INTERVAL segments sent."""
+        self._interval_failures += (failures - self._failures_reported) & 0xFFFF
+        self._failures_reported = failures
+        if self._interval_segments < ADAPT_INTERVAL:
+            return
+        # Failures are reported a round trip after their segments were sent,
+        # so a single interval can count more failures than it sent segments:
+        # average both before dividing, rather than averaging the ratios.
+        self._average_segments += CORRUPTION_GAIN * (self._interval_segments
+                                                     - self._average_segments)
+        self._average_failures += CORRUPTION_GAIN * (self._interval_failures
+                                                     - self._average_failures)
+        self.corruption_estimate = min(1.0, self._average_failures / self._average_segments)
+        if self.adaptive:
+            limit = self.payload_size(self._checksum, self._segment_payload)
+            overhead = UDP_OVERHEAD + HEADER_SIZE + limit - self._segment_payload
+            self._payload_size = best_payload(self.corruption_estimate,
+                                              self._interval_bytes / self._interval_segments,
+                                              None if self._window_limited else overhead, limit)
+        self._interval_segments = self._interval_bytes = self._interval_failures = 0
+        self._window_limited = False
+
+
+    @property
+    def chunk_size(self):
+        """How much data goes into each new segment: what the segments of the
+        connection carry, or less if adaptive shrunk it."""
+        return self._payload_size
+
+
+    def _count_sent(self, size):
+        """Count a segment of size bytes sent for adaptation. The peer
+        reports the failures of every segment, ACKs included, so all of them
+        count."""
+        self._interval_segments += 1
+        self._interval_bytes += size
+
+
+    def _control_padding(self):
+        """The payload size to pad segments without data to: none if
+        either end adapts its payload size (see btcp/adaptive.py), the fixed
+        payload size otherwise."""
+        return 0 if self.adaptive or self._peer_unpadded else PAYLOAD_SIZE
+
+
+    def _transmit(self, segment):
+        """Send a data or parity segment, given as the parts
+        build_segment_parts returns, counting it for adaptation and taking its
+        size from the token buckets."""
+        size = sum(map(len, segment))
+        self._count_sent(size)
+        now = self._clock.time()
+        for bucket in self._buckets:
+            bucket.spend(now, size)
+        self._send_parts(segment)
+
+
+    def _update_buckets(self):
+        """Bring the token buckets in line with the round trip time and the
+        rate limits."""
+        segment = HEADER_SIZE + self._segment_payload
+        self._buckets = []
+        if self.pacing and self.srtt:
+            rate = PACING_GAIN * self._window * segment / self.srtt
+            if self._pacer is None:
+                self._pacer = TokenBucket(rate, PACING_BURST * segment)
+            self._pacer.rate = rate
+            self._buckets.append(self._pacer)
+        if self.rate_limit:
+            if self._limiter is None:
+                self._limiter = TokenBucket(self.rate_limit, PACING_BURST * segment)
+            self._limiter.rate = self.rate_limit
+            self._buckets.append(self._limiter)
+        if process_bucket() is not None:
+            self._buckets.append(process_bucket())
+
+
+    def _paced(self):
+        """Whether the token buckets let a segment go now. If not,
+        _pace_deadline is when they will."""
+        now = self._clock.time()
+        ready = max((bucket.ready_at(now) for bucket in self._buckets), default=now)
+        if ready > now:
+            self._pace_deadline = ready
+            self._schedule(ready)
+            return False
+        return True
+
+
+    def _send_new_data(self):
+        """Send the window again after a timeout, then turn buffered data
+        into segments for as long as the window has room, and keep them for
+        retransmission; both as fast as the token buckets allow.
+        """
+        self._update_buckets()
+        self._pace_deadline = None
+        while True:
+            if self._resend is not None:
+                if not self._paced():
+                    break
+                self._retransmit(self._resend)
+                self._resend += 1
+                if self._resend == len(self._unacked):
+                    self._resend = None
+                continue
+            if len(self._unacked) >= self._window:
+                self._window_limited = True
+                break
+            if not self._coalesce(self._payload_size, flush=self._shutdown):
+                break
+            if not self._paced():
+                break
+            chunk = self._next_chunk(self._payload_size)
+            # Adapted segments aren't padded: their size is the point. The
+            # acknowledgement number acknowledges the peer's data.
+            segment = self.build_segment_parts(self._next_seqnum & 0xFFFF,
+                                               self._expected & 0xFFFF,
+                                               window=self._window, data=chunk,
+                                               algorithm=self._checksum,
+                                               payload_size=0 if self.adaptive else PAYLOAD_SIZE)
+            self._ack_sent()
+            if not self._unacked:
+                self._restart_timer()
+            self._unacked.append(segment)
+            self._send_times.append(self._clock.time())
+            self._transmit(segment)
+            self._arm_tail_probe()
+            if self.fec:
+                self._fec_block.append((self._next_seqnum, chunk))
+                if len(self._fec_block) == FEC_BLOCK:
+                    self._send_parity()
+            self._next_seqnum += 1
+        # Don't hold back the parity of a partial block when there is
+        # nothing more to send for now (e.g. at the end of the data).
+        if self._fec_block and not self._coalesce(self._payload_size, flush=self._shutdown):
+            self._send_parity()
+
+
+    def _send_parity(self):
+        """Send the parity segments of the current block, and update the
+        loss estimate with the losses noticed while it was being sent."""
+        block = self._fec_block
+        self._fec_block = []
+        n = len(block)
+        k = (n + group_size(self.loss_estimate) - 1) // group_size(self.loss_estimate)
+        # The chunk size may have changed within the block. The receiver pads
+        # to the length of the parity segment, which pads the value with
+        # zeroes the same way.
+        width = max(len(chunk) for seqnum, chunk in block)
+        for j in range(k):
+            value = 0
+            length = 0
+            for seqnum, chunk in block[j::k]:
+                value ^= payload_value(chunk, width)
+                length ^= len(chunk)
+            segment = self.build_segment_parts(block[0][0] & 0xFFFF, pack_group(n, k, j),
+                                               window=self._window,
+                                               data=value.to_bytes(width, "big"),
+                                               parity_set=True, length=length,
+                                               algorithm=self._checksum)
+            self.parity_sent += 1
+            self._transmit(segment)
+        self.loss_estimate += LOSS_GAIN * (min(1.0, self._losses / n) - self.loss_estimate)
+        self._losses = 0
+
+
+    def _arrived(self, seqnum):
+        """Whether the data segment numbered seqnum (unbounded), which hasn't
+        been delivered yet, arrived."""
+        return seqnum in self._reassembly
+
+
+    def _missing(self, last):
+        """Sequence numbers up to and including last that haven't arrived,
+        leaving out those named in a NAK less than NAK_HOLDOFF of the timeout
+        ago, at most NAK_LIMIT of them."""
+        if not self.naks:
+            return []
+        now = self._clock.time()
+        holdoff = NAK_HOLDOFF * self._timeout / 1000
+        missing = []
+        for seqnum in range(self._expected, min(last + 1, self._expected + self._window)):
+            if self._arrived(seqnum) or now - self._naked.get(seqnum, -holdoff) < holdoff:
+                continue
+            missing.append(seqnum)
+            self._naked[seqnum] = now
+            if len(missing) == NAK_LIMIT:
+                break
+        if len(self._naked) > 2 * self._window:
+            self._naked = {s: t for s, t in self._naked.items() if s >= self._expected}
+        return missing
+
+
+    def _checksum_failed(self):
+        """A segment failed its checksum. Count it, and tell the peer in a
+        pure ACK right away: the count only goes in those, not in the data
+        segments carrying our ACKs. If it was data, it was most likely the
+        one after the last that arrived, so name what is missing up to
+        there."""
+        self.checksum_failures += 1
+        if self._state == BTCPStates.ESTABLISHED and self._expected is not None:
+            highest = max(self._reassembly, default=self._expected - 1)
+            self._send_ack(self._missing(highest + 1))
+
+
+    @staticmethod
+    def verify_segment(segment):
+        """Return whether segment is long enough to hold a header and its
+        checksum, of the algorithm its flags name, matches the contents.
+        """
+        if len(segment) < HEADER_SIZE:
+            return False
+        algorithm = segment[4] & CHECKSUM_MASK
+        if algorithm != INTERNET_CHECKSUM:
+            function = TRAILER_CHECKSUMS.get(algorithm)
+            if function is None or len(segment) < HEADER_SIZE + TRAILER_SIZE:
+                return False
+            end = len(segment) - TRAILER_SIZE
+            return TRAILER.unpack_from(segment, end)[0] == function(memoryview(segment)[:end])
+        # Checksummed in place, with the checksum field taken as 0, instead
+        # of on a copy of the segment with the field cleared.
+        view = memoryview(segment)
+        checksum, = struct.unpack_from("!H", view, 8)
+        return BTCPSocket.in_cksum_parts(view[:8], view[10:]) == checksum
+
+
+    @staticmethod
+    def unwrap_seqnum(seqnum, reference):
+        """Map the 16 bit sequence number seqnum from the wire onto the
+        unbounded sequence number closest to reference.
+
+        The header only has room for 16 bits, so sequence numbers wrap around
+        after 65536 segments. Keeping unbounded sequence numbers internally
+        avoids having to deal with the wrap everywhere else.
+        """
+        diff = (seqnum - reference) & 0xFFFF
+        if diff >= 0x8000:
+            diff -= 0x10000
+        return reference + diff
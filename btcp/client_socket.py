@@ -1,12 +1,19 @@
-import socket
-from btcp.btcp_socket import BTCPSocket, BTCPStates
+import queue
+import struct
+from btcp.btcp_socket import NAK, BTCPSocket, BTCPStates
+from btcp.clock import WallClock
+from btcp.compression import FRAME_SIZE, StreamCompressor
 from btcp.lossy_layer import LossyLayer
 from btcp.constants import *
 
-#our own imports
-from poster import *
-from random import getrandbits
-import queue
+
+def probe_sizes(limit):
+    """Payload sizes of the SYNs sent when probing for the largest segments
+    the path carries: PAYLOAD_SIZE, doubling up to limit."""
+    sizes = [PAYLOAD_SIZE]
+    while sizes[-1] < limit:
+        sizes.append(min(sizes[-1] * 2, limit))
+    return sizes
 
 
 class BTCPClientSocket(BTCPSocket):
@@ -34,37 +41,74 @@ class BTCPClientSocket(BTCPSocket):
     """
 
 
-    def __init__(self, window, timeout):
+    def __init__(self, window, timeout, layer=LossyLayer, clock=None,
+                 local_address=(CLIENT_IP, CLIENT_PORT), remote_address=(SERVER_IP, SERVER_PORT)):
         """Constructor for the bTCP client socket. Allocates local resources
         and starts an instance of the Lossy Layer.
 
+        window is the maximum number of unacknowledged segments in flight,
+        timeout the retransmission timeout in milliseconds.
+
+        layer selects the lossy layer implementation: LossyLayer (UDP, the
+        default) or any class with the same constructor and send_segment /
+        destroy methods, e.g. btcp.loopback_layer.LoopbackLayer when the
+        server lives in the same process. clock is used for all timing and
+        defaults to the wall clock. local_address and remote_address are the
+        (ip, port) of this socket and of the server.
+
         You can extend this method if you need additional attributes to be
         initialized, but do *not* call connect from here.
         """
         super().__init__(window, timeout)
-        self.connection = False
-        self.window = window
-        self.timeout = timeout
-        self._lossy_layer = LossyLayer(self, CLIENT_IP, CLIENT_PORT, SERVER_IP, SERVER_PORT)
-
-        # The data buffer used by send() to send data from the application
-        # thread into the network thread. Bounded in size.
-        self._sendbuf = queue.Queue(maxsize=1000)
-        self._receivebuf = queue.Queue(maxsize=1000)
-
-        #set socket
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        #set timeout in seconds
-        self.socket.settimeout(1.5)
-        
-        #setup segment receival and segment sending
-        self.seg_sen = send_packet(self._sendbuf, self.socket)
-        self.seg_rec = receive_packet(self._receivebuf, self.socket)
-        
-    def start(self):
-        self.seg_rec.start()
-        self.seg_sen.start()
+        self._clock = clock if clock is not None else WallClock()
+        self._state = BTCPStates.CLOSED
+
+        # When the SYN or FIN is sent again if it isn't answered, and how
+        # many times it was sent again.
+        self._deadline = None
+        self._retries = 0
+
+        # Handshake options: application data carried by the SYN, and what
+        # the server answered in its SYN|ACK.
+        self._syn_options = b''
+        self.handshake_reply = b''
+
+        # zlib level asked for in connect, and the compressor if the server
+        # agreed to it. _compressed is the part of the last frame that
+        # didn't fit in the send buffer yet.
+        self._compression = None
+        self._compressor = None
+        self._compressed = b''
+
+        # Largest payload size to ask for, and whether to probe for it. The
+        # checksum algorithm asked for in connect is what the server agreed
+        # to once it answers, and so is _segment_payload.
+        self._max_payload = PAYLOAD_SIZE
+        self._probe = False
+
+        # The handshake gives the first round trip time sample.
+        self._syn_time = None
+
+        # Data from the server (see recv), received the way the server
+        # receives ours: the receive buffer, out of order segments by
+        # (unbounded) sequence number, and the next one expected, following
+        # the SYN|ACK's.
+        self._recvbuf = queue.Queue(maxsize=1000)
+        self._reassembly = {}
+        self._expected = None
+
+        # Delayed ACKs (see BTCPSocket._acknowledge): whether to delay them,
+        # how many segments are waiting for one and when it is due. acks_sent
+        # counts the ACKs sent for data, not the data segments carrying one.
+        self.delayed_ack = True
+        self._acks_owed = 0
+        self._ack_deadline = None
+        self.acks_sent = 0
+
+        # Create the lossy layer last: its network thread starts calling our
+        # callbacks right away.
+        self._lossy_layer = None
+        self._lossy_layer = layer(self, *local_address, *remote_address)
 
 
     ###########################################################################
@@ -79,7 +123,7 @@ class BTCPClientSocket(BTCPSocket):
     ### to add.                                                             ###
     ###########################################################################
 
-    def lossy_layer_segment_received(self, segment):
+    def lossy_layer_segment_received(self, segment, address=None):
         """Called by the lossy layer whenever a segment arrives.
 
         Things you should expect to handle here (or in helper methods called
@@ -92,14 +136,174 @@ class BTCPClientSocket(BTCPSocket):
             - any other handling of the header received from the server
 
         Remember, we expect you to implement this *as a state machine!*
+
+        address is where the segment came from, if the lossy layer knows. A
+        connected socket only hears from its peer, so it is not used here.
+        segment may be a view of the lossy layer's buffer, valid only until
+        this returns (see SharedMemoryLayer): whatever is kept is copied.
         """
+        if not self.verify_segment(segment):
+            # Corrupted; the server sends it again.
+            self._checksum_failed()
+            return
+        seqnum, acknum, flags, window, length, checksum = \
+            self.unpack_segment_header(segment[:HEADER_SIZE])
+        algorithm = flags & CHECKSUM_MASK
+        flags &= ~CHECKSUM_MASK
+
+        if self._state == BTCPStates.SYN_SENT and flags & ~COMPRESS_FLAG == SYN_FLAG | ACK_FLAG:
+            if self.unwrap_seqnum(acknum, self._base) != self._base:
+                return
+            self._window = min(self._window, window)
+            if self._retries == 0:
+                # The handshake is the first round trip time sample.
+                self.srtt = self._clock.time() - self._syn_time
+            self.handshake_reply = bytes(segment[HEADER_SIZE:HEADER_SIZE + length])
+            self._checksum = algorithm
+            # The SYN|ACK is padded to the payload size the server agreed to.
+            self._segment_payload = min(len(segment) - HEADER_SIZE, self._max_payload)
+            self._payload_size = self.payload_size(algorithm, self._segment_payload)
+            if not self._probe:
+                self._set_segment_size(HEADER_SIZE + self._segment_payload)
+            if flags & COMPRESS_FLAG and self._compression is not None:
+                self._compressor = StreamCompressor(self._compression)
+            self._expected = seqnum + 1
+            self._send_control(ack_set=True, acknum=self._expected & 0xFFFF)
+            self._state = BTCPStates.ESTABLISHED
+            self._deadline = None
+            self._send_pending()
+
+        elif (self._state == BTCPStates.ESTABLISHED and self._probe
+                and flags & ~COMPRESS_FLAG == SYN_FLAG | ACK_FLAG):
+            # The answer to a larger probe, arriving after the first.
+            size = min(len(segment) - HEADER_SIZE, self._max_payload)
+            if size > self._segment_payload:
+                self._segment_payload = size
+                self._payload_size = self.payload_size(self._checksum, size)
+
+        elif (self._state == BTCPStates.ESTABLISHED
+                and flags & ~(PARITY_FLAG | NAK_FLAG) == ACK_FLAG):
+            if flags & PARITY_FLAG:
+                # The server rebuilt a lost segment from parity.
+                self._losses += 1
+            self._count_failures(length)
+            if flags & NAK_FLAG:
+                self._handle_nak(segment[HEADER_SIZE:])
+            self._handle_ack(self.unwrap_seqnum(acknum, self._base), duplicate=True)
+            # Every ACK that frees room in the window clocks out new data.
+            self._send_pending()
+            self._arm_tail_probe()
+
+        elif flags == 0 and self._state in (BTCPStates.ESTABLISHED, BTCPStates.FIN_SENT):
+            if len(segment) < SEGMENT_SIZE:
+                self._peer_unpadded = True
+            self._handle_data(seqnum, acknum, bytes(segment[HEADER_SIZE:HEADER_SIZE + length]))
+
+        elif self._state == BTCPStates.FIN_SENT and flags == ACK_FLAG | FIN_FLAG:
+            # The FIN|ACK comes after the server's data.
+            self._send_control(ack_set=True, acknum=(seqnum + 1) & 0xFFFF)
+            self._state = BTCPStates.CLOSED
+            self._deadline = None
+
+
+    def _handle_data(self, seqnum, acknum, chunk):
+        """Receive a data segment from the server, and the acknowledgement
+        of our data it carries."""
+        self._two_way = True
+        outstanding = (self._base, self._next_seqnum)
+        if self._state == BTCPStates.ESTABLISHED:
+            self._handle_ack(self.unwrap_seqnum(acknum, self._base))
+        else:
+            # The server answers our FIN once this data is acknowledged, so
+            # don't give up on it.
+            self._retries = 0
+        seqnum = self.unwrap_seqnum(seqnum, self._expected)
+        expected = self._expected
+        if seqnum == expected and self._deliver(chunk):
+            while self._expected in self._reassembly:
+                if not self._deliver(self._reassembly[self._expected]):
+                    break
+                del self._reassembly[self._expected - 1]
+        elif expected < seqnum < expected + self._window:
+            self._reassembly[seqnum] = chunk
+        if seqnum == expected and self._expected == expected + 1:
+            self._acknowledge()
+        else:
+            # Out of order, a duplicate, or no room: tell the server now, and
+            # name what is missing before an early segment.
+            self._send_ack(self._missing(seqnum - 1) if seqnum > self._expected else ())
+        self._send_pending()
+        if (self._base, self._next_seqnum) != outstanding:
+            # Only progress restarts the probe: the server probing with its
+            # own data must not put ours off.
+            self._arm_tail_probe()
+
+
+    def _deliver(self, chunk):
+        """Pass chunk into the receive buffer for the application thread.
+        Returns False if the buffer is full, in which case the chunk is not
+        acknowledged.
+        """
+        try:
+            self._recvbuf.put_nowait(chunk)
+        except queue.Full:
+            return False
+        self._expected += 1
+        return True
+
+
+    def _send_ack(self, naks=()):
+        """Acknowledge the data received from the server, naming the
+        (unbounded) sequence numbers naks as missing."""
+        self.acks_sent += 1
+        self._ack_sent()
+        self._send_control(ack_set=True, acknum=self._expected & 0xFFFF, naks=naks)
 
-        #TODO 1: unpack segment
-        #TODO 2: give buffer to checksum generating function
-        #TODO 3: check the value of TODO 2 to know if the checksum was valified
 
-        pass # present to be able to remove the NotImplementedError without having to implement anything yet.
-        raise NotImplementedError("No implementation of lossy_layer_segment_received present. Read the comments & code of client_socket.py.")
+    def _send_control(self, syn_set=False, ack_set=False, fin_set=False, acknum=0, naks=()):
+        """Send a segment without data. SYN and FIN carry the sequence
+        number just before / just after the data; the SYN carries the
+        handshake options, and asks for compression if connect was told to.
+        The length field of an ACK carries the checksum failure count, and
+        naks are (unbounded) sequence numbers to name as missing in a NAK.
+        Only the SYN is padded if either end adapts its payload size.
+
+        The SYN asks for payloads of up to _max_payload bytes in its
+        acknowledgement number field. When probing, a SYN of every size in
+        probe_sizes is sent instead, each padded to and asking for its size,
+        the largest first, so its answer arrives first if the path carries it.
+        """
+        seqnum = self._next_seqnum if fin_set else self._isn
+        sizes = (probe_sizes(self._max_payload)[::-1] if syn_set and self._probe
+                 else [PAYLOAD_SIZE] if syn_set else [self._control_padding()])
+        data = self._syn_options if syn_set else b''
+        if naks:
+            data = NAK.pack(len(naks)) + struct.pack("!{}H".format(len(naks)),
+                                                     *(seqnum & 0xFFFF for seqnum in naks))
+            self.naks_sent += 1
+        for size in sizes:
+            if syn_set:
+                acknum = size if self._probe else self._max_payload
+            segment = self.build_segment(seqnum & 0xFFFF, acknum, syn_set, ack_set, fin_set,
+                                         window=self._window, data=data, nak_set=bool(naks),
+                                         length=(self.checksum_failures & 0xFFFF
+                                                 if ack_set and not fin_set else None),
+                                         compress_set=syn_set and self._compression is not None,
+                                         algorithm=self._checksum, payload_size=size)
+            self._count_sent(len(segment))
+            self._lossy_layer.send_segment(segment)
+
+
+    def next_timeout(self):
+        """Time (according to the socket's clock) by which lossy_layer_tick
+        has to be called to handle a retransmission timeout or tail loss
+        probe, to send what pacing held back or a delayed ACK, or None if no
+        timer is running.
+        """
+        return min((deadline for deadline in (self._deadline, self._retransmit_deadline,
+                                              self._tlp_deadline, self._pace_deadline,
+                                              self._ack_deadline)
+                    if deadline is not None), default=None)
 
 
     def lossy_layer_tick(self):
@@ -126,27 +330,48 @@ class BTCPClientSocket(BTCPSocket):
         candidate to put in a helper method which can be called from either
         lossy_layer_segment_received or lossy_layer_tick.
         """
+        if self._deadline is not None and self._clock.time() >= self._deadline:
+            self._handle_timeout()
+        self._handle_send_timers()
+        if self._ack_deadline is not None and self._clock.time() >= self._ack_deadline:
+            self._send_ack()
 
-        raise NotImplementedError("Only rudimentary implementation of lossy_layer_tick present. Read the comments & code of client_socket.py, then remove the NotImplementedError.")
+        self._send_pending()
 
-        # Send all data available for sending.
-        # Relies on an eventual exception to break from the loop when no data
-        # is available.
-        # You should be checking whether there's space in the window as well,
-        # and storing the segments for retransmission somewhere.
-        while True:
-            try:
-                # Get a chunk of data from the buffer, if available.
-                chunk = self._sendbuf.get_nowait()
-                datalen = len(chunk)
-                if datalen < PAYLOAD_SIZE:
-                    chunk = chunk + b'\x00' * (PAYLOAD_SIZE - datalen)
-                segment = self.build_segment_header(0, 0, length=datalen) + chunk
-                self._lossy_layer.send_segment(segment)
-            except queue.Empty:
-                # No data was available for sending.
-                break
 
+    def _send_pending(self):
+        """Send new data as far as the window allows, and the FIN once
+        shutdown was asked for and everything is acknowledged. Called when an
+        ACK arrives, and on ticks (timers, kicks) for when none will.
+        """
+        if self._state == BTCPStates.ESTABLISHED:
+            self._send_new_data()
+            if (self._shutdown and not self._unacked and self._sendbuf.empty()
+                    and not self._rest):
+                self._state = BTCPStates.FIN_SENT
+                self._retries = 0
+                self._send_control(fin_set=True)
+                self._deadline = self._clock.time() + self._timeout / 1000
+
+
+    def _handle_timeout(self):
+        """The SYN or FIN was not answered in time: send it again, or give up
+        after MAX_RETRIES times.
+        """
+        if self._state in (BTCPStates.SYN_SENT, BTCPStates.FIN_SENT):
+            self._retries += 1
+            if self._retries > MAX_RETRIES:
+                self._state = BTCPStates.CLOSED
+                self._deadline = None
+                return
+            if self._state == BTCPStates.SYN_SENT:
+                # Maybe segments that large don't make it: ask for less.
+                self._max_payload = max(PAYLOAD_SIZE, self._max_payload // 2)
+            self._send_control(syn_set=self._state == BTCPStates.SYN_SENT,
+                               fin_set=self._state == BTCPStates.FIN_SENT)
+            self._deadline = self._clock.time() + self._timeout / 1000
+        else:
+            self._deadline = None
 
     ###########################################################################
     ### You're also building the socket API for the applications to use.    ###
@@ -173,7 +398,8 @@ class BTCPClientSocket(BTCPSocket):
     ### above.                                                              ###
     ###########################################################################
 
-    def connect(self):
+    def connect(self, options=b'', compression=None, checksum=INTERNET_CHECKSUM,
+                max_payload=PAYLOAD_SIZE, probe=False):
         """Perform the bTCP three-way handshake to establish a connection.
 
         connect should *block* (i.e. not return) until the connection has been
@@ -187,117 +413,62 @@ class BTCPClientSocket(BTCPSocket):
         wasting a lot of CPU time) ensures that thread B will wait until the
         boolean or enum has the expected value. We do not think you will need
         more advanced thread synchronization in this project.
-        """
 
-        #check if there is no connection yet
-        if (self.connection):
+        options (at most PAYLOAD_SIZE bytes) are sent along with the SYN for
+        the server's handshake callback; its answer is in handshake_reply once
+        connect returns. Servers without a callback ignore them.
+
+        compression, a zlib level (0-9, or -1 for the default), asks the
+        server for a compressed stream; if it agrees, everything sent is
+        compressed before it is cut into segments.
+
+        checksum is the checksum algorithm to ask for: INTERNET_CHECKSUM (the
+        original format), CRC32_CHECKSUM or ADLER32_CHECKSUM. If the server
+        doesn't agree, the internet checksum is used. With the others, options
+        can be at most PAYLOAD_SIZE - TRAILER_SIZE bytes.
+
+        max_payload (up to MAX_PAYLOAD_SIZE, and what the lossy layer can
+        carry) asks for segments with larger payloads, e.g. on loopback or
+        jumbo frame links; the server may agree to less, and every SYN that
+        goes unanswered halves it again. With probe, SYNs of increasing size
+        up to max_payload are sent at once, and the connection uses the
+        largest one answered, so a path that drops large segments is found
+        out in one round trip.
+        """
+        if not self._start_connect(options, compression, checksum, max_payload, probe):
+            return False
+
+        # The network thread moves the state on from here.
+        while self._state == BTCPStates.SYN_SENT:
+            self._clock.sleep(0.001)
+        return self._state == BTCPStates.ESTABLISHED
+
+    def _start_connect(self, options=b'', compression=None, checksum=INTERNET_CHECKSUM,
+                       max_payload=PAYLOAD_SIZE, probe=False):
+        """Send the SYN, without waiting for the answer."""
+        if self._state != BTCPStates.CLOSED:
             print("ERROR: there is already an connection present")
-            #TODO: exception or termination of some kind?
-
-        print("Starting phase one of three way handshake")
-        
-        #create random number
-        seq_num = getrandbits(16)
-
-        #flags 
-        # TODO: create enum for flags
-        # 0x1 = SYN, 0x2 = ACK, 0x3 = FIN
-        # SYN and ACK =     0X1 | 0X2
-        # check flag =      if (FLAG & 0x1) > 0: print("syn is set")
-
-        #sequence number, ack number (empty yet), flags, window, data length
-        #TODO: add packet/header class
-
-        #we set checksum to 0 then calculate it
-        temp_header = (seq_num, 0, '0x1', self.window, 0, 0)
-        payload = bytes(1000)
-
-        #set socket and generate checksum
-        sock = BTCPSocket(self.window, self.timeout)
-        checksum = sock.in_cksum(sock.build_segment_header(temp_header) + payload)
-
-        #use checksum for full header
-        header = (seq_num, 0, '0x1', self.window, 0, checksum)
-
-        #pack header for usage inside pack and create packet
-        pack = (sock.build_segment_header(header), payload)
-
-        #add package to sendbuf
-        self._sendbuf.put(pack)
-
-        #we now automaticly send SYN (due to SEG_SEN running)
-
-        print("Starting phase two of three way handshake")
-        
-        #receive syn-ack
-        try:
-            data, addr = self._receivebuf.get(True, self.timeout)
-        except queue.Empty:
-            return False      
-        
-        #check if header is long enough
-        if len(data) < 16:
-            raise ValueError("header is not long enough")
-        
-        #get unpacked header
-        header_temp = sock.unpack_segment_header(data)
-        
-        #unpack header
-        syn_number = header_temp[0]
-        ack_number = header_temp[1]
-        flag_byte = header_temp[2]
-        window = header_temp[3]
-        length = header_temp[4]
-        
-        #this is the given checksum
-        checksum = header_temp[5]
-        
-        #we calculate our own checksum from our data to compare
-        checksum_comp = sock.in_cksum(sock.build_segment_header(header_temp) + payload)
-        
-        
-        #check that header is not empty
-        if ( header_temp is not None
-            #check that ACK = SYN + 1
-            and ack_number == syn_number + 1 
-            #check that SYN FLAG is set
-            and (flag_byte & '0x1') > 0
-            #check that ACK FLAG is set
-            and (flag_byte & '0x2') > 0
-            #check that the checksum works
-            and checksum == checksum_comp
-            
-        ):
-            syn_number = ack_number
-        else:
-            #exit connect function
-            return False 
-
-        print("Starting phase three of three way handshake")
-
-        #set window to parameter
-        self.window = window
-        
-        #create temp header and payload
-        temp_header = (0, syn_number, '0x2', self.window, 0, 0)
-        payload = bytes(1000)
-        
-        #create checksum and new header with checksum
-        checksum = sock.in_cksum(sock.build_segment_header(temp_header) + payload)
-        header = (0, syn_number, '0x2', self.window, 0, checksum)
-        
-        #create a pack
-        pack = (sock.build_segment_header(header), payload)
-        
-        #add package to sendbuf
-        self._sendbuf.put(pack)
-        
-        #ack is now automaticly send to the server by the sender
-
-        #we only return after finishing the connection
-        #TODO: maybe set some more self values here
-        self.connection = True
-        print("Succesfully connected")
+            return False
+        if len(options) > self.payload_size(checksum):
+            raise ValueError("handshake options can't exceed {} bytes".format(
+                self.payload_size(checksum)))
+
+        self._syn_options = bytes(options)
+        self.handshake_reply = b''
+        self._compression = compression
+        self._compressor = None
+        self._checksum = checksum
+        self._payload_size = self.payload_size(checksum)
+        self._max_payload = max(PAYLOAD_SIZE,
+                                min(max_payload, self._max_segment_size() - HEADER_SIZE))
+        self._probe = probe
+        self._segment_payload = PAYLOAD_SIZE
+        self._set_segment_size(HEADER_SIZE + self._max_payload)
+        self._retries = 0
+        self._state = BTCPStates.SYN_SENT
+        self._syn_time = self._clock.time()
+        self._send_control(syn_set=True)
+        self._deadline = self._clock.time() + self._timeout / 1000
         return True
 
 
@@ -327,26 +498,53 @@ class BTCPClientSocket(BTCPSocket):
         in maximum 1008-byte bytes objects because that's the maximum a segment
         can carry. If a chunk is smaller we do *not* pad it here, that gets
         done later.
-        """
 
-        raise NotImplementedError("Only rudimentary implementation of send present. Read the comments & code of client_socket.py, then remove the NotImplementedError.")
-
-        # Example with a finite buffer: a queue with at most 1000 chunks,
-        # for a maximum of 985KiB data buffered to get turned into packets.
-        # See BTCPSocket__init__() in btcp_socket.py for its construction.
-        datalen = len(data)
-        sent_bytes = 0
-        while sent_bytes < datalen:
-            # Loop over data using sent_bytes. Reassignments to data are too
-            # expensive when data is large.
-            chunk = data[sent_bytes:sent_bytes+PAYLOAD_SIZE]
-            try:
-                self._sendbuf.put_nowait(chunk)
-                sent_bytes += len(chunk)
-            except queue.Full:
-                break
-        return sent_bytes
+        On a compressed connection, data is taken a frame (at most FRAME_SIZE
+        bytes) at a time, and nothing is taken while the previous frame
+        hasn't fit in the buffer yet.
 
+        Read-only data, like bytes or a memoryview of a file mapped with
+        ACCESS_READ, isn't copied: the segments refer to it until they are
+        acknowledged, so it must not change in the meantime (see
+        btcp.file_io.send_file). Other data is copied into the send buffer.
+
+        Small writes share segments: while a segment that went out short
+        waits for its ACK, data that doesn't fill a segment waits for more to
+        join it, and goes once the ACK arrives. Set nodelay for every write
+        to go out right away instead, e.g. for small messages that someone is
+        waiting for; that costs a segment (and an ACK) per write.
+        """
+        if self._compressor is not None:
+            if not self._flush_compressed():
+                return 0
+            accepted = min(len(data), FRAME_SIZE)
+            self._compressed = memoryview(self._compressor.compress(data[:accepted]))
+            self._flush_compressed()
+            return accepted
+        return self._buffer(data)
+
+    def _flush_compressed(self):
+        """Move as much of the pending compressed frame into the send buffer
+        as fits. Returns whether all of it did."""
+        if self._compressed:
+            self._compressed = self._compressed[self._buffer(self._compressed):]
+        return not self._compressed
+
+    def recv(self):
+        """Return data the server sent (see BTCPServerSocket.send), blocking
+        until some arrives; b'' once the connection is closed. Data that
+        arrives while shutdown waits for the server stays available.
+        """
+        data = bytearray()
+        while not data:
+            try:
+                data.extend(self._clock.get(self._recvbuf, TIMER_TICK / 1000))
+                while True:
+                    data.extend(self._recvbuf.get_nowait())
+            except queue.Empty:
+                if not data and self._state == BTCPStates.CLOSED:
+                    break
+        return bytes(data)
 
     def shutdown(self):
         """Perform the bTCP three-way finish to shutdown the connection.
@@ -363,10 +561,18 @@ class BTCPClientSocket(BTCPSocket):
         boolean or enum has the expected value. We do not think you will need
         more advanced thread synchronization in this project.
         """
-        #TODO: section 2.3
-
-        pass # present to be able to remove the NotImplementedError without having to implement anything yet.
-        raise NotImplementedError("No implementation of shutdown present. Read the comments & code of client_socket.py.")
+        while not self._flush_compressed() and self._state == BTCPStates.ESTABLISHED:
+            self._clock.sleep(0.001)
+        self._start_shutdown()
+        while self._state in (BTCPStates.ESTABLISHED, BTCPStates.FIN_SENT):
+            self._clock.sleep(0.001)
+        return self._state == BTCPStates.CLOSED
+
+    def _start_shutdown(self):
+        """Have the network thread send the FIN once all buffered data has
+        been sent and acknowledged, without waiting for it."""
+        self._shutdown = True
+        self._kick()
 
     ## NO MODIFICATIONS NEEDED BELOW HERE
 
@@ -0,0 +1,146 @@
+"""
+Clocks used by bTCP to measure timeouts.
+
+Every timeout in the bTCP implementation goes through a clock object instead of
+calling time.time() or blocking on Queue.get(timeout=...) directly. The default
+WallClock simply forwards to the standard library, so normal use is unchanged.
+
+The VirtualClock is a discrete-event scheduler: time only advances when the
+next scheduled event is run. Waiting on an empty queue does not block, it runs
+events (e.g. segment deliveries of the simulated network) until the queue gets
+filled or the deadline is reached. This lets a complete transfer with a 100ms
+round trip time run as fast as the CPU allows.
+"""
+
+
+import heapq
+import itertools
+import queue
+import time
+
+
+class WallClock:
+    """Clock backed by the real time of the operating system."""
+
+    def time(self):
+        """Return the current time in seconds."""
+        return time.time()
+
+
+    def sleep(self, seconds):
+        """Block the calling thread for the given number of seconds."""
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+    def get(self, buf, timeout=None):
+        """Get an item from the queue buf, blocking for at most timeout
+        seconds. Raises queue.Empty when the timeout expires, exactly like
+        Queue.get(True, timeout).
+        """
+        if timeout is not None and timeout <= 0:
+            return buf.get_nowait()
+        return buf.get(True, timeout)
+
+
+class VirtualClock:
+    """Single threaded discrete-event clock.
+
+    Events are callbacks scheduled at an absolute virtual time with call_at or
+    relative to the current virtual time with call_later. They are executed in
+    order of their scheduled time; events scheduled for the same time run in
+    the order they were scheduled.
+
+    Only use this clock from a single thread: there is nobody else to advance
+    time while a thread waits.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._events = []
+        self._counter = itertools.count()
+        self.events_run = 0
+
+
+    def time(self):
+        """Return the current virtual time in seconds."""
+        return self._now
+
+
+    def call_at(self, when, callback, *args):
+        """Schedule callback(*args) to run at virtual time when.
+
+        Returns a handle that can be passed to cancel.
+        """
+        event = [max(when, self._now), next(self._counter), callback, args]
+        heapq.heappush(self._events, event)
+        return event
+
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) to run delay seconds from now."""
+        return self.call_at(self._now + delay, callback, *args)
+
+
+    @staticmethod
+    def cancel(handle):
+        """Cancel an event scheduled with call_at or call_later. Cancelled
+        events stay in the heap but are skipped when their time comes.
+        """
+        handle[2] = None
+
+
+    def pending(self):
+        """Return whether any (not cancelled) events are still scheduled."""
+        return any(event[2] is not None for event in self._events)
+
+
+    def run_next(self, until=None):
+        """Run the earliest scheduled event, advancing time to it.
+
+        If until is given and the earliest event lies beyond it, time is
+        advanced to until instead and no event runs. Returns whether an event
+        was run.
+        """
+        while self._events:
+            when, _, callback, args = self._events[0]
+            if until is not None and when > until:
+                break
+            heapq.heappop(self._events)
+            if callback is None:
+                continue
+            self._now = when
+            self.events_run += 1
+            callback(*args)
+            return True
+        if until is not None and until > self._now:
+            self._now = until
+        return False
+
+
+    def run(self, until=None, stop=None):
+        """Run events until none are left, virtual time reaches until, or the
+        callable stop returns True.
+        """
+        while stop is None or not stop():
+            if not self.run_next(until):
+                return
+
+
+    def sleep(self, seconds):
+        """Let seconds of virtual time pass, running all events in between."""
+        self.run(until=self._now + seconds)
+
+
+    def get(self, buf, timeout=None):
+        """Get an item from the queue buf, running scheduled events until one
+        becomes available. Raises queue.Empty if the virtual deadline passes
+        or no events are left that could fill the queue.
+        """
+        if timeout is not None and timeout <= 0:
+            return buf.get_nowait()
+        deadline = None if timeout is None else self._now + timeout
+        while buf.empty():
+            if not self.run_next(deadline):
+                raise queue.Empty
+        return buf.get_nowait()
@@ -0,0 +1,86 @@
+"""
+Stream compression for bTCP connections.
+
+Compression is negotiated in the handshake: a client that wants to compress
+sets COMPRESS_FLAG on its SYN, and a server willing to decompress sets it on
+its SYN|ACK. From then on, the client compresses the byte stream before it is
+cut into segments, so every segment carries more application data.
+
+The compressed stream is a sequence of frames, each a FRAME header (kind and
+length of the body) followed by the body. Every call to send becomes one
+frame: DEFLATE frames continue a single zlib stream, flushed at the end of
+every frame so the receiver can decompress it right away; data that doesn't
+get smaller (already compressed or random) is sent as a RAW frame instead and
+never enters the zlib stream.
+"""
+
+
+import struct
+import zlib
+
+
+FRAME = struct.Struct("!BI")
+RAW = 0
+DEFLATE = 1
+
+# At most this much application data goes into one frame.
+FRAME_SIZE = 64 * 1024
+
+
+class StreamCompressor:
+    """Sending side: turns application data into frames, compressed with
+    zlib at level (0-9, or -1 for zlib's default) when that makes them
+    smaller."""
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION):
+        self._deflate = zlib.compressobj(level)
+        # Application bytes taken in, and frame bytes put out.
+        self.consumed = 0
+        self.produced = 0
+
+
+    def compress(self, data):
+        """Return the frame carrying data."""
+        attempt = self._deflate.copy()
+        body = attempt.compress(data) + attempt.flush(zlib.Z_SYNC_FLUSH)
+        if len(body) < len(data):
+            self._deflate = attempt
+            kind = DEFLATE
+        else:
+            kind, body = RAW, bytes(data)
+        self.consumed += len(data)
+        self.produced += FRAME.size + len(body)
+        return FRAME.pack(kind, len(body)) + body
+
+
+class StreamDecompressor:
+    """Receiving side: turns the frames, in whatever pieces they arrive,
+    back into application data."""
+
+    def __init__(self):
+        self._inflate = zlib.decompressobj()
+        self._pending = bytearray()
+
+
+    def decompress(self, data):
+        """Return the application data of all frames completed by data."""
+        self._pending += data
+        output = bytearray()
+        offset = 0
+        while len(self._pending) - offset >= FRAME.size:
+            kind, length = FRAME.unpack_from(self._pending, offset)
+            end = offset + FRAME.size + length
+            if end > len(self._pending):
+                break
+            body = memoryview(self._pending)[offset + FRAME.size:end]
+            if kind == DEFLATE:
+                output += self._inflate.decompress(body)
+            elif kind == RAW:
+                output += body
+            else:
+                body.release()
+                raise ValueError("unknown frame kind {}".format(kind))
+            body.release()
+            offset = end
+        del self._pending[:offset]
+        return output
@@ -30,3 +30,80 @@ HEADER_SIZE, PAYLOAD_SIZE, SEGMENT_SIZE:
 HEADER_SIZE = 10
 PAYLOAD_SIZE = 1008
 SEGMENT_SIZE = HEADER_SIZE + PAYLOAD_SIZE
+
+"""
+MAX_SEGMENT_SIZE, MAX_PAYLOAD_SIZE:
+    Largest segment (the largest UDP datagram over IPv4) and payload a
+    connection can negotiate. PAYLOAD_SIZE stays the default and the smallest
+    payload size; see BTCPClientSocket.connect.
+"""
+MAX_SEGMENT_SIZE = 65507
+MAX_PAYLOAD_SIZE = MAX_SEGMENT_SIZE - HEADER_SIZE
+
+"""
+SYN_FLAG, ACK_FLAG, FIN_FLAG, COMPRESS_FLAG, PARITY_FLAG, NAK_FLAG:
+    Values of the flags in the flags byte of the header, as packed by
+    BTCPSocket.build_segment_header. COMPRESS_FLAG is only set on the SYN and
+    SYN|ACK, to negotiate a compressed stream (see btcp/compression.py).
+    PARITY_FLAG marks FEC parity segments and the ACKs of segments rebuilt
+    from them (see btcp/fec.py). NAK_FLAG marks an ACK whose payload names
+    segments the server is missing: a NAK header (the number of sequence
+    numbers) followed by the 16 bit sequence numbers.
+
+    Data segments have none of these flags set. Both ends send them, and
+    their acknowledgement number carries the cumulative acknowledgement of
+    the data going the other way.
+"""
+NAK_FLAG = 0x80
+PARITY_FLAG = 0x10
+COMPRESS_FLAG = 0x8
+SYN_FLAG = 0x4
+ACK_FLAG = 0x2
+FIN_FLAG = 0x1
+
+"""
+CHECKSUM_MASK, INTERNET_CHECKSUM, CRC32_CHECKSUM, ADLER32_CHECKSUM, TRAILER_SIZE:
+    The two CHECKSUM_MASK bits of the flags byte say how a segment is
+    checksummed. INTERNET_CHECKSUM (both bits clear, the original format)
+    puts the 16 bit internet checksum in the header. The others leave the
+    header field 0 and end the segment with a TRAILER_SIZE byte CRC-32 or
+    Adler-32 of everything before it, so the payload has room for
+    TRAILER_SIZE bytes less data. A client asks for an algorithm by using it
+    for its SYN; the server agrees by using it for the SYN|ACK.
+"""
+CHECKSUM_MASK = 0x60
+INTERNET_CHECKSUM = 0x00
+CRC32_CHECKSUM = 0x20
+ADLER32_CHECKSUM = 0x40
+TRAILER_SIZE = 4
+
+"""
+MAX_RETRIES:
+    How many times a SYN or FIN is sent again without an answer before connect
+    or shutdown give up.
+"""
+MAX_RETRIES = 10
+
+"""
+NAK_LIMIT, NAK_HOLDOFF:
+    The most sequence numbers one NAK names, and the fraction of the
+    timeout to wait before naming the same sequence number again, so a
+    retransmission has time to arrive.
+"""
+NAK_LIMIT = 64
+NAK_HOLDOFF = 0.5
+
+"""
+TLP_FACTOR:
+    How many smoothed round trip times without an ACK the client waits
+    before a tail loss probe.
+"""
+TLP_FACTOR = 2
+
+"""
+ACK_DELAY:
+    How long, in seconds, a socket that has sent data of its own may hold
+    back the ACK of an in order data segment, for data going the other way to
+    carry it. A second segment waiting for its ACK is acknowledged right away.
+"""
+ACK_DELAY = 0.01
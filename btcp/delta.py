@@ -0,0 +1,283 @@
+"""
+Delta transfers: only send what changed compared to the receiver's copy.
+
+The rsync algorithm over one bTCP connection, which carries data both ways:
+    - the sender connects with a DELTA_REQUEST in the handshake options,
+      naming the block size;
+    - the receiver sends the signatures of its existing copy back over the
+      same connection: for every whole block, an Adler-32 (the rolling
+      checksum) and a BLAKE2b digest (the strong hash);
+    - the sender slides a block sized window over its file, rolling the
+      Adler-32 one byte at a time. Where it matches a signature and the
+      strong hash agrees, it sends a reference to the receiver's block;
+      everything in between is sent as literal data;
+    - the receiver rebuilds the file from its old copy and the literals,
+      checks the digest of the result and moves it into place.
+
+Wire format of the delta stream: DELTA_HEADER (magic, size, block size,
+BLAKE2b digest of the new file), then records, each a RECORD header: b'L'
+with the length of the literal data that follows, or b'C' with the first
+block and the number of consecutive blocks to copy.
+"""
+
+
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from btcp.constants import *
+
+
+BLOCK_SIZE = 4096
+LITERAL_SIZE = 1024 * 1024
+ADLER_MOD = 65521
+
+DELTA_MAGIC = b'bTCPdlta'
+DELTA_REQUEST = struct.Struct("!8sI")
+DELTA_HEADER = struct.Struct("!8sQI16s")
+RECORD = struct.Struct("!cQQ")
+SIGNATURE_HEADER = struct.Struct("!IQ")
+SIGNATURE = struct.Struct("!I16s")
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _map(file):
+    """Map file read-only; an empty file can't be mapped."""
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def signatures(path, block_size=BLOCK_SIZE):
+    """Signatures of every whole block of the file at path, serialized. A
+    missing file has no blocks."""
+    entries = []
+    try:
+        with open(path, "rb") as file:
+            data = _map(file)
+            for offset in range(0, len(data) - block_size + 1, block_size):
+                block = data[offset:offset + block_size]
+                entries.append(SIGNATURE.pack(zlib.adler32(block), strong_hash(block)))
+    except FileNotFoundError:
+        pass
+    return SIGNATURE_HEADER.pack(block_size, len(entries)) + b''.join(entries)
+
+
+def parse_signatures(data):
+    """Return the block size and a table from rolling checksum to
+    {strong hash: block index} of serialized signatures."""
+    block_size, count = SIGNATURE_HEADER.unpack_from(data)
+    table = {}
+    for index in range(count):
+        weak, strong = SIGNATURE.unpack_from(data, SIGNATURE_HEADER.size + index * SIGNATURE.size)
+        table.setdefault(weak, {}).setdefault(strong, index)
+    return block_size, table
+
+
+def delta(data, block_size, table):
+    """Generate the records turning the receiver's copy (described by table)
+    into data, a bytes-like object, as (header, literal data) tuples."""
+    size = len(data)
+    literal_start = 0
+    copy_start = copy_count = 0
+
+    def flush_literal(end):
+        for start in range(literal_start, end, LITERAL_SIZE):
+            stop = min(start + LITERAL_SIZE, end)
+            yield RECORD.pack(b'L', stop - start, 0), data[start:stop]
+
+    def flush_copy():
+        if copy_count:
+            yield RECORD.pack(b'C', copy_start, copy_count), b''
+
+    i = 0
+    weak = None
+    while table and i + block_size <= size:
+        if weak is None:
+            weak = zlib.adler32(data[i:i + block_size])
+        candidates = table.get(weak)
+        if candidates is not None:
+            index = candidates.get(strong_hash(data[i:i + block_size]))
+            if index is not None:
+                if literal_start < i:
+                    yield from flush_copy()
+                    copy_count = 0
+                    yield from flush_literal(i)
+                if copy_count and copy_start + copy_count == index:
+                    copy_count += 1
+                else:
+                    yield from flush_copy()
+                    copy_start, copy_count = index, 1
+                i += block_size
+                literal_start = i
+                weak = None
+                continue
+        if i + block_size < size:
+            # Roll the Adler-32 one byte on: drop data[i], add data[i + block_size].
+            out = data[i]
+            a = ((weak & 0xFFFF) - out + data[i + block_size]) % ADLER_MOD
+            b = ((weak >> 16) - block_size * out + a - 1) % ADLER_MOD
+            weak = b << 16 | a
+        i += 1
+    yield from flush_copy()
+    yield from flush_literal(size)
+
+
+class DeltaPatcher:
+    """Rebuilds a file from the old copy at old_path and a delta stream,
+    writing it to new_path."""
+
+    def __init__(self, old_path, new_path):
+        try:
+            self._old = open(old_path, "rb")
+        except FileNotFoundError:
+            self._old = None
+        self._new = open(new_path, "wb", buffering=LITERAL_SIZE)
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._pending = bytearray()
+        self._header = None
+        self._literal = 0
+        self.written = 0
+        self.copied = 0
+
+
+    def _write(self, data):
+        self._new.write(data)
+        self._digest.update(data)
+        self.written += len(data)
+
+
+    def feed(self, chunk):
+        """Process chunk, the next bytes of the delta stream."""
+        view = memoryview(chunk)
+        while view:
+            if self._literal:
+                data = view[:self._literal]
+                view = view[len(data):]
+                self._literal -= len(data)
+                self._write(data)
+                continue
+            needed = DELTA_HEADER.size if self._header is None else RECORD.size
+            missing = needed - len(self._pending)
+            self._pending += view[:missing]
+            view = view[missing:]
+            if len(self._pending) < needed:
+                return
+            if self._header is None:
+                self._header = DELTA_HEADER.unpack(self._pending)
+                if self._header[0] != DELTA_MAGIC:
+                    raise ValueError("not a delta stream")
+            else:
+                kind, first, count = RECORD.unpack(self._pending)
+                if kind == b'L':
+                    self._literal = first
+                else:
+                    self._copy(first, count)
+            self._pending.clear()
+
+
+    def _copy(self, first, count):
+        block_size = self._header[2]
+        offset = first * block_size
+        remaining = count * block_size
+        while remaining:
+            data = os.pread(self._old.fileno(), min(remaining, LITERAL_SIZE), offset)
+            if not data:
+                raise ValueError("delta refers beyond the old copy")
+            self._write(data)
+            offset += len(data)
+            remaining -= len(data)
+            self.copied += len(data)
+
+
+    def close(self):
+        """Close the files. Returns whether the new file is complete and
+        matches the digest the sender announced."""
+        self._new.close()
+        if self._old is not None:
+            self._old.close()
+        return (self._header is not None and not self._literal
+                and self.written == self._header[1] and self._digest.digest() == self._header[3])
+
+
+def _receive_signatures(client):
+    """Read serialized signatures from client, or None if the connection
+    closed before all of them arrived."""
+    received = bytearray()
+    size = SIGNATURE_HEADER.size
+    while len(received) < size:
+        chunk = client.recv()
+        if not chunk:
+            return None
+        received += chunk
+        if size == SIGNATURE_HEADER.size and len(received) >= size:
+            size += SIGNATURE_HEADER.unpack_from(received)[1] * SIGNATURE.size
+    return received
+
+
+def send_delta(client, path, block_size=BLOCK_SIZE):
+    """Send the file at path over client as a delta against the receiver's
+    copy, whose signatures the receiver sends back over the same connection.
+    Returns the number of literal bytes sent, or None if the receiver
+    couldn't be reached.
+    """
+    if not client.connect(DELTA_REQUEST.pack(DELTA_MAGIC, block_size)):
+        return None
+    received = _receive_signatures(client)
+    if received is None:
+        return None
+    block_size, table = parse_signatures(received)
+
+    with open(path, "rb") as file:
+        data = _map(file)
+        digest = hashlib.blake2b(digest_size=16)
+        for offset in range(0, len(data), LITERAL_SIZE):
+            digest.update(data[offset:offset + LITERAL_SIZE])
+        client.sendall(DELTA_HEADER.pack(DELTA_MAGIC, len(data), block_size, digest.digest()))
+        literal = 0
+        for header, literal_data in delta(data, block_size, table):
+            client.sendall(header + literal_data)
+            literal += len(literal_data)
+    return literal
+
+
+def delta_request(options):
+    """Block size of a DELTA_REQUEST, or None if options aren't one."""
+    if len(options) < DELTA_REQUEST.size:
+        return None
+    magic, block_size = DELTA_REQUEST.unpack_from(options)
+    if magic != DELTA_MAGIC:
+        return None
+    return block_size
+
+
+def receive_delta(server, old_path, new_path):
+    """Receive a file sent with send_delta on the accepted server and write
+    it to new_path, using old_path as the copy to patch. The signatures of
+    old_path go back to the sender over server. Returns whether the file
+    arrived intact.
+    """
+    block_size = delta_request(server.handshake_options)
+    if block_size is None:
+        return False
+    server.sendall(signatures(old_path, block_size))
+
+    temporary = new_path + ".delta"
+    patcher = DeltaPatcher(old_path, temporary)
+    try:
+        while True:
+            chunk = server.recv()
+            if not chunk:
+                break
+            patcher.feed(chunk)
+    finally:
+        complete = patcher.close()
+    if complete:
+        os.replace(temporary, new_path)
+    else:
+        os.unlink(temporary)
+    return complete
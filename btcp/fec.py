@@ -0,0 +1,70 @@
+"""
+Forward error correction with XOR parity.
+
+A client with fec set sends, after every block of up to FEC_BLOCK data
+segments, K parity segments: parity segment j is the XOR of the (zero
+padded) payloads of the data segments i of the block with i % K == j, so
+every parity protects an interleaved group of about N / K segments, and the
+server can rebuild any one segment missing from a group without waiting for
+a retransmission. Interleaving the groups spreads a burst of consecutive
+losses over several of them.
+
+A parity segment has PARITY_FLAG set. Its sequence number is that of the
+first data segment of the block, its acknowledgement number holds N, K and j
+(see pack_group), its length field the XOR of the lengths of the group and
+its payload the XOR of the payloads, each padded to as much data as a
+segment of the connection carries. Parity segments take no sequence numbers
+and are never retransmitted. Only the server rebuilds segments from parity, so
+only the client sends it.
+
+An ACK acknowledging a segment the server rebuilt from parity has
+PARITY_FLAG set too, so the client also counts the losses FEC repaired when
+it estimates the loss rate. K is chosen from that estimate (group_size): the
+largest groups that keep the chance of two losses in one group, which XOR
+parity can't repair, under FEC_TARGET.
+"""
+
+
+from btcp.constants import *
+
+
+FEC_BLOCK = 16
+FEC_TARGET = 0.02
+GROUP_SIZES = (16, 8, 4, 2, 1)
+# Weight of the loss rate of the latest block in the estimate.
+LOSS_GAIN = 1 / 8
+
+
+def group_size(loss):
+    """The largest group size (data segments per parity segment) for which
+    the probability of a group with parity losing more than one segment, at
+    loss rate loss, stays under FEC_TARGET."""
+    for size in GROUP_SIZES:
+        n = size + 1
+        unrecoverable = 1 - (1 - loss) ** n - n * loss * (1 - loss) ** size
+        if unrecoverable <= FEC_TARGET:
+            return size
+    return GROUP_SIZES[-1]
+
+
+def pack_group(n, k, j):
+    """Acknowledgement number field of parity segment j of K, of a block of
+    N data segments (N <= 256, K <= 16)."""
+    return (n - 1) << 8 | (k - 1) << 4 | j
+
+
+def unpack_group(field):
+    """N, K and j from the acknowledgement number field of a parity segment."""
+    return (field >> 8) + 1, ((field >> 4) & 0xF) + 1, field & 0xF
+
+
+def payload_value(chunk, size=PAYLOAD_SIZE):
+    """The payload chunk, zero padded to size bytes, as an integer, so
+    payloads can be XORed in one operation."""
+    return int.from_bytes(chunk, "big") << (8 * (size - len(chunk)))
+
+
+def value_payload(value, length, size=PAYLOAD_SIZE):
+    """The first length bytes of the size byte payload with integer value
+    value."""
+    return value.to_bytes(size, "big")[:length]
@@ -0,0 +1,258 @@
+"""
+Bounded-memory file I/O for bTCP transfers.
+
+Neither end of a transfer ever holds the whole file: the sender maps the
+file and hands it to the connection a block at a time, without copying it,
+and the receiver collects in-order data in a buffer of fixed size that is
+written to disk whenever it fills up, or writes every segment at its place
+in the file as it arrives. Memory use is therefore set by the window and the
+buffer sizes, not by the size of the file.
+"""
+
+
+import mmap
+import os
+from btcp.constants import *
+
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class MappedFile:
+    """A file as a sequence of chunk_size byte chunks, memory mapped.
+
+    Supports len() and indexing like the list of chunks it replaces. Every
+    chunk is a memoryview slice of the mapping, so building a segment from it
+    copies nothing; the pages are only read when the kernel copies the
+    segment into the socket buffer. Holding on to a chunk for retransmission
+    costs a memoryview, not a copy of the payload.
+    """
+
+    def __init__(self, path, chunk_size=PAYLOAD_SIZE):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._chunk_size = chunk_size
+        # An empty file can't be mapped.
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if size else memoryview(b'')
+        self._released = 0
+
+
+    def __len__(self):
+        return (len(self._view) + self._chunk_size - 1) // self._chunk_size
+
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("chunk {} of {}".format(index, len(self)))
+        return self._view[index * self._chunk_size:(index + 1) * self._chunk_size]
+
+
+    def release(self, index):
+        """Tell the kernel the chunks before index won't be sent again, so the
+        pages holding them can be dropped from this process' resident set.
+        They are read back from the page cache if they are used after all.
+        """
+        end = index * self._chunk_size // mmap.PAGESIZE * mmap.PAGESIZE
+        if self._map is not None and end > self._released and hasattr(mmap, "MADV_DONTNEED"):
+            self._map.madvise(mmap.MADV_DONTNEED, 0, end)
+            self._released = end
+
+
+    def close(self):
+        """Unmap the file. Chunks still referenced keep the mapping alive
+        until they are gone."""
+        if self._file is not None:
+            self._view.release()
+            if self._map is not None:
+                try:
+                    self._map.close()
+                except BufferError:
+                    pass
+            self._file.close()
+        self._file = None
+
+
+class BufferedSink:
+    """Write-only file that coalesces small writes.
+
+    In-order data is collected in memory until buffer_size bytes are pending,
+    and then written with a single system call.
+    """
+
+    def __init__(self, path, buffer_size=WRITE_BUFFER_SIZE):
+        self._file = open(path, "wb", buffering=0)
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size
+        self.written = 0
+
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+
+    def flush(self):
+        written = 0
+        with memoryview(self._buffer) as view:
+            while written < len(view):
+                written += self._file.write(view[written:])
+        self.written += written
+        self._buffer.clear()
+
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+        self._file = None
+
+
+class OffsetWriter:
+    """Write-only file that every segment goes to at its final offset as soon
+    as it arrives, in whatever order.
+
+    Segment index is written at the end of the segments received in order so
+    far, plus segment_size bytes for every segment between them. Only a
+    bitmap of the segments received so far is kept in memory, so memory use
+    doesn't depend on how far segments arrive out of order.
+
+    The offsets of early segments are guesses, good as long as the segments
+    before them are all segment_size long. When a segment of another size
+    fills the gap, the segments after it were written in the wrong place:
+    they are forgotten (write takes them again), and segment_size becomes
+    the size of that segment. A sender whose segments are all full but the
+    last never causes that.
+    """
+
+    def __init__(self, path, segment_size=PAYLOAD_SIZE):
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        self._segment_size = segment_size
+        self._bitmap = bytearray()
+        # Lengths of the early segments that aren't segment_size long.
+        self._odd = {}
+        # Number of segments received from the start without a gap, and the
+        # number of bytes in them.
+        self.contiguous = 0
+        self.size = 0
+        self.written = 0
+
+
+    def __contains__(self, index):
+        byte = index >> 3
+        return byte < len(self._bitmap) and bool(self._bitmap[byte] & (1 << (index & 7)))
+
+
+    def write(self, index, data):
+        """Write data, the payload of segment index. Returns False if that
+        segment had already been written."""
+        if index in self:
+            return False
+        offset = self.size + (index - self.contiguous) * self._segment_size
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+        byte = index >> 3
+        if byte >= len(self._bitmap):
+            self._bitmap.extend(bytes(byte + 1 - len(self._bitmap)))
+        self._bitmap[byte] |= 1 << (index & 7)
+        self.written += len(data)
+        if len(data) != self._segment_size:
+            self._odd[index] = len(data)
+        while self.contiguous in self:
+            length = self._odd.pop(self.contiguous, self._segment_size)
+            self.size += length
+            self.contiguous += 1
+            if length != self._segment_size:
+                self._forget_early()
+                self._segment_size = length
+        return True
+
+
+    def _forget_early(self):
+        """Forget the segments after the ones received in order."""
+        byte = self.contiguous >> 3
+        if byte < len(self._bitmap):
+            self._bitmap[byte] &= (1 << (self.contiguous & 7)) - 1
+            del self._bitmap[byte + 1:]
+        self._odd.clear()
+
+
+    def close(self):
+        """Cut off anything written past the segments received in order, and
+        close the file."""
+        if self._fd is not None:
+            os.ftruncate(self._fd, self.size)
+            os.close(self._fd)
+        self._fd = None
+
+
+def send_file(client, path, read_ahead=None):
+    """Send the contents of the file at path over the connected
+    BTCPClientSocket client. Returns the number of bytes handed to it.
+
+    The file is memory mapped and handed to the client read_ahead segments'
+    worth (by default the window of the connection) at a time. The blocks
+    are read-only views of the mapping, so the client's segments refer to
+    the mapped pages instead of copying them, and the pages are only read
+    when the kernel copies a segment into the socket buffer. The pages of
+    blocks the server acknowledged are released as it goes, so only the
+    pages of what is still buffered or in flight stay resident; those are
+    page cache the kernel can reclaim, not copies.
+    """
+    block_size = (read_ahead or client._window) * PAYLOAD_SIZE
+    acknowledged = client.bytes_acknowledged
+    total = 0
+    mapped = MappedFile(path, block_size)
+    try:
+        for index in range(len(mapped)):
+            block = mapped[index]
+            sent = client.sendall(block)
+            total += sent
+            if sent < len(block):
+                break
+            mapped.release((client.bytes_acknowledged - acknowledged) // block_size)
+    finally:
+        mapped.close()
+    return total
+
+
+def receive_file(server, path, buffer_size=WRITE_BUFFER_SIZE):
+    """Write everything received on the BTCPServerSocket server to the file
+    at path, until the client disconnects. Returns the number of bytes
+    written."""
+    sink = BufferedSink(path, buffer_size)
+    try:
+        while True:
+            data = server.recv()
+            if not data:
+                break
+            sink.write(data)
+    finally:
+        sink.close()
+    return sink.written
+
+
+def receive_file_direct(server, path):
+    """Like receive_file, but every segment is written at its place in the
+    file as soon as it arrives, through an OffsetWriter, instead of waiting
+    in memory for the gap before it to be filled.
+
+    The BTCPServerSocket server must not have accepted the connection yet;
+    this accepts it. A compressed stream has no segments to place, so the
+    server won't agree to compression. Returns the number of bytes written.
+    """
+    writer = OffsetWriter(path)
+    server.writer = writer
+    try:
+        server.accept()
+        # The data never reaches the receive buffer; recv returns once the
+        # client disconnects.
+        while server.recv():
+            pass
+    finally:
+        writer.close()
+    return writer.size
@@ -0,0 +1,121 @@
+"""
+In-process loopback replacement for the lossy layer.
+
+When the client and the server socket live in the same process, sending every
+segment through two UDP sockets and the kernel only adds system calls and
+copies. LoopbackLayer offers the same contract as LossyLayer, but passes the
+segment objects themselves to the paired endpoint through an in-memory queue.
+"""
+
+
+import queue
+import threading
+from btcp.constants import *
+from btcp.lossy_layer import tick_wait
+
+
+def handle_loopback_segments(btcp_socket, event, segments):
+    """Main method of the network thread of a LoopbackLayer.
+
+    Behaves like handle_incoming_segments in lossy_layer.py: every segment
+    taken from the queue is passed to lossy_layer_segment_received of the
+    associated socket together with the address of its sender, and if no
+    segment arrives for TIMER_TICK ms (or by the socket's next_timeout) then
+    lossy_layer_tick is called instead. A None in the queue is a kick: it
+    calls lossy_layer_tick, and wakes the thread up so it notices the event
+    has been set.
+    """
+    while not event.is_set():
+        try:
+            item = segments.get(True, tick_wait(btcp_socket))
+        except queue.Empty:
+            btcp_socket.lossy_layer_tick()
+            continue
+        if item is None:
+            if not event.is_set():
+                btcp_socket.lossy_layer_tick()
+            continue
+        segment, address = item
+        btcp_socket.lossy_layer_segment_received(segment, address)
+        if tick_wait(btcp_socket) == 0:
+            btcp_socket.lossy_layer_tick()
+
+
+class LoopbackLayer:
+    """Lossy layer for endpoints in the same process.
+
+    Endpoints are paired by address: a segment sent by the layer created with
+    remote address (remote_ip, remote_port) ends up at the layer created with
+    that local address. Addresses are compared as given, so use the same
+    spelling (e.g. 'localhost') on both sides. Segments sent to an address
+    nobody is bound to are silently dropped, just like UDP would.
+
+    The segment object is handed over as is, without copying, so callers must
+    not modify a segment after sending it (bytes objects can't be modified
+    anyway).
+    """
+
+    _endpoints = {}
+    _endpoints_lock = threading.Lock()
+
+
+    def __init__(self, btcp_socket, local_ip, local_port, remote_ip=None, remote_port=None):
+        self._bTCP_socket = btcp_socket
+        self._local = (local_ip, local_port)
+        self._remote = (remote_ip, remote_port)
+        self._segments = queue.SimpleQueue()
+        self._event = None
+        self._thread = None
+
+        with LoopbackLayer._endpoints_lock:
+            if self._local in LoopbackLayer._endpoints:
+                raise OSError("Loopback address {} is already in use".format(self._local))
+            LoopbackLayer._endpoints[self._local] = self
+
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=handle_loopback_segments,
+                                        args=(self._bTCP_socket, self._event, self._segments))
+        self._thread.start()
+
+
+    def __del__(self):
+        self.destroy()
+
+
+    def destroy(self):
+        """Flag the thread that it can stop, wait for it to do so, then release
+        the local address.
+
+        Should be safe to call multiple times, so safe to call from __del__.
+        """
+        if self._event is not None and self._thread is not None:
+            self._event.set()
+            self._segments.put(None)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+        with LoopbackLayer._endpoints_lock:
+            if LoopbackLayer._endpoints.get(self._local) is self:
+                del LoopbackLayer._endpoints[self._local]
+        self._event = None
+        self._thread = None
+
+
+    def kick(self):
+        """Wake the network thread up to call lossy_layer_tick."""
+        self._segments.put(None)
+
+
+    def send_segment(self, segment):
+        """Hand the segment to the paired endpoint.
+
+        Should be safe to call from either the application thread or the
+        network thread.
+        """
+        self.send_segment_to(segment, self._remote)
+
+
+    def send_segment_to(self, segment, address):
+        """Hand the segment to the endpoint at address."""
+        peer = LoopbackLayer._endpoints.get(address)
+        if peer is not None:
+            peer._segments.put((segment, self._local))
@@ -9,17 +9,33 @@ import socket
 import select
 import sys
 import threading
+import time
 from btcp.constants import *
 
 
-def handle_incoming_segments(btcp_socket, event, udp_socket):
+def tick_wait(btcp_socket):
+    """Seconds to wait for a segment before calling lossy_layer_tick:
+    TIMER_TICK ms, or less if the socket's next_timeout (on the wall clock)
+    comes sooner. 0 means a timer of the socket is due."""
+    wait = TIMER_TICK / 1000
+    deadline = btcp_socket.next_timeout()
+    if deadline is not None:
+        wait = max(0.0, min(wait, deadline - time.time()))
+    return wait
+
+
+def handle_incoming_segments(btcp_socket, event, udp_socket, layer):
     """This is the main method of the "network thread".
 
     Continuously read from the socket and whenever a segment arrives,
-    call the lossy_layer_segment_received method of the associated socket.
+    call the lossy_layer_segment_received method of the associated socket with
+    the segment and the address it came from. Segments are received with a
+    buffer of layer.segment_size bytes.
 
-    If no segment is received for TIMER_TICK ms, call the lossy_layer_tick
-    method of the associated socket.
+    If no segment is received for TIMER_TICK ms, or by the socket's
+    next_timeout, call the lossy_layer_tick method of the associated socket;
+    also right after a segment if next_timeout has passed, so timers run
+    while segments keep arriving, and when the layer gets kicked.
 
     When flagged, return from the function. This is used by LossyLayer's
     destructor. Note that destruction will *not* attempt to receive or send any
@@ -31,16 +47,19 @@ def handle_incoming_segments(btcp_socket, event, udp_socket):
     """
     while not event.is_set():
         # We do not block here, because we might never check the loop condition in that case
-        rlist, wlist, elist = select.select([udp_socket], [], [], TIMER_TICK / 1000)
-        if rlist:
-            segment, address = udp_socket.recvfrom(SEGMENT_SIZE)
-            btcp_socket.lossy_layer_segment_received(segment)
-            # We *assume* here that students aren't leaving multiple processes
-            # sending segments from different remote IPs and ports running.
-            # We *could* check the address for validity but then we'd have
-            # to resolve hostnames etc and honestly I don't see a pressing need
-            # for that.
-        else:
+        rlist, wlist, elist = select.select([udp_socket, layer._wake], [], [],
+                                            tick_wait(btcp_socket))
+        if udp_socket in rlist:
+            segment, address = udp_socket.recvfrom(layer.segment_size)
+            # Connected sockets can ignore the address; a listening socket
+            # uses it to find the connection the segment belongs to.
+            btcp_socket.lossy_layer_segment_received(segment, address)
+            if tick_wait(btcp_socket) == 0:
+                btcp_socket.lossy_layer_tick()
+        if layer._wake in rlist:
+            layer._wake.recv(4096)
+            btcp_socket.lossy_layer_tick()
+        elif not rlist:
             btcp_socket.lossy_layer_tick()
 
 
@@ -53,12 +72,25 @@ class LossyLayer:
     will signal that thread to end, join it, wait for it to terminate, then
     destroy its UDP socketet.
 
+    With reuse_port set, the UDP socket is bound with SO_REUSEPORT, so several
+    processes can bind the same address and the kernel spreads the remotes
+    over them by hashing the address 4-tuple.
+
+    segment_size is the largest segment expected. Sockets that negotiate a
+    larger payload size call set_segment_size, which also grows the socket
+    buffers to hold as many of the larger segments.
+
+    kick has the network thread call lossy_layer_tick right away, e.g.
+    because the application gave the socket something to send.
+
     Students should NOT need to modify any code in this class.
     """
-    def __init__(self, btcp_socket, local_ip, local_port, remote_ip, remote_port):
+    def __init__(self, btcp_socket, local_ip, local_port, remote_ip=None, remote_port=None,
+                 reuse_port=False):
         self._bTCP_socket = btcp_socket
         self._remote_ip = remote_ip
         self._remote_port = remote_port
+        self.segment_size = SEGMENT_SIZE
 
         self._udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -67,11 +99,19 @@ class LossyLayer:
         # socket.SO_NO_CHECK is not defined in Python, so hardcode the value
         # from /usr/include/asm-generic/socket.h:#define SO_NO_CHECK  11.
         self._udp_socket.setsockopt(socket.SOL_SOCKET, 11, 1)
+        if reuse_port:
+            self._udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self._udp_socket.bind((local_ip, local_port))
 
+        # kick writes to one end of the pair, the network thread wakes up on
+        # the other.
+        self._wake, self._kicker = socket.socketpair()
+        self._kicker.setblocking(False)
+
         self._event = threading.Event()
         self._thread = threading.Thread(target=handle_incoming_segments,
-                                        args=(self._bTCP_socket, self._event, self._udp_socket))
+                                        args=(self._bTCP_socket, self._event, self._udp_socket,
+                                              self))
         self._thread.start()
 
 
@@ -90,11 +130,33 @@ class LossyLayer:
             self._thread.join()
         if self._udp_socket is not None:
             self._udp_socket.close()
+            self._wake.close()
+            self._kicker.close()
         self._event = None
         self._thread = None
         self._udp_socket = None
 
 
+    def kick(self):
+        """Wake the network thread up to call lossy_layer_tick. Safe to call
+        from the application thread."""
+        try:
+            self._kicker.send(b'\x00')
+        except (BlockingIOError, OSError):
+            pass # already kicked plenty, or destroyed
+
+
+    def set_segment_size(self, size):
+        """Expect segments of up to size bytes."""
+        if size > self.segment_size and self._udp_socket is not None:
+            scale = size / self.segment_size
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                current = self._udp_socket.getsockopt(socket.SOL_SOCKET, option)
+                # The kernel caps this at net.core.[rw]mem_max.
+                self._udp_socket.setsockopt(socket.SOL_SOCKET, option, int(current * scale))
+        self.segment_size = size
+
+
     def send_segment(self, segment):
         """Put the segment into the network
 
@@ -104,3 +166,23 @@ class LossyLayer:
         bytes_sent = self._udp_socket.sendto(segment, (self._remote_ip, self._remote_port))
         if bytes_sent != len(segment):
             print("The lossy layer was only able to send {} bytes of that segment!".format(bytes_sent), file=sys.stderr)
+
+
+    def send_segment_parts(self, parts):
+        """Put the segment made of the buffers parts into the network as one
+        datagram, without joining them first: they are passed to the kernel
+        as separate iovecs (scatter I/O).
+        """
+        bytes_sent = self._udp_socket.sendmsg(parts, (), 0, (self._remote_ip, self._remote_port))
+        if bytes_sent != sum(map(len, parts)):
+            print("The lossy layer was only able to send {} bytes of that segment!".format(bytes_sent), file=sys.stderr)
+
+
+    def send_segment_to(self, segment, address):
+        """Put the segment into the network, addressed to address instead of
+        the remote address the layer was created with. Used by listening
+        sockets, which talk to many remotes over one lossy layer.
+        """
+        bytes_sent = self._udp_socket.sendto(segment, address)
+        if bytes_sent != len(segment):
+            print("The lossy layer was only able to send {} bytes of that segment!".format(bytes_sent), file=sys.stderr)
@@ -0,0 +1,84 @@
+"""
+Sender pacing and rate limiting.
+
+A sender that sends a whole window the moment it has room puts it into the
+network back to back. At the bottleneck of the path that burst has to wait
+in a buffer, and whatever doesn't fit gets dropped: loss the connection
+causes itself. Pacing spreads the segments over the round trip time instead,
+at PACING_GAIN times the rate the window allows (window segments per
+srtt), so a connection that isn't limited by the network still gets its
+whole window out in a round trip.
+
+Pacing and rate limits use token buckets: a bucket fills with rate tokens
+(bytes) per second up to burst tokens, and every segment sent takes its
+size. A segment may be sent as long as no bucket is in debt, so a bucket
+never holds back a segment larger than its burst forever.
+
+Besides its pacer, a socket can have a hard rate limit of its own
+(BTCPSocket.rate_limit), and limit_process caps all sockets of the process
+together.
+"""
+
+
+import threading
+
+
+PACING_GAIN = 1.25
+# The fewest segments a pacer lets go back to back, so the network thread
+# doesn't need to wake up for every single segment.
+PACING_BURST = 4
+
+
+class TokenBucket:
+    """rate tokens per second, at most burst of them. Times are in seconds
+    on whatever clock the caller uses; safe to share between network threads.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._time = None
+        self._lock = threading.Lock()
+
+
+    def _fill(self, now):
+        if self._time is not None and now > self._time:
+            self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+        if self._time is None or now > self._time:
+            self._time = now
+
+
+    def ready_at(self, now):
+        """When the bucket is out of debt: now, or later."""
+        with self._lock:
+            self._fill(now)
+            if self._tokens >= 0:
+                return now
+            return now - self._tokens / self.rate
+
+
+    def spend(self, now, amount):
+        """Take amount tokens, going into debt if there aren't that many."""
+        with self._lock:
+            self._fill(now)
+            self._tokens -= amount
+
+
+_process_bucket = None
+
+
+def limit_process(rate, burst=None):
+    """Cap all sockets of this process together at rate bytes per
+    second, letting burst bytes (default: a tenth of a second's worth) go at
+    once; None lifts the cap. The cap starts out full, and its clock is the
+    clock of the sockets using it: don't mix wall clock and simulated
+    sockets under one cap.
+    """
+    global _process_bucket
+    _process_bucket = None if rate is None else TokenBucket(rate, burst or rate / 10)
+
+
+def process_bucket():
+    """The TokenBucket of limit_process, or None."""
+    return _process_bucket
@@ -1,50 +1,118 @@
-
 #!/usr/local/bin/python3
+import collections
+import queue
+import select
 import threading
-import queue 
-import socket  
+import time
+from btcp.constants import *
 
-class send_packet(threading.Thread):
+class queue_delay:
+    """How long the segments of one class waited to be sent, in seconds.
+    Segments sent right away count as waiting 0."""
 
-    def __init__(self, buf, socket):
-        super().__init__()
-        self.buf = buf
-        self.socket = socket
-        self.running = True
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
 
-    def run(self):
-        while self.running:
-            try:
-                data, addr = self.buf.get(True, 1)
-                self.socket.sendto(data, addr)
-            except queue.Empty:
-                pass
-            except OSError:
-                break
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
 
-    def stop(self):
-        self.running = False
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class packet_io(threading.Thread):
+    """The single I/O thread of a bTCP connection.
+
+    Owns one non-blocking UDP socket. Received segments are handed to
+    dispatch, a callable taking a (segment, address) tuple such as the
+    put_nowait of a receive queue, straight from this thread.
+
+    Sending does not involve this thread at all as long as the socket accepts
+    the segment: send() calls sendto directly from the calling thread. Only if
+    the socket would block are segments kept in a backlog, which this thread
+    flushes once the socket becomes writable again.
 
-class receive_packet(threading.Thread):
+    There are two backlogs: control segments (SYN, ACK, FIN, sent with
+    control=True) never wait behind data. They are sent before any backlogged
+    data, and right away as long as no other control segment is waiting. How
+    long segments waited is kept per class in control_delay and data_delay.
 
-    def __init__(self, buf, socket):
+    Datagrams are received with a buffer of segment_size bytes; raise it for
+    connections with larger segments.
+    """
+
+    def __init__(self, dispatch, socket):
         super().__init__()
-        self.buf = buf
+        self.dispatch = dispatch
         self.socket = socket
+        self.socket.setblocking(False)
+        self.backlog = collections.deque()
+        self.control_backlog = collections.deque()
+        self.control_delay = queue_delay()
+        self.data_delay = queue_delay()
+        self.lock = threading.Lock()
         self.running = True
+        self.segment_size = SEGMENT_SIZE
 
-    def run(self):
-        while self.running:
+    def send(self, data, addr, control=False):
+        self.sendmsg((data,), addr, control)
+
+    def sendmsg(self, buffers, addr, control=False):
+        #scatter send: the datagram is the concatenation of buffers, which
+        #are passed to the kernel as separate iovecs without copying
+        backlog, delay = ((self.control_backlog, self.control_delay) if control
+                          else (self.backlog, self.data_delay))
+        with self.lock:
+            #data also waits for backlogged control segments
+            if not self.control_backlog and (control or not self.backlog):
+                try:
+                    self.socket.sendmsg(buffers, (), 0, addr)
+                    delay.add(0.0)
+                    return
+                except BlockingIOError:
+                    pass
+            backlog.append((buffers, addr, time.perf_counter()))
+
+    def flush(self):
+        with self.lock:
+            for backlog, delay in ((self.control_backlog, self.control_delay),
+                                   (self.backlog, self.data_delay)):
+                while backlog:
+                    buffers, addr, queued = backlog[0]
+                    try:
+                        self.socket.sendmsg(buffers, (), 0, addr)
+                    except BlockingIOError:
+                        return
+                    backlog.popleft()
+                    delay.add(time.perf_counter() - queued)
+
+    def receive(self):
+        while True:
+            try:
+                data, addr = self.socket.recvfrom(self.segment_size)
+            except BlockingIOError:
+                return
             try:
-                inf = self.socket.recvfrom(1016)
-                self.buf.put_nowait(inf)
+                self.dispatch((data, addr))
             except queue.Full:
                 pass
-            except socket.timeout:
-                pass
-            except OSError:
-                break
 
+    def run(self):
+        while self.running:
+            #only wait for the socket to become writable if something is waiting
+            wlist = [self.socket] if self.backlog or self.control_backlog else []
+            try:
+                rlist, wlist, elist = select.select([self.socket], wlist, [], TIMER_TICK / 1000)
+                if rlist:
+                    self.receive()
+                if wlist:
+                    self.flush()
+            except (OSError, ValueError):
+                break
 
     def stop(self):
-        self.running = False     
+        self.running = False
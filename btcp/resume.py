@@ -0,0 +1,244 @@
+"""
+Resumable file transfers.
+
+The receiver keeps a checkpoint next to the output file: the identity of the
+file being received, the byte ranges it has written so far, and a CRC-32 of
+the contents of every range, updated as the range grows. The checkpoint is
+rewritten (atomically, after the data itself is synced) every
+checkpoint_interval bytes, and removed once the file is complete.
+
+Resuming is negotiated in the handshake, using the handshake options of the
+bTCP sockets:
+    - the sender's SYN carries RESUME_REQUEST: the file identity and size;
+    - the receiver looks for a checkpoint with that identity, checks the
+      CRC-32 of every range against what is on disk, and answers in its
+      SYN|ACK with the ranges it already has (RANGE_COUNT followed by that
+      many RANGE entries), or none to start over.
+The sender then only sends what is missing, as records of a RANGE header
+(offset, length) followed by the data.
+"""
+
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+from btcp.constants import *
+
+
+RESUME_MAGIC = b'bTCPresm'
+RESUME_REQUEST = struct.Struct("!8s16sQ")
+RANGE_COUNT = struct.Struct("!H")
+RANGE = struct.Struct("!QQ")
+# As many ranges as fit in the SYN|ACK; a receiver with more starts over.
+MAX_RANGES = (PAYLOAD_SIZE - RANGE_COUNT.size) // RANGE.size
+
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_identity(path):
+    """Identity of the file at path: a 16 byte BLAKE2b digest of its contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                return digest.digest()
+            digest.update(block)
+
+
+def missing_ranges(size, ranges):
+    """The (offset, length) ranges of [0, size) not covered by ranges."""
+    missing = []
+    position = 0
+    for offset, length in sorted(ranges):
+        if offset > position:
+            missing.append((position, offset - position))
+        position = max(position, offset + length)
+    if position < size:
+        missing.append((position, size - position))
+    return missing
+
+
+def checkpoint_path(path):
+    return path + ".checkpoint"
+
+
+class ResumableReceiver:
+    """Receives one file into path, resuming from its checkpoint if the
+    sender offers the same file.
+
+    Set handshake as the handshake callback of the server socket (or listen
+    socket) before the sender connects, then call receive with the accepted
+    connection.
+    """
+
+    def __init__(self, path, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self._checkpoint_interval = checkpoint_interval
+        self._identity = None
+        self.size = None
+        # [offset, length, crc32] of every range written so far.
+        self.ranges = []
+        self.resumed = 0
+
+
+    def handshake(self, options):
+        """Answer the sender's RESUME_REQUEST with the ranges we already have."""
+        if len(options) < RESUME_REQUEST.size:
+            return b''
+        magic, identity, size = RESUME_REQUEST.unpack_from(options)
+        if magic != RESUME_MAGIC:
+            return b''
+        self._identity = identity
+        self.size = size
+        self.ranges = self._load_checkpoint(identity, size)
+        self.resumed = sum(length for offset, length, crc in self.ranges)
+        return RANGE_COUNT.pack(len(self.ranges)) + b''.join(
+            RANGE.pack(offset, length) for offset, length, crc in self.ranges)
+
+
+    def _load_checkpoint(self, identity, size):
+        """Ranges of a checkpoint for this file whose contents on disk are
+        still intact."""
+        try:
+            with open(checkpoint_path(self.path)) as file:
+                checkpoint = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if checkpoint.get("identity") != identity.hex() or checkpoint.get("size") != size:
+            return []
+        ranges = []
+        try:
+            with open(self.path, "rb") as file:
+                for offset, length, crc in checkpoint["ranges"][:MAX_RANGES]:
+                    file.seek(offset)
+                    value = 0
+                    remaining = length
+                    while remaining:
+                        block = file.read(min(BLOCK_SIZE, remaining))
+                        if not block:
+                            break
+                        value = zlib.crc32(block, value)
+                        remaining -= len(block)
+                    if not remaining and value == crc:
+                        ranges.append([offset, length, crc])
+        except OSError:
+            return []
+        return ranges
+
+
+    def _save_checkpoint(self, fd):
+        os.fsync(fd)
+        checkpoint = {"identity": self._identity.hex(), "size": self.size, "ranges": self.ranges}
+        temporary = checkpoint_path(self.path) + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary, checkpoint_path(self.path))
+
+
+    def receive(self, server):
+        """Write the records received on server into the file until the
+        sender disconnects. Returns whether the file is complete."""
+        if self.size is None:
+            return False
+        if not self.ranges:
+            # Starting over: don't keep whatever a different file left.
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        else:
+            flags = os.O_WRONLY | os.O_CREAT
+        fd = os.open(self.path, flags, 0o666)
+        header = bytearray()
+        current = None
+        remaining = 0
+        unsaved = 0
+        try:
+            while True:
+                data = memoryview(server.recv())
+                if not data:
+                    break
+                while data:
+                    if remaining == 0:
+                        missing = RANGE.size - len(header)
+                        header += data[:missing]
+                        data = data[missing:]
+                        if len(header) < RANGE.size:
+                            break
+                        offset, remaining = RANGE.unpack(header)
+                        header.clear()
+                        current = self._range_at(offset)
+                        continue
+                    chunk = data[:remaining]
+                    data = data[remaining:]
+                    written = 0
+                    while written < len(chunk):
+                        written += os.pwrite(fd, chunk[written:], current[0] + current[1] + written)
+                    current[1] += len(chunk)
+                    current[2] = zlib.crc32(chunk, current[2])
+                    remaining -= len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= self._checkpoint_interval:
+                        self._save_checkpoint(fd)
+                        unsaved = 0
+            complete = not missing_ranges(self.size, [(o, l) for o, l, c in self.ranges])
+            if complete:
+                os.ftruncate(fd, self.size)
+                try:
+                    os.unlink(checkpoint_path(self.path))
+                except FileNotFoundError:
+                    pass
+            else:
+                self._save_checkpoint(fd)
+            return complete
+        finally:
+            os.close(fd)
+
+
+    def _range_at(self, offset):
+        """The range a record starting at offset extends, creating it if no
+        range ends there."""
+        for entry in self.ranges:
+            if entry[0] + entry[1] == offset:
+                return entry
+        entry = [offset, 0, 0]
+        self.ranges.append(entry)
+        return entry
+
+
+def send_resumable(client, path, limit=None):
+    """Connect client offering the file at path, and send whatever the
+    receiver doesn't have yet. limit, if given, stops after that many bytes
+    of file data (to simulate a transfer that dies). Returns the number of
+    bytes of file data sent, or None if the connection failed.
+    """
+    size = os.path.getsize(path)
+    if not client.connect(RESUME_REQUEST.pack(RESUME_MAGIC, file_identity(path), size)):
+        return None
+    ranges = []
+    reply = client.handshake_reply
+    if len(reply) >= RANGE_COUNT.size:
+        count, = RANGE_COUNT.unpack_from(reply)
+        ranges = [RANGE.unpack_from(reply, RANGE_COUNT.size + i * RANGE.size)
+                  for i in range(min(count, (len(reply) - RANGE_COUNT.size) // RANGE.size))]
+
+    total = 0
+    with open(path, "rb") as file:
+        for offset, length in missing_ranges(size, ranges):
+            if limit is not None:
+                length = min(length, limit - total)
+                if length <= 0:
+                    break
+            client.sendall(RANGE.pack(offset, length))
+            file.seek(offset)
+            while length:
+                block = file.read(min(BLOCK_SIZE, length))
+                sent = client.sendall(block)
+                total += sent
+                if sent < len(block):
+                    # The connection went down.
+                    return total
+                length -= len(block)
+    return total
+
@@ -0,0 +1,181 @@
+"""
+Multi-process bTCP server.
+
+Checksums and the state machines run in Python, so one server process never
+uses more than one core. ServerPool forks a number of worker processes that
+each run a BTCPListenSocket on the same UDP address, bound with SO_REUSEPORT:
+the kernel hashes the 4-tuple of every client to one of the workers, so all
+segments of a connection end up in the same process.
+
+The supervisor (the process that created the ServerPool) restarts workers
+that die and adds up the statistics they report.
+
+    pool = ServerPool(4, window, timeout)
+    pool.start()
+    while serving:
+        pool.poll(1.0)
+        print(pool.stats())
+    pool.stop()
+"""
+
+
+import functools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from btcp.lossy_layer import LossyLayer
+from btcp.server_socket import BTCPListenSocket
+from btcp.constants import *
+
+
+STATS_INTERVAL = 1.0
+
+
+def discard(connection, received):
+    """Connection handler that receives everything and throws it away."""
+    while True:
+        data = connection.recv()
+        if not data:
+            return
+        received(len(data))
+
+
+def worker_main(index, window, timeout, address, backlog, handler, stats_queue, stop_event,
+                interval=STATS_INTERVAL):
+    """Main function of a worker process.
+
+    Accepts connections on address until stop_event is set and runs handler
+    on each of them in a thread of its own. handler gets the accepted
+    BTCPServerSocket and a function to call with the number of bytes whenever
+    it received some, and returns when the connection is closed. Every
+    interval seconds, and once more when stopping, a (pid, stats) tuple is put
+    into stats_queue; stats are totals since the worker started.
+    """
+    listener = BTCPListenSocket(window, timeout, backlog,
+                                functools.partial(LossyLayer, reuse_port=True),
+                                address=address)
+    stats = {"worker": index, "connections": 0, "active": 0, "bytes": 0, "syns_dropped": 0}
+    lock = threading.Lock()
+
+    def received(count):
+        with lock:
+            stats["bytes"] += count
+
+    def serve(connection):
+        handler(connection, received)
+        connection.close()
+        with lock:
+            stats["active"] -= 1
+
+    def report():
+        with lock:
+            stats["syns_dropped"] = listener.syns_dropped
+            stats_queue.put((os.getpid(), dict(stats)))
+
+    next_report = time.time() + interval
+    try:
+        while not stop_event.is_set():
+            connection = listener.accept(min(0.1, interval))
+            if connection is not None:
+                with lock:
+                    stats["connections"] += 1
+                    stats["active"] += 1
+                threading.Thread(target=serve, args=(connection,), daemon=True).start()
+            if time.time() >= next_report:
+                report()
+                next_report = time.time() + interval
+    finally:
+        report()
+        listener.close()
+
+
+class ServerPool:
+    """Supervisor of worker processes sharing one bTCP server address.
+
+    handler is called with every accepted connection, in the worker process;
+    it must be picklable (a module level function, or a functools.partial of
+    one) and defaults to discard.
+    """
+
+    def __init__(self, workers, window, timeout, address=(SERVER_IP, SERVER_PORT),
+                 backlog=128, handler=discard, interval=STATS_INTERVAL):
+        self._window = window
+        self._timeout = timeout
+        self._address = address
+        self._backlog = backlog
+        self._handler = handler
+        self._interval = interval
+        self._stats_queue = multiprocessing.Queue()
+        self._stop_event = multiprocessing.Event()
+        self._processes = [None] * workers
+        # Latest report of every worker process ever started, by pid, so the
+        # work of a worker that died still counts after its restart.
+        self._reports = {}
+
+        self.restarts = 0
+
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(index, self._window, self._timeout, self._address, self._backlog,
+                  self._handler, self._stats_queue, self._stop_event, self._interval),
+            daemon=True)
+        process.start()
+        self._processes[index] = process
+
+
+    def start(self):
+        """Start all workers."""
+        for index in range(len(self._processes)):
+            self._spawn(index)
+
+
+    def poll(self, timeout=0):
+        """Collect the reports that came in within timeout seconds, and restart
+        workers that died."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                pid, stats = self._stats_queue.get(True, max(0, deadline - time.time()))
+                self._reports[pid] = stats
+            except queue.Empty:
+                break
+        if self._stop_event.is_set():
+            return
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                process.join()
+                self.restarts += 1
+                self._spawn(index)
+
+
+    def stats(self):
+        """Totals over all workers: connections accepted, connections still
+        active, bytes received, SYNs dropped, and workers alive."""
+        alive = {process.pid for process in self._processes
+                 if process is not None and process.is_alive()}
+        totals = {"connections": 0, "active": 0, "bytes": 0, "syns_dropped": 0}
+        for pid, stats in self._reports.items():
+            for key in totals:
+                # Connections of a dead worker are gone, whatever it said last.
+                if key != "active" or pid in alive:
+                    totals[key] += stats[key]
+        totals["workers"] = len(alive)
+        totals["restarts"] = self.restarts
+        return totals
+
+
+    def stop(self):
+        """Stop all workers and collect their final reports."""
+        self._stop_event.set()
+        for process in self._processes:
+            if process is not None:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        self.poll()
+        self._processes = [None] * len(self._processes)
@@ -1,13 +1,16 @@
-from btcp.btcp_socket import BTCPSocket, BTCPStates
+import collections
+import functools
+import heapq
+import itertools
+import queue
+import struct
+from btcp.btcp_socket import NAK, BTCPSocket, BTCPStates
+from btcp.clock import WallClock
+from btcp.compression import StreamDecompressor
+from btcp.fec import payload_value, unpack_group, value_payload
 from btcp.lossy_layer import LossyLayer
 from btcp.constants import *
 
-#our own imports
-from poster import *
-from random import getrandbits
-import queue
-
-
 
 class BTCPServerSocket(BTCPSocket):
     """bTCP server socket
@@ -38,45 +41,97 @@ class BTCPServerSocket(BTCPSocket):
     """
 
 
-    def __init__(self, window, timeout, source):
+    def __init__(self, window, timeout, layer=LossyLayer, clock=None,
+                 local_address=(SERVER_IP, SERVER_PORT), remote_address=(CLIENT_IP, CLIENT_PORT)):
         """Constructor for the bTCP server socket. Allocates local resources
         and starts an instance of the Lossy Layer.
 
+        window is the number of segments the server is willing to buffer out
+        of order, timeout the time in milliseconds to wait for the client's
+        final ack during termination.
+
+        layer selects the lossy layer implementation: LossyLayer (UDP, the
+        default) or any class with the same constructor and send_segment /
+        destroy methods, e.g. btcp.loopback_layer.LoopbackLayer when the
+        client lives in the same process. clock is used for all timing and
+        defaults to the wall clock. local_address and remote_address are the
+        (ip, port) of this socket and of the client; to serve more than one
+        client, use a BTCPListenSocket instead.
+
         You can extend this method if you need additional attributes to be
         initialized, but do *not* call accept from here.
         """
         super().__init__(window, timeout)
-        self._lossy_layer = LossyLayer(self, SERVER_IP, SERVER_PORT, CLIENT_IP, CLIENT_PORT)
-        
-        self.connection = False
-        self.source = source
-        
-        self.window = window
-        self.timeout = timeout
+        self._clock = clock if clock is not None else WallClock()
+        self._state = BTCPStates.ACCEPTING
 
         # The data buffer used by lossy_layer_segment_received to move data
         # from the network thread into the application thread. Bounded in size.
-        # If data overflows the buffer it will get lost -- that's what window
-        # size negotiation should solve.
-        # For this rudimentary implementation, we simply hope receive manages
-        # to be faster than send.
-        self._sendbuf = queue.Queue(maxsize=1000)
-        self._receivebuf = queue.Queue(maxsize=1000)
-        
-        #set socket
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        #set timeout in seconds
-        self.socket.settimeout(1.5)
-        
-        #setup segment receival and segment sending
-        self.seg_sen = send_packet(self._sendbuf, self.socket)
-        self.seg_rec = receive_packet(self._receivebuf, self.socket)
-        
-    def start(self):
-        self.socket.bind(self.source)
-        self.seg_rec.start()
-        self.seg_sen.start()
+        # Data that does not fit is not acknowledged, so the client sends it
+        # again later.
+        self._recvbuf = queue.Queue(maxsize=1000)
+
+        # Out of order segments within the window, by (unbounded) sequence
+        # number, waiting for the gap before them to be filled.
+        self._reassembly = {}
+        self._expected = None
+        self._deadline = None
+
+        # Called with the handshake options of the client's SYN; what it
+        # returns is sent back in the SYN|ACK. Set before the client connects.
+        self.handshake = None
+        self.handshake_options = b''
+        self._syn_reply = b''
+
+        # Whether to agree to a client asking for a compressed stream, and
+        # the decompressor once we did.
+        self.compression = True
+        self._decompressor = None
+
+        # Where data goes instead of the receive buffer, if set: an object
+        # with a write(index, data) method that places the payload of the
+        # index-th data segment (btcp.file_io.OffsetWriter), answers
+        # whether it has segment index with `in`, and counts the segments it
+        # has from the start without a gap in contiguous. Set before the
+        # client connects.
+        self.writer = None
+        self._first = None
+
+        # Forward error correction: payloads of recent data segments by
+        # (unbounded) sequence number, and the parity segments that can't be
+        # used yet, by (first sequence number, j), as (group members, XOR of
+        # their lengths, XOR of their payloads).
+        self._fec_payloads = {}
+        self._parities = {}
+        self.repaired = 0
+
+        # Checksum algorithms to agree to when a client asks for one.
+        self.checksums = {CRC32_CHECKSUM, ADLER32_CHECKSUM}
+
+        # Largest payload size to agree to, and the largest agreed to so far.
+        # Our own data goes in segments of PAYLOAD_SIZE, which every client
+        # can take.
+        self.max_payload = MAX_PAYLOAD_SIZE
+        self._agreed_payload = PAYLOAD_SIZE
+
+        # Whether the client sent its FIN, which gets answered once all data
+        # sent to it is acknowledged. The handshake gives the first round
+        # trip time sample of that data.
+        self._fin_received = False
+        self._synack_time = None
+
+        # Delayed ACKs (see BTCPSocket._acknowledge): whether to delay them,
+        # how many segments are waiting for one and when it is due. acks_sent
+        # counts the ACKs sent for data, not the data segments carrying one.
+        self.delayed_ack = True
+        self._acks_owed = 0
+        self._ack_deadline = None
+        self.acks_sent = 0
+
+        # Create the lossy layer last: its network thread starts calling our
+        # callbacks right away.
+        self._lossy_layer = None
+        self._lossy_layer = layer(self, *local_address, *remote_address)
 
     ###########################################################################
     ### The following section is the interface between the transport layer  ###
@@ -96,7 +151,7 @@ class BTCPServerSocket(BTCPSocket):
     ### layer thread: Queues are inherently threadsafe, Lists are not.      ###
     ###########################################################################
 
-    def lossy_layer_segment_received(self, segment):
+    def lossy_layer_segment_received(self, segment, address=None):
         """Called by the lossy layer whenever a segment arrives.
 
         Things you should expect to handle here (or in helper methods called
@@ -109,25 +164,255 @@ class BTCPServerSocket(BTCPSocket):
             - any other handling of the header received from the client
 
         Remember, we expect you to implement this *as a state machine!*
-        """
-
-        raise NotImplementedError("Only rudimentary implementation of lossy_layer_segment_received present. Read the comments & code of server_socket.py, then remove the NotImplementedError.")
 
-        # Get length from header. Change this to a proper segment header unpack
-        # after implementing BTCPSocket.unpack_segment_header in btcp_socket.py
-        datalen, = struct.unpack("!H", segment[6:8])
-        # Slice data from incoming segment.
-        chunk = segment[HEADER_SIZE:HEADER_SIZE + datalen]
-        # Pass data into receive buffer so that the application thread can
-        # retrieve it.
+        address is where the segment came from, if the lossy layer knows. A
+        connected socket only hears from its peer, so it is not used here.
+        segment may be a view of the lossy layer's buffer, valid only until
+        this returns (see SharedMemoryLayer): whatever is kept is copied.
+        """
+        if not self.verify_segment(segment):
+            # Corrupted; the client will send it again.
+            self._checksum_failed()
+            return
+        seqnum, acknum, flags, window, length, checksum = \
+            self.unpack_segment_header(segment[:HEADER_SIZE])
+        algorithm = flags & CHECKSUM_MASK
+        flags &= ~CHECKSUM_MASK
+
+        if flags & ~COMPRESS_FLAG == SYN_FLAG:
+            if self._state == BTCPStates.ACCEPTING:
+                self.handshake_options = bytes(segment[HEADER_SIZE:HEADER_SIZE + length])
+                if self.handshake is not None:
+                    self._syn_reply = self.handshake(self.handshake_options)
+                if (algorithm in self.checksums
+                        and len(self._syn_reply) <= self.payload_size(algorithm)):
+                    self._checksum = algorithm
+                self._payload_size = self.payload_size(self._checksum)
+                if flags & COMPRESS_FLAG and self.compression and self.writer is None:
+                    self._decompressor = StreamDecompressor()
+            if self._state in (BTCPStates.ACCEPTING, BTCPStates.SYN_RCVD):
+                # A SYN sent again makes the handshake useless as a round
+                # trip time sample.
+                self._synack_time = (self._clock.time() if self._state == BTCPStates.ACCEPTING
+                                     else None)
+                self._expected = self._first = seqnum + 1
+                self._state = BTCPStates.SYN_RCVD
+                # The acknowledgement number of a SYN is the payload size the
+                # client asks for (0 from clients that don't know about it).
+                size = max(PAYLOAD_SIZE, min(acknum or PAYLOAD_SIZE, self.max_payload,
+                                             self._max_segment_size() - HEADER_SIZE))
+                if size > self._agreed_payload:
+                    self._agreed_payload = size
+                    self._set_segment_size(HEADER_SIZE + size)
+                self._send_control(syn_set=True, ack_set=True, payload_size=size)
+
+        elif flags == FIN_FLAG:
+            if self._state in (BTCPStates.SYN_RCVD, BTCPStates.ESTABLISHED, BTCPStates.CLOSING):
+                self._fin_received = True
+                self._answer_fin()
+
+        elif flags & ~NAK_FLAG == ACK_FLAG:
+            if self._state == BTCPStates.SYN_RCVD:
+                self._state = BTCPStates.ESTABLISHED
+                if self._synack_time is not None:
+                    self.srtt = self._clock.time() - self._synack_time
+            elif self._state == BTCPStates.CLOSING:
+                # The answer to the FIN|ACK, which comes after all our data,
+                # not a late ACK of that data.
+                if self.unwrap_seqnum(acknum, self._next_seqnum) == self._next_seqnum + 1:
+                    self._state = BTCPStates.CLOSED
+            if self._state == BTCPStates.ESTABLISHED:
+                self._count_failures(length)
+                if flags & NAK_FLAG:
+                    self._handle_nak(segment[HEADER_SIZE:])
+                self._handle_ack(self.unwrap_seqnum(acknum, self._base), duplicate=True)
+                self._send_pending()
+
+        elif flags == 0 and self._state in (BTCPStates.SYN_RCVD, BTCPStates.ESTABLISHED):
+            self._state = BTCPStates.ESTABLISHED
+            self._two_way = True
+            if len(segment) < SEGMENT_SIZE:
+                self._peer_unpadded = True
+            self._handle_ack(self.unwrap_seqnum(acknum, self._base))
+            seqnum = self.unwrap_seqnum(seqnum, self._expected)
+            chunk = bytes(segment[HEADER_SIZE:HEADER_SIZE + length])
+            expected = self._expected
+            self._handle_data(seqnum, chunk)
+            self._remember_payload(seqnum, chunk)
+            repaired = self._repair_all()
+            if seqnum == expected and self._expected == expected + 1 and not repaired:
+                self._acknowledge()
+            else:
+                # Anything before an early segment that hasn't arrived is
+                # missing.
+                self._send_control(ack_set=True, parity_set=repaired,
+                                   naks=self._missing(seqnum - 1) if seqnum > self._expected else ())
+            self._send_pending()
+
+        elif flags == PARITY_FLAG and self._state in (BTCPStates.SYN_RCVD, BTCPStates.ESTABLISHED):
+            first = self.unwrap_seqnum(seqnum, self._expected)
+            n, k, j = unpack_group(acknum)
+            members = range(first + j, first + n, k)
+            if members and members[-1] >= self._expected:
+                width = self.payload_size(algorithm, len(segment) - HEADER_SIZE)
+                self._parities[(first, j)] = (
+                    members, length,
+                    payload_value(segment[HEADER_SIZE:HEADER_SIZE + width], width), width)
+                if self._repair_all():
+                    self._send_control(ack_set=True, parity_set=True)
+
+
+    def _send_pending(self):
+        """Send data from the send buffer for as long as the window has
+        room, and answer the client's FIN once all of it is acknowledged.
+        Called when the client acknowledges data, and on ticks.
+        """
+        if self._state != BTCPStates.ESTABLISHED:
+            return
+        self._send_new_data()
+        if self._fin_received:
+            self._answer_fin()
+
+
+    def _answer_fin(self):
+        """Answer the client's FIN (again) with a FIN|ACK, unless data sent
+        to the client is still waiting to be acknowledged. The client keeps
+        sending its FIN until then."""
+        if self._unacked or not self._sendbuf.empty() or self._rest:
+            return
+        self._state = BTCPStates.CLOSING
+        self._deadline = self._clock.time() + self._timeout / 1000
+        self._send_control(ack_set=True, fin_set=True)
+
+
+    def _send_ack(self, naks=()):
+        self._send_control(ack_set=True, naks=naks)
+
+
+    def _handle_data(self, seqnum, chunk):
+        """Deliver chunk in order to the application, or keep it for
+        reassembly if it arrived early. With a writer, every chunk in the
+        window goes straight to it instead."""
+        if self.writer is not None:
+            if self._expected <= seqnum < self._expected + self._window:
+                self.writer.write(seqnum - self._first, chunk)
+                self._expected = self._first + self.writer.contiguous
+        elif seqnum == self._expected:
+            if not self._deliver(chunk):
+                return
+            while self._expected in self._reassembly:
+                if not self._deliver(self._reassembly[self._expected]):
+                    return
+                del self._reassembly[self._expected - 1]
+        elif self._expected < seqnum < self._expected + self._window:
+            self._reassembly[seqnum] = chunk
+
+
+    def _remember_payload(self, seqnum, chunk):
+        """Keep the payload of a data segment for rebuilding others from
+        parity. A block is at most 256 segments, so nothing before that many
+        segments before the next expected one is needed any more."""
+        self._fec_payloads[seqnum] = chunk
+        if len(self._fec_payloads) > 2 * (self._window + 256):
+            oldest = self._expected - 256
+            self._fec_payloads = {s: c for s, c in self._fec_payloads.items() if s >= oldest}
+            self._parities = {key: parity for key, parity in self._parities.items()
+                              if parity[0][-1] >= self._expected}
+
+
+    def _repair_all(self):
+        """Rebuild every segment that is the only one missing from the group
+        of a parity segment. Returns whether any segment was rebuilt."""
+        repaired = False
+        progress = True
+        while progress and self._parities:
+            progress = False
+            for key, (members, length, value, width) in list(self._parities.items()):
+                if members[-1] < self._expected:
+                    # Everything in the group has been delivered.
+                    del self._parities[key]
+                    continue
+                missing = [s for s in members if s not in self._fec_payloads]
+                if len(missing) != 1:
+                    if not missing:
+                        del self._parities[key]
+                    continue
+                for s in members:
+                    if s != missing[0]:
+                        chunk = self._fec_payloads[s]
+                        value ^= payload_value(chunk, width)
+                        length ^= len(chunk)
+                del self._parities[key]
+                if not 0 <= length <= width:
+                    continue
+                chunk = value_payload(value, length, width)
+                self._handle_data(missing[0], chunk)
+                self._remember_payload(missing[0], chunk)
+                self.repaired += 1
+                repaired = progress = True
+        return repaired
+
+
+    def _arrived(self, seqnum):
+        return (seqnum in self._reassembly
+                or self.writer is not None and seqnum - self._first in self.writer)
+
+
+    def _deliver(self, chunk):
+        """Pass chunk into the receive buffer for the application thread.
+        Returns False if the buffer is full, in which case the chunk is not
+        acknowledged.
+        """
         try:
             self._recvbuf.put_nowait(chunk)
         except queue.Full:
-            # Data gets silently dropped if the receive buffer is full. You
-            # need to ensure this doesn't happen by using window sizes and not
-            # acknowledging dropped data.
-            pass
+            return False
+        self._expected += 1
+        return True
+
 
+    def next_timeout(self):
+        """Time (according to the socket's clock) by which lossy_layer_tick
+        has to be called, or None if no timer is running.
+        """
+        deadlines = [self._ack_deadline, self._retransmit_deadline, self._tlp_deadline,
+                     self._pace_deadline]
+        if self._state == BTCPStates.CLOSING:
+            deadlines.append(self._deadline)
+        return min((deadline for deadline in deadlines if deadline is not None), default=None)
+
+
+    def _send_control(self, syn_set=False, ack_set=False, fin_set=False, parity_set=False,
+                      payload_size=PAYLOAD_SIZE, naks=()):
+        """Send a segment without data, acknowledging everything received in
+        order so far. The SYN|ACK carries the answer to the handshake
+        options, agrees to compression if the client asked for it, and is
+        padded to payload_size, the payload size agreed to; the others are
+        padded only if neither end adapts its payload size. An ACK with
+        parity_set tells the client a segment was rebuilt from parity. The
+        length field of the others carries the checksum failure count. naks
+        are (unbounded) sequence numbers to name as missing in a NAK. The
+        FIN|ACK takes the sequence number after our data."""
+        data = self._syn_reply if syn_set else b''
+        if naks:
+            data = NAK.pack(len(naks)) + struct.pack("!{}H".format(len(naks)),
+                                                     *(seqnum & 0xFFFF for seqnum in naks))
+            self.naks_sent += 1
+        if ack_set and not syn_set:
+            self._ack_sent()
+            if not fin_set:
+                self.acks_sent += 1
+        seqnum = self._next_seqnum & 0xFFFF if fin_set else self._isn
+        segment = self.build_segment(seqnum, self._expected & 0xFFFF,
+                                     syn_set, ack_set, fin_set, window=self._window,
+                                     data=data, nak_set=bool(naks),
+                                     length=None if syn_set else self.checksum_failures & 0xFFFF,
+                                     compress_set=syn_set and self._decompressor is not None,
+                                     parity_set=parity_set, algorithm=self._checksum,
+                                     payload_size=payload_size if syn_set
+                                     else self._control_padding())
+        self._count_sent(len(segment))
+        self._lossy_layer.send_segment(segment)
 
     def lossy_layer_tick(self):
         """Called by the lossy layer whenever no segment has arrived for
@@ -150,9 +435,15 @@ class BTCPServerSocket(BTCPSocket):
         candidate to put in a helper method which can be called from either
         lossy_layer_segment_received or lossy_layer_tick.
         """
-        pass # present to be able to remove the NotImplementedError without having to implement anything yet.
-        raise NotImplementedError("No implementation of lossy_layer_tick present. Read the comments & code of server_socket.py.")
-
+        now = self._clock.time()
+        # The client's final ack got lost; the connection is over anyway.
+        if (self._state == BTCPStates.CLOSING and self._deadline is not None
+                and now >= self._deadline):
+            self._state = BTCPStates.CLOSED
+        if self._ack_deadline is not None and now >= self._ack_deadline:
+            self._send_ack()
+        self._handle_send_timers()
+        self._send_pending()
 
     ###########################################################################
     ### You're also building the socket API for the applications to use.    ###
@@ -183,7 +474,7 @@ class BTCPServerSocket(BTCPSocket):
     ### above.                                                              ###
     ###########################################################################
 
-    def accept(self, timeout):
+    def accept(self, timeout=None):
         """Accept and perform the bTCP three-way handshake to establish a
         connection.
 
@@ -199,141 +490,16 @@ class BTCPServerSocket(BTCPSocket):
         wasting a lot of CPU time) ensures that thread B will wait until the
         boolean or enum has the expected value. We do not think you will need
         more advanced thread synchronization in this project.
+
+        timeout is given in seconds; None waits forever.
         """
-        
-        #check if there is no connection yet
-        if (self.connection):
-            print("ERROR: there is already an connection present (server)")
-            exit()
-            
-        print("Server starting phase one of three way handshake")
-
-        sock = BTCPSocket(self.window, self.timeout)            
-        
-        #! received SYN packet
-        data, addr = self._recvbuf.get()
-        
-        #check if header is long enough
-        if len(data) < 16:
-            raise ValueError("header is not long enough")
-        
-        #specify payload
-        payload = bytes(1000)
-        
-        #get unpacked header
-        header_temp = sock.unpack_segment_header(data)
-        
-        #unpack header
-        syn_number = header_temp[0]
-        ack_number = header_temp[1]
-        flag_byte = header_temp[2]
-        window = header_temp[3]
-        length = header_temp[4]
-        
-        #this is the given checksum
-        checksum = header_temp[5]
-        
-        #we calculate our own checksum from our data to compare
-        checksum_comp = sock.in_cksum(sock.build_segment_header(header_temp) + payload)
-        
-        if ( header_temp is None
-            #check that SYN == 1
-            or syn_number != 1
-            #check that ack != 1
-            or ack_number == 1
-            #check that the checksum works
-            or checksum != checksum_comp
-            
-        ):
-            #if any of these conditions is true, we return False for the entire function
-            return False
-        
-        print(f"A client from {addr} tries to connect.")
-        
-        #! send SYN-ACK package
-        #ack = syn + 1
-        ack_num = syn_number + 1
-                
-        #the seq num is 0 as we do not need it, flag = 0x3 (syn ack)
-        temp_header = (0, ack_num, '0x3', self.window, 0, 0)
-        
-        #create a payload
-        payload = bytes(1000)
-
-        #generate checksum
-        checksum = sock.in_cksum(sock.build_segment_header(temp_header) + payload)
-
-        #use checksum for full header
-        header = (0, ack_num, '0x3', self.window, 0, checksum)
-
-        #pack header for usage inside pack and create packet
-        pack = (sock.build_segment_header(header), payload)
-
-        #add package to sendbuf
-        self._sendbuf.put(pack)
-        
-        print("Syn-ack was succesfully send")
-        
-        #! received ACK package
-        
-        try:
-            data, addr = self._receivebuf.get(True, self.timeout)
-            
-            #check if header is long enough
-            if len(data) < 16:
-                raise ValueError("header is not long enough")
-            
-            #specify payload
-            payload = bytes(1000)
-            
-            #get unpacked header
-            header_temp = sock.unpack_segment_header(data)
-            
-            #unpack header
-            syn_number = header_temp[0]
-            ack_number = header_temp[1]
-            flag_byte = header_temp[2]
-            window = header_temp[3]
-            length = header_temp[4]
-            
-            #this is the given checksum
-            checksum = header_temp[5]
-            
-            #we calculate our own checksum from our data to compare
-            checksum_comp = sock.in_cksum(sock.build_segment_header(header_temp) + payload)
-            
-            #if the conditions dont hold we pass the try
-            if ( header_temp is None
-                #check that SYN == 1
-                or syn_number == 1
-                #check that ack != 1
-                or ack_number != 1
-                #check that the window works
-                or self.window != window 
-                #check that the checksum works
-                or checksum != checksum_comp
-                
-            ):
-                pass
-        except queue.Empty:
-            return False   
-
-        #if I am reached the try succeeded
-        print(f"Connected server with {addr}")
-        
-        #we only return after finishing the connection
-        #TODO: maybe set some more self values here
-        self.connection = True
+        start = self._clock.time()
+        while self._state in (BTCPStates.ACCEPTING, BTCPStates.SYN_RCVD):
+            if timeout is not None and self._clock.time() - start >= timeout:
+                return False
+            self._clock.sleep(0.001)
         return True
 
-
-
-        #pass # present to be able to remove the NotImplementedError without having to implement anything yet.
-        #raise NotImplementedError("No implementation of accept present. Read the comments & code of server_socket.py.")
-
-        
-
-
     def recv(self):
         """Return data that was received from the client to the application in
         a reliable way.
@@ -364,32 +530,45 @@ class BTCPServerSocket(BTCPSocket):
         that the connection has been terminated.
 
         Again, you should feel free to deviate from how this usually works.
-        """
-
-        raise NotImplementedError("Only rudimentary implementation of recv present. Read the comments & code of server_socket.py, then remove the NotImplementedError.")
 
-        # Rudimentary example implementation:
+        On a compressed connection, the data returned is decompressed.
+        """
         # Empty the queue in a loop, reading into a larger bytearray object.
-        # Once empty, return the data as bytes.
-        # If no data is received for 10 seconds, this returns no data and thus
-        # signals disconnection to the server application.
-        # Proper handling should use the bTCP state machine to check that the
-        # client has disconnected when a timeout happens, and keep blocking
-        # until data has actually been received if it's still connected.
+        # Once empty, return the data as bytes. While nothing arrives, keep
+        # blocking for as long as the client is still connected.
         data = bytearray()
-        try:
-            # Wait until one segment becomes available in the buffer, or
-            # timeout signalling disconnect.
-            data.extend(self._recvbuf.get(block=True, timeout=10))
-            while True:
-                # Empty the rest of the buffer, until queue.Empty exception
-                # exits the loop. If that happens, data contains received
-                # segments so that will *not* signal disconnect.
-                data.extend(self._recvbuf.get_nowait())
-        except queue.Empty:
-            pass # (Not break: the exception itself has exited the loop)
+        while not data:
+            try:
+                data.extend(self._clock.get(self._recvbuf, TIMER_TICK / 1000))
+                while True:
+                    # Empty the rest of the buffer, until queue.Empty exception
+                    # exits the loop.
+                    data.extend(self._recvbuf.get_nowait())
+            except queue.Empty:
+                if not data and (self._fin_received
+                                 or self._state in (BTCPStates.CLOSING, BTCPStates.CLOSED)):
+                    break
+            if data and self._decompressor is not None:
+                # May be empty while a frame is incomplete; then keep waiting.
+                data = self._decompressor.decompress(data)
         return bytes(data)
 
+    def send(self, data):
+        """Send data to the client, which reads it with recv; the connection
+        carries data both ways. Like BTCPClientSocket.send, this doesn't block:
+        it returns the number of bytes that fit in the send buffer, and the
+        application retries with the rest. Data to the client isn't
+        compressed, and goes in segments of PAYLOAD_SIZE; otherwise it is
+        sent the way the client sends its own (see BTCPClientSocket.send):
+        read-only data isn't copied, small writes are gathered unless nodelay
+        is set, and pacing, rate_limit, NAKs and adaptive work the same.
+
+        Data can be sent until the client shut the connection down and
+        everything sent is acknowledged; then 0 is returned.
+        """
+        if self._state != BTCPStates.ESTABLISHED:
+            return 0
+        return self._buffer(data)
 
     def close(self):
         """Cleans up any internal state by at least destroying the instance of
@@ -416,3 +595,228 @@ class BTCPServerSocket(BTCPSocket):
     def __del__(self):
         """Destructor. Do not modify."""
         self.close()
+
+
+class ConnectionLayer:
+    """Lossy layer of a connection accepted by a BTCPListenSocket.
+
+    Does not own a network endpoint: segments are sent through the lossy layer
+    of the listening socket, addressed to the remote of this connection, and
+    incoming segments are passed in by the listening socket. Creating the
+    layer registers the connection in the listener's connection table,
+    destroying it removes it again.
+    """
+
+    def __init__(self, listener, btcp_socket, local_ip, local_port, remote_ip, remote_port):
+        self._listener = listener
+        self._remote = (remote_ip, remote_port)
+        listener._connections[self._remote] = btcp_socket
+
+
+    def destroy(self):
+        """Remove the connection from the listener's table. Safe to call
+        multiple times."""
+        if self._listener is not None:
+            self._listener._forget(self._remote)
+        self._listener = None
+
+
+    @property
+    def max_segment_size(self):
+        layer = self._listener._lossy_layer if self._listener is not None else None
+        return getattr(layer, "max_segment_size", MAX_SEGMENT_SIZE)
+
+
+    def set_segment_size(self, size):
+        """The listener's layer receives for all connections, so only ever
+        grow its segment size."""
+        layer = self._listener._lossy_layer if self._listener is not None else None
+        if hasattr(layer, "set_segment_size") and size > layer.segment_size:
+            layer.set_segment_size(size)
+
+
+    def kick(self):
+        """Have the listener tick this connection right away."""
+        if self._listener is not None:
+            self._listener._kicked.append(self._remote)
+            self._listener._kick()
+
+
+    def schedule(self, deadline):
+        """Have the listener tick this connection by deadline, instead of
+        only on its next sweep."""
+        if self._listener is not None:
+            self._listener._schedule_connection(deadline, self._remote)
+
+
+    def send_segment(self, segment):
+        if self._listener is not None and self._listener._lossy_layer is not None:
+            self._listener._lossy_layer.send_segment_to(segment, self._remote)
+
+
+class BTCPListenSocket(BTCPSocket):
+    """bTCP listening socket, serving any number of clients on one address.
+
+    Every client gets a BTCPServerSocket of its own, returned by accept once
+    the three-way handshake with it has completed. All of them share the lossy
+    layer of the listening socket: incoming segments are demultiplexed by the
+    (ip, port) they came from through the connection table, a dict from remote
+    address to connection, and handed to that connection's state machine in
+    the network thread.
+
+    A SYN from an unknown address creates a half-open connection. At most
+    backlog connections can be half-open or established but not yet accepted;
+    SYNs beyond that are dropped (and counted in syns_dropped), so the client
+    retries later. Half-open connections whose client went away are forgotten
+    after MAX_RETRIES timeouts.
+
+    Needs a lossy layer that passes the source address to
+    lossy_layer_segment_received and has send_segment_to: LossyLayer,
+    LoopbackLayer and SimulatedLossyLayer do, SharedMemoryLayer does not.
+    """
+
+
+    def __init__(self, window, timeout, backlog=128, layer=LossyLayer, clock=None,
+                 address=(SERVER_IP, SERVER_PORT), handshake=None, compression=True,
+                 checksums=None):
+        """window and timeout are passed on to every accepted BTCPServerSocket,
+        and so is handshake, the callback answering handshake options,
+        compression, whether to agree to compressed streams, and checksums,
+        the checksum algorithms to agree to (by default all). layer,
+        clock and address have the same meaning as for BTCPServerSocket; the
+        layer is created without a remote address.
+        """
+        super().__init__(window, timeout)
+        self.handshake = handshake
+        self.compression = compression
+        self.checksums = checksums
+        self._clock = clock if clock is not None else WallClock()
+        self._address = address
+        self._backlog = backlog
+
+        # Remote address -> BTCPServerSocket, for every connection that is not
+        # closed yet. Filled and emptied by ConnectionLayer.
+        self._connections = {}
+        # Remote address -> time of the SYN, for connections still in the
+        # handshake.
+        self._half_open = {}
+        # Established connections waiting for accept.
+        self._accept_queue = queue.Queue()
+        self._layer = functools.partial(ConnectionLayer, self)
+        self._next_sweep = self._clock.time()
+        # Connections to tick before their next sweep: a heap of (deadline,
+        # tie breaker, remote address) scheduled by their timers, and the
+        # addresses of those their application kicked.
+        self._timers = []
+        self._timer_order = itertools.count()
+        self._kicked = collections.deque()
+
+        self.syns_dropped = 0
+
+        self._lossy_layer = None
+        self._lossy_layer = layer(self, *address)
+
+
+    def lossy_layer_segment_received(self, segment, address=None):
+        """Pass the segment to the connection of the address it came from,
+        creating a half-open connection for a SYN from a new address."""
+        connection = self._connections.get(address)
+        if connection is None:
+            if not self.verify_segment(segment):
+                return
+            seqnum, acknum, flags, window, length, checksum = \
+                self.unpack_segment_header(segment[:HEADER_SIZE])
+            if flags & ~(COMPRESS_FLAG | CHECKSUM_MASK) != SYN_FLAG:
+                return
+            if len(self._half_open) + self._accept_queue.qsize() >= self._backlog:
+                self.syns_dropped += 1
+                return
+            connection = BTCPServerSocket(self._window, self._timeout, self._layer, self._clock,
+                                          self._address, address)
+            connection.handshake = self.handshake
+            connection.compression = self.compression
+            if self.checksums is not None:
+                connection.checksums = self.checksums
+            self._half_open[address] = self._clock.time()
+
+        connection.lossy_layer_segment_received(segment, address)
+        if address in self._half_open and connection._state not in (BTCPStates.ACCEPTING,
+                                                                    BTCPStates.SYN_RCVD):
+            del self._half_open[address]
+            self._accept_queue.put(connection)
+        if self._clock.time() >= self._next_sweep:
+            self._sweep()
+
+
+    def lossy_layer_tick(self):
+        while self._kicked:
+            self._tick_connection(self._kicked.popleft())
+        now = self._clock.time()
+        while self._timers and self._timers[0][0] <= now:
+            self._tick_connection(heapq.heappop(self._timers)[2])
+        if now >= self._next_sweep:
+            self._sweep()
+
+
+    def _tick_connection(self, address):
+        connection = self._connections.get(address)
+        if connection is not None:
+            connection.lossy_layer_tick()
+
+
+    def _schedule_connection(self, deadline, address):
+        heapq.heappush(self._timers, (deadline, next(self._timer_order), address))
+
+
+    def _sweep(self):
+        """Run the timers of all connections, and forget closed connections
+        and half-open ones that have been abandoned. Done every TIMER_TICK ms,
+        also while segments keep arriving."""
+        now = self._clock.time()
+        self._next_sweep = now + TIMER_TICK / 1000
+        for address, connection in list(self._connections.items()):
+            connection.lossy_layer_tick()
+            syn_time = self._half_open.get(address)
+            if connection._state == BTCPStates.CLOSED:
+                self._forget(address)
+            elif syn_time is not None and now - syn_time > MAX_RETRIES * self._timeout / 1000:
+                connection.close()
+
+
+    def _forget(self, address):
+        self._connections.pop(address, None)
+        self._half_open.pop(address, None)
+
+
+    def next_timeout(self):
+        """Time by which lossy_layer_tick has to be called: the listening
+        socket sweeps its connections every TIMER_TICK ms, and ticks those
+        that scheduled a timer before that."""
+        if self._timers:
+            return min(self._next_sweep, self._timers[0][0])
+        return self._next_sweep
+
+
+    def accept(self, timeout=None):
+        """Wait for a client to complete the three-way handshake and return
+        its BTCPServerSocket, or None if timeout seconds pass first.
+
+        The returned socket is used like any BTCPServerSocket: recv until it
+        returns b'', then close it.
+        """
+        try:
+            return self._clock.get(self._accept_queue, timeout)
+        except queue.Empty:
+            return None
+
+
+    def close(self):
+        """Destroy the lossy layer. Connections still open stop hearing from
+        their clients."""
+        if self._lossy_layer is not None:
+            self._lossy_layer.destroy()
+        self._lossy_layer = None
+
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,320 @@
+"""
+Shared memory replacement for the lossy layer, for endpoints on the same host.
+
+Every endpoint owns one single-producer single-consumer ring of segment slots
+in a multiprocessing.shared_memory block, named after its local address. Its
+peer writes segments straight into that ring; a named pipe (FIFO) next to it
+is only used to wake the consumer up when it found the ring empty and went
+to sleep, once however many segments arrive before it wakes up. The consumer
+reads segments where they are in the ring, and only frees their slots once
+its socket is done with them. A bulk transfer therefore moves segments
+without the kernel networking stack, without a system call per segment and
+without copying them more than the socket itself does.
+
+Layout of the shared memory block:
+    offset   0: head, index of the next slot to read (written by the consumer)
+    offset  64: tail, index of the next slot to write (written by the producer)
+    offset 128: waiting, set by the consumer before it sleeps and cleared by
+                the producer that wakes it up
+    offset 192: RING_SLOTS slots of SLOT_SIZE bytes: a 4 byte length followed
+                by the segment itself
+head, tail and waiting are kept on separate cache lines; head and tail only
+ever grow, the slot of an index is index % RING_SLOTS.
+"""
+
+
+import os
+import select
+import struct
+import tempfile
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from btcp.constants import *
+from btcp.lossy_layer import tick_wait
+
+
+# The ring is the receive buffer of the endpoint, about as deep as that of a
+# UDP socket by default: a backlog deeper than what the consumer works off
+# within the retransmission timeout only brings on retransmissions.
+RING_SLOTS = 256
+SLOT_SIZE = (4 + SEGMENT_SIZE + 7) & ~7
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+WAITING_OFFSET = 128
+SLOTS_OFFSET = 192
+
+
+def ring_name(ip, port):
+    """Name of the shared memory block (and FIFO) of the given address."""
+    return "btcp-{}-{}".format(ip, port)
+
+
+def fifo_path(name):
+    return os.path.join(tempfile.gettempdir(), name + ".fifo")
+
+
+class SharedMemoryRing:
+    """One direction of a shared memory connection.
+
+    The consumer creates the ring (create=True), the producer attaches to an
+    existing one. Only one process may produce into and one may consume from
+    a ring.
+    """
+
+    def __init__(self, name, create=False, slots=RING_SLOTS, slot_size=SLOT_SIZE):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self._fifo_path = fifo_path(name)
+        self._created = create
+
+        if create:
+            self._unlink_stale()
+            self._shm = shared_memory.SharedMemory(name, create=True,
+                                                   size=SLOTS_OFFSET + slots * slot_size)
+            os.mkfifo(self._fifo_path)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            # Attaching registers the block with the resource tracker as well,
+            # which would unlink it when *this* process exits. Only the
+            # creator owns the block.
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self._buf = self._shm.buf
+        # The segment get returned last, until it is released.
+        self._view = None
+        # O_RDWR keeps the FIFO open without waiting for the other side.
+        self._fifo = os.open(self._fifo_path, os.O_RDWR | os.O_NONBLOCK)
+
+
+    def _unlink_stale(self):
+        """Remove what a previous consumer at this address left behind."""
+        try:
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            os.unlink(self._fifo_path)
+        except FileNotFoundError:
+            pass
+
+
+    def fileno(self):
+        """File descriptor that becomes readable when segments are waiting."""
+        return self._fifo
+
+
+    def _get(self, offset):
+        return struct.unpack_from("!Q", self._buf, offset)[0]
+
+
+    def _set(self, offset, value):
+        struct.pack_into("!Q", self._buf, offset, value)
+
+
+    def put(self, segment):
+        """Append segment to the ring. Returns False if the ring is full, in
+        which case the segment is dropped, just like a full UDP socket buffer
+        would.
+        """
+        tail = self._get(TAIL_OFFSET)
+        if tail - self._get(HEAD_OFFSET) >= self.slots:
+            return False
+        offset = SLOTS_OFFSET + (tail % self.slots) * self.slot_size
+        struct.pack_into("!I", self._buf, offset, len(segment))
+        self._buf[offset + 4:offset + 4 + len(segment)] = segment
+        self._set(TAIL_OFFSET, tail + 1)
+        # Only wake the consumer if it went to sleep, and only once: it takes
+        # everything in the ring when it wakes up. A wakeup lost to a race is
+        # recovered by the consumer's TIMER_TICK timeout.
+        if self._get(WAITING_OFFSET):
+            self._set(WAITING_OFFSET, 0)
+            self.wake()
+        return True
+
+
+    def empty(self):
+        return self._get(HEAD_OFFSET) == self._get(TAIL_OFFSET)
+
+
+    def get(self):
+        """Return the oldest segment in the ring, as a memoryview of its
+        slot, or None if the ring is empty. The slot stays the consumer's
+        until release is called; until then, get returns the same segment.
+        """
+        if self._view is not None:
+            return self._view
+        head = self._get(HEAD_OFFSET)
+        if head == self._get(TAIL_OFFSET):
+            return None
+        offset = SLOTS_OFFSET + (head % self.slots) * self.slot_size
+        length, = struct.unpack_from("!I", self._buf, offset)
+        self._view = self._buf[offset + 4:offset + 4 + length]
+        return self._view
+
+
+    def release(self):
+        """Hand the slot of the segment get returned back to the producer,
+        releasing the memoryview: what the socket keeps of it, it copied."""
+        self._view.release()
+        self._view = None
+        self._set(HEAD_OFFSET, self._get(HEAD_OFFSET) + 1)
+
+
+    def sleep(self, timeout):
+        """Wait until a segment or a wakeup arrives, or timeout (in
+        seconds, None for no limit) passes. Returns whether the ring holds a
+        segment."""
+        # Let the producer go first if it shares our CPU: woken up for every
+        # segment, the two would take turns a segment at a time.
+        os.sched_yield()
+        if not self.empty():
+            return True
+        self._set(WAITING_OFFSET, 1)
+        # A segment put before the flag was set came without a wakeup.
+        if self.empty():
+            rlist, wlist, elist = select.select([self], [], [], timeout)
+            if rlist:
+                self.clear_wakeups()
+        self._set(WAITING_OFFSET, 0)
+        return not self.empty()
+
+
+    def wake(self):
+        """Wake the consumer up without a segment."""
+        try:
+            os.write(self._fifo, b'\x00')
+        except BlockingIOError:
+            pass
+
+
+    def clear_wakeups(self):
+        """Consume all pending wakeup bytes from the FIFO."""
+        try:
+            while os.read(self._fifo, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+    def close(self):
+        """Detach from the ring; the consumer also removes it."""
+        if self._fifo is not None:
+            os.close(self._fifo)
+        self._fifo = None
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._shm is not None:
+            self._buf = None
+            self._shm.close()
+            if self._created:
+                self._shm.unlink()
+                try:
+                    os.unlink(self._fifo_path)
+                except FileNotFoundError:
+                    pass
+        self._shm = None
+
+
+def handle_ring_segments(btcp_socket, event, ring):
+    """Main method of the network thread of a SharedMemoryLayer.
+
+    Behaves like handle_incoming_segments in lossy_layer.py: all segments
+    waiting in the ring are passed to lossy_layer_segment_received, and if no
+    segment arrives for TIMER_TICK ms (or by the socket's next_timeout)
+    lossy_layer_tick is called instead.
+    """
+    while not event.is_set():
+        segment = ring.get()
+        if segment is not None:
+            # The segment is read where it is in the ring: its slot is only
+            # freed once the socket is done with it.
+            btcp_socket.lossy_layer_segment_received(segment)
+            ring.release()
+            if tick_wait(btcp_socket) == 0:
+                btcp_socket.lossy_layer_tick()
+            continue
+        if not ring.sleep(tick_wait(btcp_socket)):
+            # A timer event, or a wakeup without a segment: a kick, which
+            # does no harm.
+            btcp_socket.lossy_layer_tick()
+
+
+class SharedMemoryLayer:
+    """Lossy layer between processes on the same host.
+
+    Same constructor and send_segment / destroy contract as LossyLayer.
+    Segments are put into the ring of the remote address, which is created by
+    the remote endpoint's layer. Until it exists, segments are dropped, like
+    UDP segments sent to a port nobody listens on.
+
+    Segments have to fit in a slot, so connections over it can't negotiate
+    segments larger than max_segment_size.
+    """
+
+    max_segment_size = SLOT_SIZE - 4
+
+    def __init__(self, btcp_socket, local_ip, local_port, remote_ip, remote_port):
+        self._bTCP_socket = btcp_socket
+        self._remote_name = ring_name(remote_ip, remote_port)
+        self._outgoing = None
+        self._outgoing_lock = threading.Lock()
+        self._event = None
+        self._thread = None
+        self._incoming = None
+        self._incoming = SharedMemoryRing(ring_name(local_ip, local_port), create=True)
+
+        self.segments_dropped = 0
+
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=handle_ring_segments,
+                                        args=(self._bTCP_socket, self._event, self._incoming))
+        self._thread.start()
+
+
+    def __del__(self):
+        self.destroy()
+
+
+    def destroy(self):
+        """Flag the thread that it can stop, wait for it to do so, then detach
+        from both rings.
+
+        Should be safe to call multiple times, so safe to call from __del__.
+        """
+        if self._event is not None and self._thread is not None:
+            self._event.set()
+            self._thread.join()
+        if self._incoming is not None:
+            self._incoming.close()
+        if self._outgoing is not None:
+            self._outgoing.close()
+        self._event = None
+        self._thread = None
+        self._incoming = None
+        self._outgoing = None
+
+
+    def kick(self):
+        """Wake the network thread up to call lossy_layer_tick."""
+        if self._incoming is not None:
+            self._incoming.wake()
+
+
+    def send_segment(self, segment):
+        """Put the segment into the ring of the remote endpoint.
+
+        Should be safe to call from either the application thread or the
+        network thread.
+        """
+        with self._outgoing_lock:
+            if self._outgoing is None:
+                try:
+                    self._outgoing = SharedMemoryRing(self._remote_name)
+                except FileNotFoundError:
+                    self.segments_dropped += 1
+                    return
+            if not self._outgoing.put(segment):
+                self.segments_dropped += 1
@@ -0,0 +1,648 @@
+"""
+Discrete-event simulation of a complete bTCP transfer.
+
+Running bTCP over the loopback interface with a netem delay profile takes
+minutes of wall time for a large transfer, which makes it impossible to try
+more than a handful of window / timeout configurations. This module runs the
+same protocol against an in-memory network driven by a VirtualClock instead:
+round trip time, jitter and loss are simulated, but no time is actually spent
+waiting, so a transfer runs as fast as the CPU allows.
+
+The pieces are:
+    - SimulatedNetwork: delivers segments between endpoints after a simulated
+      delay, dropping them according to a (netem style, correlated) loss rate,
+      flipping bits at a bit error rate and optionally limiting the link rate.
+    - SimulatedLossyLayer: drop-in replacement for LossyLayer with the same
+      send_segment / lossy_layer_segment_received / lossy_layer_tick contract.
+    - simulate: run one transfer between a BTCPClientSocket and a
+      BTCPServerSocket, both using the VirtualClock and a SimulatedLossyLayer,
+      and report the simulated goodput. Everything runs in one thread: every
+      blocking call of the sockets drives the clock, and the applications on
+      both ends are scheduled as events as well.
+    - simulate_striped: the same for a striped transfer over several
+      connections to a BTCPListenSocket.
+    - simulate_requests: requests answered by the server, over one
+      connection carrying data both ways, or over a connection each way.
+    - simulate_messages: the latency of small messages sent at intervals.
+
+Run as a module to sweep window and timeout configurations:
+    python3 -m btcp.simulation -w 10 50 100 -t 100 200 --delay 50 --loss 0.1
+"""
+
+
+import argparse
+import functools
+import queue
+import random
+import sys
+
+from btcp.btcp_socket import BTCPStates
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPListenSocket, BTCPServerSocket
+from btcp.striping import STRIPE_HEADER, StripeAssembler, split
+
+
+class SimulatedNetwork:
+    """In-memory network between SimulatedLossyLayer endpoints.
+
+    delay and jitter are given in seconds; every segment is delayed by delay
+    plus a uniformly distributed value in [-jitter, jitter], so jitter also
+    causes reordering, like netem does. loss is the probability a segment gets
+    dropped; loss_correlation makes drops depend on the previous drop decision
+    the way "loss 10% 25%" does in netem. duplicate is the probability a
+    segment gets delivered twice. bit_error is the probability any one bit of
+    a segment gets flipped, so larger segments get corrupted more often.
+    rate limits the link to the given number of bytes per second (per
+    direction); segments queue up behind each other when it is set, in a
+    buffer of buffer bytes (unlimited if None) that drops what doesn't fit.
+
+    Besides counting segments, the network measures how long segments queue
+    for the link (queue_delay, the total, and max_queue_delay) and the
+    largest burst: the most segments one endpoint sent at the same instant.
+
+    All randomness comes from a generator seeded with seed, so simulations are
+    reproducible.
+    """
+
+    def __init__(self, clock, delay=0.0, jitter=0.0, loss=0.0,
+                 loss_correlation=0.0, duplicate=0.0, rate=None, seed=0, bit_error=0.0,
+                 buffer=None):
+        self.clock = clock
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.loss_correlation = loss_correlation
+        self.duplicate = duplicate
+        self.bit_error = bit_error
+        self.rate = rate
+        self.buffer = buffer
+        self._random = random.Random(seed)
+        self._endpoints = {}
+        self._link_free = {}
+        self._last_lost = False
+        self._bursts = {}
+
+        self.segments_sent = 0
+        self.segments_lost = 0
+        self.segments_corrupted = 0
+        self.segments_overflowed = 0
+        self.bytes_sent = 0
+        self.queue_delay = 0.0
+        self.max_queue_delay = 0.0
+        self.max_burst = 0
+
+
+    def attach(self, address, layer):
+        """Register layer to receive the segments sent to address."""
+        self._endpoints[address] = layer
+
+
+    def detach(self, address):
+        self._endpoints.pop(address, None)
+
+
+    def _lost(self):
+        """Decide whether the next segment gets lost."""
+        p = (1 - self.loss_correlation) * self.loss
+        if self._last_lost:
+            p += self.loss_correlation
+        self._last_lost = self._random.random() < p
+        return self._last_lost
+
+
+    def _corrupt(self, segment):
+        """Flip a bit of segment with the probability that at least one of
+        its bits flips at the bit error rate; one is enough to fail the
+        checksum."""
+        if self._random.random() >= 1 - (1 - self.bit_error) ** (8 * len(segment)):
+            return segment
+        self.segments_corrupted += 1
+        corrupted = bytearray(segment)
+        bit = self._random.randrange(8 * len(segment))
+        corrupted[bit // 8] ^= 0x80 >> bit % 8
+        return bytes(corrupted)
+
+
+    def transmit(self, source, destination, segment):
+        """Send segment from source to destination over the simulated link."""
+        self.segments_sent += 1
+        self.bytes_sent += len(segment)
+        now = self.clock.time()
+
+        when, burst = self._bursts.get(source, (None, 0))
+        burst = burst + 1 if when == now else 1
+        self._bursts[source] = (now, burst)
+        self.max_burst = max(self.max_burst, burst)
+
+        # Serialize segments on a rate limited link.
+        departure = now
+        if self.rate:
+            link = (source, destination)
+            waiting = max(0.0, self._link_free.get(link, now) - now)
+            if self.buffer is not None and waiting * self.rate + len(segment) > self.buffer:
+                self.segments_overflowed += 1
+                self.segments_lost += 1
+                return
+            self.queue_delay += waiting
+            self.max_queue_delay = max(self.max_queue_delay, waiting)
+            departure = now + waiting + len(segment) / self.rate
+            self._link_free[link] = departure
+
+        if self._lost():
+            self.segments_lost += 1
+            return
+
+        if self.bit_error:
+            segment = self._corrupt(segment)
+        copies = 2 if self._random.random() < self.duplicate else 1
+        for _ in range(copies):
+            arrival = departure + self.delay
+            if self.jitter:
+                arrival += self._random.uniform(-self.jitter, self.jitter)
+            self.clock.call_at(arrival, self._deliver, source, destination, segment)
+
+
+    def _deliver(self, source, destination, segment):
+        layer = self._endpoints.get(destination)
+        if layer is not None:
+            layer.segment_arrived(segment, source)
+
+
+class SimulatedLossyLayer:
+    """Lossy layer on top of a SimulatedNetwork.
+
+    Offers the same contract as LossyLayer: send_segment puts a segment into
+    the network, and the associated socket gets lossy_layer_segment_received
+    called for every segment that arrives, or lossy_layer_tick after TIMER_TICK
+    ms (of virtual time) without any segment arriving, or at the socket's
+    next_timeout.
+    """
+
+    def __init__(self, network, btcp_socket, local_ip, local_port, remote_ip=None, remote_port=None):
+        self._network = network
+        self._bTCP_socket = btcp_socket
+        self._local = (local_ip, local_port)
+        self._remote = (remote_ip, remote_port)
+        self._tick = None
+
+        self._network.attach(self._local, self)
+        self._schedule_tick()
+
+
+    def _schedule_tick(self):
+        clock = self._network.clock
+        if self._tick is not None:
+            clock.cancel(self._tick)
+        when = clock.time() + TIMER_TICK / 1000
+        deadline = self._bTCP_socket.next_timeout()
+        if deadline is not None:
+            when = max(clock.time(), min(when, deadline))
+        self._tick = clock.call_at(when, self._on_tick)
+
+
+    def _on_tick(self):
+        self._tick = None
+        self._schedule_tick()
+        self._bTCP_socket.lossy_layer_tick()
+        # Again, now that the tick has moved the socket's timers on (unless
+        # it destroyed the layer).
+        if self._tick is not None:
+            self._schedule_tick()
+
+
+    def segment_arrived(self, segment, source):
+        """Called by the network when a segment for this endpoint arrives."""
+        if self._tick is None:
+            return
+        self._bTCP_socket.lossy_layer_segment_received(segment, source)
+        if self._tick is not None:
+            self._schedule_tick()
+
+
+    def destroy(self):
+        """Stop delivering segments and ticks. Safe to call multiple times."""
+        if self._tick is not None:
+            self._network.clock.cancel(self._tick)
+        self._tick = None
+        self._network.detach(self._local)
+
+
+    def kick(self):
+        """Have lossy_layer_tick called right away (after the current event)."""
+        if self._tick is not None:
+            self._network.clock.cancel(self._tick)
+            self._tick = self._network.clock.call_later(0, self._on_tick)
+
+
+    def send_segment(self, segment):
+        """Put the segment into the simulated network."""
+        self._network.transmit(self._local, self._remote, segment)
+
+
+    def send_segment_to(self, segment, address):
+        """Put the segment into the simulated network, addressed to address."""
+        self._network.transmit(self._local, address, segment)
+
+
+class SimulationResult:
+    """Outcome of a single simulated transfer."""
+
+    def __init__(self, window, timeout, size, duration, retransmissions,
+                 segments_sent, segments_lost, correct, events,
+                 corruption_estimate=None, chunk_size=None, max_burst=None,
+                 queue_delay=None, max_queue_delay=None):
+        self.window = window
+        self.timeout = timeout
+        self.size = size
+        self.duration = duration
+        self.retransmissions = retransmissions
+        self.segments_sent = segments_sent
+        self.segments_lost = segments_lost
+        self.correct = correct
+        self.events = events
+        # The client's estimate of the fraction of segments corrupted, and
+        # the data per segment it ended up with.
+        self.corruption_estimate = corruption_estimate
+        self.chunk_size = chunk_size
+        # The largest burst of segments, and the mean and largest time
+        # segments queued for the link.
+        self.max_burst = max_burst
+        self.queue_delay = queue_delay
+        self.max_queue_delay = max_queue_delay
+
+
+    @property
+    def goodput(self):
+        """Application bytes delivered per second of simulated time."""
+        if not self.duration:
+            return 0.0
+        return self.size / self.duration
+
+
+    def __str__(self):
+        return ("window {:5d} timeout {:6.0f}ms: {:10.1f} KiB/s in {:8.2f}s simulated, "
+                "{} retransmissions, {}/{} segments lost{}").format(
+                    self.window, self.timeout * 1000, self.goodput / 1024,
+                    self.duration, self.retransmissions, self.segments_lost,
+                    self.segments_sent, "" if self.correct else ", DATA MISMATCH")
+
+
+def simulate(data, window=100, timeout=0.1, delay=0.0, jitter=0.0, loss=0.0,
+             loss_correlation=0.0, duplicate=0.0, rate=None, seed=0,
+             limit=3600.0, fec=False, bit_error=0.0, adaptive=False, naks=True,
+             tail_loss_probe=True, buffer=None, pacing=True, rate_limit=None,
+             write_size=None, write_interval=0.0, nodelay=False):
+    """Transfer data from a BTCPClientSocket to a BTCPServerSocket over a
+    SimulatedNetwork and return a SimulationResult.
+
+    timeout, delay and jitter are in seconds. limit is the maximum amount of
+    simulated time the sending application keeps trying to hand its data to
+    the client socket. fec has the client send parity segments, adaptive
+    adapt its payload size to the corruption the server reports; naks has
+    the server send NAKs, tail_loss_probe the client probe for lost tails.
+    buffer is the link's buffer in bytes, pacing has the client pace its
+    segments and rate_limit limits it to that many bytes per second.
+
+    With write_size, the sending application hands data to the client in
+    writes of that many bytes, one every write_interval seconds (letting
+    the network go first between them even at 0). nodelay has the client
+    send small writes right away instead of gathering them.
+    """
+    clock = VirtualClock()
+    network = SimulatedNetwork(clock, delay, jitter, loss, loss_correlation,
+                               duplicate, rate, seed, bit_error, buffer)
+    layer = functools.partial(SimulatedLossyLayer, network)
+    server = BTCPServerSocket(window, timeout * 1000, layer, clock)
+    client = BTCPClientSocket(window, timeout * 1000, layer, clock)
+    client.fec = fec
+    client.adaptive = adaptive
+    server.naks = naks
+    client.tail_loss_probe = tail_loss_probe
+    client.pacing = pacing
+    client.rate_limit = rate_limit
+    client.nodelay = nodelay
+
+    # The server application: read whatever arrived every millisecond.
+    received = bytearray()
+    finish = []
+    def read():
+        try:
+            while True:
+                received.extend(server._recvbuf.get_nowait())
+        except queue.Empty:
+            pass
+        if len(received) >= len(data) and not finish:
+            finish.append(clock.time())
+        if server._lossy_layer is not None:
+            clock.call_later(0.001, read)
+    read()
+
+    # The client application: connect, send everything, shut down.
+    start = clock.time()
+    if client.connect():
+        view = memoryview(data)
+        sent = 0
+        while sent < len(data) and clock.time() < limit:
+            piece = view[sent:sent + (write_size or len(data))]
+            accepted = client.send(piece)
+            sent += accepted
+            if accepted < len(piece):
+                clock.sleep(0.001)
+            elif write_size:
+                clock.sleep(write_interval)
+        client.shutdown()
+    client.close()
+    server.close()
+
+    duration = (finish[0] if finish else clock.time()) - start
+    return SimulationResult(window, timeout, len(data), duration,
+                            client.retransmissions, network.segments_sent,
+                            network.segments_lost, bytes(received) == data,
+                            clock.events_run, client.corruption_estimate, client.chunk_size,
+                            network.max_burst, network.queue_delay / network.segments_sent,
+                            network.max_queue_delay)
+
+
+class RequestResult:
+    """Outcome of simulate_requests: the latency of every request (from
+    sending it to having all of its response), the segments sent and the
+    ACKs sent apart from data while they ran, and whether every response
+    arrived intact. simulate_messages reports the same for messages, each
+    from sending it to the server application having all of it."""
+
+    def __init__(self, latencies, segments_sent, acks_sent, correct):
+        self.latencies = latencies
+        self.segments_sent = segments_sent
+        self.acks_sent = acks_sent
+        self.correct = correct
+
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def simulate_requests(count, request_size=100, response_size=1000, duplex=True, window=100,
+                      timeout=0.1, delay=0.0, jitter=0.0, loss=0.0, seed=0):
+    """Have a client send count requests of request_size bytes, one at a
+    time, each answered by response_size bytes from the server application,
+    and return a RequestResult.
+
+    With duplex, requests and responses share one connection. Otherwise the
+    responses go over a second connection the other way, as they had to
+    before connections carried data both ways: the server application has a
+    BTCPClientSocket of its own, connected to a BTCPServerSocket next to the
+    client.
+    """
+    clock = VirtualClock()
+    network = SimulatedNetwork(clock, delay, jitter, loss, seed=seed)
+    layer = functools.partial(SimulatedLossyLayer, network)
+    server = BTCPServerSocket(window, timeout * 1000, layer, clock)
+    client = BTCPClientSocket(window, timeout * 1000, layer, clock)
+    sockets = [server, client]
+    if duplex:
+        responder, responses = server, client
+    else:
+        responses = BTCPServerSocket(window, timeout * 1000, layer, clock,
+                                     local_address=(CLIENT_IP, CLIENT_PORT + 1),
+                                     remote_address=(SERVER_IP, SERVER_PORT + 1))
+        responder = BTCPClientSocket(window, timeout * 1000, layer, clock,
+                                     local_address=(SERVER_IP, SERVER_PORT + 1),
+                                     remote_address=(CLIENT_IP, CLIENT_PORT + 1))
+        sockets += [responses, responder]
+        responder.connect()
+    client.connect()
+
+    response = random.Random(seed).randbytes(response_size)
+    # The server application: answer every complete request, polling every
+    # 0.1ms.
+    pending = bytearray()
+    unanswered = []
+    def serve():
+        try:
+            while True:
+                pending.extend(server._recvbuf.get_nowait())
+        except queue.Empty:
+            pass
+        while len(pending) >= request_size:
+            del pending[:request_size]
+            unanswered.append(memoryview(response))
+        while unanswered:
+            unanswered[0] = unanswered[0][responder.send(unanswered[0]):]
+            if unanswered[0]:
+                break
+            unanswered.pop(0)
+        if server._lossy_layer is not None:
+            clock.call_later(0.0001, serve)
+    serve()
+
+    # The client application: one request at a time.
+    segments_before = network.segments_sent
+    acks_before = sum(socket.acks_sent for socket in sockets)
+    request = bytes(request_size)
+    latencies = []
+    correct = True
+    for _ in range(count):
+        start = clock.time()
+        sent = 0
+        while sent < request_size:
+            sent += client.send(request[sent:])
+        received = bytearray()
+        while len(received) < response_size:
+            data = responses.recv()
+            if not data:
+                break
+            received.extend(data)
+        latencies.append(clock.time() - start)
+        correct = correct and received == response
+    segments = network.segments_sent - segments_before
+    acks = sum(socket.acks_sent for socket in sockets) - acks_before
+
+    client.shutdown()
+    if not duplex:
+        responder.shutdown()
+    for socket in sockets:
+        socket.close()
+    return RequestResult(latencies, segments, acks, correct)
+
+
+def simulate_messages(count, size=100, interval=0.005, nodelay=False, window=100, timeout=0.1,
+                      delay=0.0, jitter=0.0, loss=0.0, seed=0):
+    """Have a client send count messages of size bytes, one every interval
+    seconds whether or not the earlier ones arrived, and return a
+    RequestResult with the latency of every message. nodelay has the client
+    send every message right away, instead of holding small ones back while
+    an earlier one waits for its ACK.
+    """
+    clock = VirtualClock()
+    network = SimulatedNetwork(clock, delay, jitter, loss, seed=seed)
+    layer = functools.partial(SimulatedLossyLayer, network)
+    server = BTCPServerSocket(window, timeout * 1000, layer, clock)
+    client = BTCPClientSocket(window, timeout * 1000, layer, clock)
+    client.nodelay = nodelay
+    client.connect()
+
+    data = random.Random(seed).randbytes(count * size)
+    sent_at = []
+    latencies = []
+    # The server application: read whatever arrived every 0.1ms, noting
+    # when each message is complete.
+    received = bytearray()
+    def read():
+        try:
+            while True:
+                received.extend(server._recvbuf.get_nowait())
+        except queue.Empty:
+            pass
+        while len(latencies) < len(sent_at) and len(received) >= (len(latencies) + 1) * size:
+            latencies.append(clock.time() - sent_at[len(latencies)])
+        if server._lossy_layer is not None:
+            clock.call_later(0.0001, read)
+    read()
+
+    # The client application: a message every interval.
+    segments_before = network.segments_sent
+    view = memoryview(data)
+    for start in range(0, len(data), size):
+        sent_at.append(clock.time())
+        client.sendall(view[start:start + size])
+        clock.sleep(interval)
+    while len(latencies) < count and clock.run_next():
+        pass
+    segments = network.segments_sent - segments_before
+    acks = server.acks_sent + client.acks_sent
+
+    client.shutdown()
+    client.close()
+    server.close()
+    return RequestResult(latencies, segments, acks, bytes(received) == data)
+
+
+def simulate_striped(data, stripes, window=100, timeout=0.1, delay=0.0, jitter=0.0,
+                     loss=0.0, loss_correlation=0.0, duplicate=0.0, rate=None, seed=0,
+                     limit=3600.0, buffer=None, pacing=True):
+    """Transfer data striped over stripes BTCPClientSockets to a
+    BTCPListenSocket over a SimulatedNetwork and return a SimulationResult.
+    All connections share the network, so they compete for its rate.
+
+    The applications can't block in a single thread with several connections,
+    so both ends are events polling every millisecond, using the non-blocking
+    halves of connect and shutdown. The clients share the process' rate cap,
+    if btcp.pacing.limit_process set one.
+    """
+    clock = VirtualClock()
+    network = SimulatedNetwork(clock, delay, jitter, loss, loss_correlation,
+                               duplicate, rate, seed, buffer=buffer)
+    layer = functools.partial(SimulatedLossyLayer, network)
+    listener = BTCPListenSocket(window, timeout * 1000, layer=layer, clock=clock)
+
+    # The server application: accept stripes and reassemble what they carry.
+    assembler = StripeAssembler()
+    connections = []
+    finish = []
+    def serve():
+        while True:
+            connection = listener.accept(0)
+            if connection is None:
+                break
+            connections.append((connection, assembler.stream()))
+        for connection, stream in connections:
+            try:
+                while True:
+                    stream.feed(connection._recvbuf.get_nowait())
+            except queue.Empty:
+                pass
+        if assembler.complete() and not finish:
+            finish.append(clock.time())
+        if listener._lossy_layer is not None:
+            clock.call_later(0.001, serve)
+    serve()
+
+    # The client application: one sender per stripe.
+    start = clock.time()
+    clients = []
+    for i, (offset, length) in enumerate(split(len(data), stripes)):
+        client = BTCPClientSocket(window, timeout * 1000, layer, clock,
+                                  local_address=(CLIENT_IP, CLIENT_PORT + i))
+        client.pacing = pacing
+        payload = memoryview(STRIPE_HEADER.pack(len(data), offset, length)
+                             + data[offset:offset + length])
+        clients.append(client)
+        client._start_connect()
+        def send(client=client, payload=payload, sent=0):
+            if client._state == BTCPStates.ESTABLISHED:
+                sent += client.send(payload[sent:])
+                if sent == len(payload):
+                    client._start_shutdown()
+            if client._state != BTCPStates.CLOSED and clock.time() - start < limit:
+                clock.call_later(0.001, send, client, payload, sent)
+        send()
+
+    clock.run(stop=lambda: finish and all(client._state == BTCPStates.CLOSED
+                                          for client in clients))
+    for client in clients:
+        client.close()
+    listener.close()
+
+    duration = (finish[0] if finish else clock.time()) - start
+    return SimulationResult(window, timeout, len(data), duration,
+                            sum(client.retransmissions for client in clients),
+                            network.segments_sent, network.segments_lost,
+                            assembler.complete() and bytes(assembler.data) == data,
+                            clock.events_run, max_burst=network.max_burst,
+                            queue_delay=network.queue_delay / network.segments_sent,
+                            max_queue_delay=network.max_queue_delay)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated bTCP transfers")
+    parser.add_argument("-w", "--window", help="Window sizes to try",
+                        type=int, nargs="+", default=[100])
+    parser.add_argument("-t", "--timeout", help="Timeouts to try in milliseconds",
+                        type=int, nargs="+", default=[100])
+    parser.add_argument("-s", "--size", help="Number of bytes to transfer",
+                        type=int, default=1024 * 1024)
+    parser.add_argument("--delay", help="One way delay in milliseconds",
+                        type=float, default=50)
+    parser.add_argument("--jitter", help="Delay jitter in milliseconds",
+                        type=float, default=0)
+    parser.add_argument("--loss", help="Loss probability (0-1)",
+                        type=float, default=0)
+    parser.add_argument("--loss-correlation", help="Loss correlation (0-1)",
+                        type=float, default=0)
+    parser.add_argument("--rate", help="Link rate in bytes per second",
+                        type=float, default=None)
+    parser.add_argument("--buffer", help="Link buffer in bytes (with --rate)",
+                        type=int, default=None)
+    parser.add_argument("--no-pacing", help="Send the window back to back",
+                        action="store_true")
+    parser.add_argument("--bit-error", help="Bit error probability (0-1)",
+                        type=float, default=0)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    parser.add_argument("-n", "--stripes", help="Stripe the transfer over this many connections",
+                        type=int, default=1)
+    parser.add_argument("--fec", help="Send parity segments (not with --stripes)",
+                        action="store_true")
+    parser.add_argument("--adaptive", help="Adapt the payload size to corruption "
+                        "(not with --stripes)", action="store_true")
+    args = parser.parse_args()
+
+    payload = random.Random(args.seed).randbytes(args.size)
+    for window in args.window:
+        for timeout in args.timeout:
+            if args.stripes > 1:
+                result = simulate_striped(payload, args.stripes, window, timeout / 1000,
+                                          args.delay / 1000, args.jitter / 1000, args.loss,
+                                          args.loss_correlation, rate=args.rate,
+                                          seed=args.seed, buffer=args.buffer,
+                                          pacing=not args.no_pacing)
+            else:
+                result = simulate(payload, window, timeout / 1000, args.delay / 1000,
+                                  args.jitter / 1000, args.loss, args.loss_correlation,
+                                  rate=args.rate, seed=args.seed, fec=args.fec,
+                                  bit_error=args.bit_error, adaptive=args.adaptive,
+                                  buffer=args.buffer, pacing=not args.no_pacing)
+            print(result)
+            sys.stdout.flush()
@@ -0,0 +1,174 @@
+"""
+Striped transfers: one piece of data sent concurrently over several bTCP
+connections.
+
+With a fixed window, one connection on a lossy link spends much of its time
+waiting for retransmissions. Splitting the data into stripes and sending each
+over a connection of its own keeps several windows in flight, and every
+stripe recovers from its own losses without stalling the others.
+
+Every stripe connection starts with a STRIPE_HEADER holding the total size of
+the data, the offset of the stripe in it and the length of the stripe,
+followed by the stripe itself. The receiver places every stripe at its offset
+and is done once all bytes of the total size have arrived, whichever
+connections they came over.
+"""
+
+
+import struct
+import threading
+from btcp.client_socket import BTCPClientSocket
+from btcp.lossy_layer import LossyLayer
+from btcp.constants import *
+
+
+STRIPE_HEADER = struct.Struct("!QQQ")
+
+
+def split(size, stripes):
+    """(offset, length) of every stripe when splitting size bytes into
+    stripes stripes of (almost) equal length."""
+    stripes = max(1, min(stripes, size))
+    bounds = [size * i // stripes for i in range(stripes + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(stripes)]
+
+
+class StripeAssembler:
+    """Reassembles data from the stripes it was split into.
+
+    Create one stream per incoming stripe connection and feed it everything
+    received on that connection, in order.
+    """
+
+    def __init__(self):
+        self.data = None
+        self.received = 0
+        self._lock = threading.Lock()
+
+
+    def stream(self):
+        return StripeStream(self)
+
+
+    def complete(self):
+        return self.data is not None and self.received == len(self.data)
+
+
+    def _place(self, size, offset, chunk):
+        with self._lock:
+            if self.data is None:
+                self.data = bytearray(size)
+            elif len(self.data) != size:
+                raise ValueError("stripe of a transfer of {} bytes, expected {}".format(
+                    size, len(self.data)))
+            self.data[offset:offset + len(chunk)] = chunk
+            self.received += len(chunk)
+
+
+class StripeStream:
+    """The receiving end of one stripe connection."""
+
+    def __init__(self, assembler):
+        self._assembler = assembler
+        self._header = bytearray()
+        self._size = None
+        self._offset = None
+        self._remaining = None
+
+
+    def feed(self, chunk):
+        """Process chunk, the next bytes received on the connection."""
+        chunk = memoryview(chunk)
+        if self._size is None:
+            missing = STRIPE_HEADER.size - len(self._header)
+            self._header.extend(chunk[:missing])
+            chunk = chunk[missing:]
+            if len(self._header) < STRIPE_HEADER.size:
+                return
+            self._size, self._offset, self._remaining = STRIPE_HEADER.unpack(self._header)
+            # Also allocates the data, in case it is empty.
+            self._assembler._place(self._size, self._offset, b'')
+        chunk = chunk[:self._remaining]
+        if chunk:
+            self._assembler._place(self._size, self._offset, chunk)
+            self._offset += len(chunk)
+            self._remaining -= len(chunk)
+
+
+def send_stripe(client, data, offset, length):
+    """Connect client, send one stripe of data over it and shut it down.
+    Returns whether the stripe was delivered."""
+    if not client.connect():
+        return False
+    payload = memoryview(STRIPE_HEADER.pack(len(data), offset, length) + data[offset:offset + length])
+    sent = client.sendall(payload)
+    return client.shutdown() and sent == len(payload)
+
+
+def send_striped(data, stripes, window, timeout, layer=LossyLayer,
+                 server=(SERVER_IP, SERVER_PORT), first_port=CLIENT_PORT):
+    """Send data to the BTCPListenSocket at server over stripes connections
+    at once, from ports first_port, first_port + 1, ... Returns whether all
+    stripes were delivered.
+    """
+    results = []
+    clients = []
+    threads = []
+    for i, (offset, length) in enumerate(split(len(data), stripes)):
+        client = BTCPClientSocket(window, timeout, layer,
+                                  local_address=(CLIENT_IP, first_port + i),
+                                  remote_address=server)
+        clients.append(client)
+        threads.append(threading.Thread(
+            target=lambda *args: results.append(send_stripe(*args)),
+            args=(client, data, offset, length)))
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for client in clients:
+            client.close()
+    return all(results) and len(results) == len(threads)
+
+
+def receive_striped(listener, timeout=None):
+    """Accept stripe connections on listener until a complete striped transfer
+    has arrived and return its data, or None if nothing arrives for timeout
+    seconds before that.
+    """
+    assembler = StripeAssembler()
+    threads = []
+
+    def receive(connection):
+        stream = assembler.stream()
+        while True:
+            chunk = connection.recv()
+            if not chunk:
+                break
+            stream.feed(chunk)
+        connection.close()
+
+    clock = listener._clock
+    idle_since = clock.time()
+    received = 0
+    while not assembler.complete():
+        # Poll, so data arriving over connections already accepted counts
+        # as activity as well.
+        connection = listener.accept(TIMER_TICK / 1000)
+        if connection is not None:
+            thread = threading.Thread(target=receive, args=(connection,), daemon=True)
+            thread.start()
+            threads.append(thread)
+        if connection is not None or assembler.received != received:
+            idle_since = clock.time()
+            received = assembler.received
+        elif timeout is not None and clock.time() - idle_since >= timeout:
+            break
+    if not assembler.complete():
+        return None
+    # Let the stripes finish their shutdown.
+    for thread in threads:
+        thread.join()
+    return bytes(assembler.data)
@@ -1,13 +1,13 @@
 #!/usr/local/bin/python3
 import contextlib
 import socket, argparse
-from Packet import Header, Packet, Payload
-from Poster import send_packet, receive_packet
+from btcp.poster import packet_io
 import queue
 from random import getrandbits
 from btcp.btcp_socket import BTCPSocket, BTCPStates
 from btcp.lossy_layer import LossyLayer
 from btcp.constants import *
+from btcp.clock import WallClock
 import binascii
 
 class Btcp:
@@ -39,10 +39,15 @@ class Btcp:
     TODO: clean
     """
     
-    def __init__(self, source, window, timeout):
+    def __init__(self, source, window, timeout, clock=None):
         """Constructor for the bTCP client socket. Allocates local resources
         and starts an instance of the Lossy Layer.
 
+        All timeouts are measured with clock, which defaults to the wall clock.
+        Segments arrive from a real UDP socket on the I/O thread, so it has to
+        be a clock that waits for them in real time; simulated time (see
+        btcp/simulation.py) is for the sockets in the btcp package.
+
         You can extend this method if you need additional attributes to be
         initialized, but do *not* call connect from here.
         """
@@ -54,21 +59,25 @@ class Btcp:
         self.window = window
         self.connected = False
         self.timeout = timeout
+        self.clock = clock if clock is not None else WallClock()
 
         self.retransmissionQueue = queue.PriorityQueue()
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(1)
 
+        #one I/O thread owns the socket; segments are sent directly and
+        #received segments go straight into the receive buffer
         self.receivebuffer = queue.Queue(1000)
-        self.receiver = receive_packet(self.receivebuffer, self.sock)
-        self.sendbuffer = queue.Queue(1000)
-        self.sender = send_packet(self.sendbuffer, self.sock)
+        self.io = packet_io(self.receivebuffer.put_nowait, self.sock)
 
     def start(self):
         self.sock.bind(self.source)
-        self.receiver.start()
-        self.sender.start()
+        self.io.start()
+
+    def close(self):
+        self.io.stop()
+        self.io.join()
+        self.sock.close()
 
     def listen(self):
         if self.connected:
@@ -76,7 +85,7 @@ class Btcp:
             exit(0)
 
         # Wait for handshake
-        data, addr = self.receivebuffer.get()
+        data, addr = self.clock.get(self.receivebuffer)
         
         #check if header is long enough
         if len(data) < 16:
@@ -146,17 +155,14 @@ class Btcp:
         header = sock.build_segment_header(seq_num, ack_num, True, True, False, self.window, 0, checksum)
         
         #send syn-ack to client
-        self.sendbuffer.put((header + payload, addr))
+        self.io.send(header + payload, addr, control=True)
         
         #! receive ACK package
 
         # Wait for ACK
         with contextlib.suppress(queue.Empty):
-            data, addr = self.receivebuffer.get(True, self.timeout)
+            data, addr = self.clock.get(self.receivebuffer, self.timeout)
                         
-            #get packet 
-            ackpacket = Packet.from_bytes(data)
-            
             #check if header is long enough
             if len(data) < 16:
                 raise ValueError("header is not long enough")
@@ -238,13 +244,13 @@ class Btcp:
         #build header including checksum
         header = sock.build_segment_header(seq_num, 0, True, False, False, self.window, 0, checksum)
         
-        self.sendbuffer.put((header + payload, destination))
+        self.io.send(header + payload, destination, control=True)
 
         print(f"Starting phase two of three way handshake with {str(destination)}")
         
         # Syn-Ack ontvangen
         try:
-            data, addr = self.receivebuffer.get(True, self.timeout)
+            data, addr = self.clock.get(self.receivebuffer, self.timeout)
         except queue.Empty:
             return False
 
@@ -308,7 +314,7 @@ class Btcp:
         header = sock.build_segment_header(syn_number, ack_number, False, True, False, self.window, 0, checksum)
         
         #send 
-        self.sendbuffer.put((header + payload, destination))
+        self.io.send(header + payload, destination, control=True)
 
         print(f"Client connection established with {str(destination)}")
         self.peer = destination
@@ -336,11 +342,11 @@ class Btcp:
         header = sock.build_segment_header(syn_number1, 0, False, False, True, self.window, 0, checksum)
         
         #send packet
-        self.sendbuffer.put((header + payload, destination))
+        self.io.send(header + payload, destination, control=True)
 
         #Wait until receival of FIN-ACK segment
         with contextlib.suppress(queue.Empty):
-            data, addr = self.receivebuffer.get(True, self.timeout)
+            data, addr = self.clock.get(self.receivebuffer, self.timeout)
             
         #check if header is long enough
         if len(data) < 16:
@@ -385,7 +391,7 @@ class Btcp:
         header = sock.build_segment_header(syn_number1, 0, False, True, False, self.window, 0, checksum)
         
         #send packet
-        self.sendbuffer.put((header + payload, destination))
+        self.io.send(header + payload, destination, control=True)
         
         print(f"Connection terminated with {str(destination)}")
         return True
@@ -401,7 +407,7 @@ class Btcp:
         
         #get possible FIN segment
         with contextlib.suppress(queue.Empty):
-            data, addr = self.receivebuffer.get(True, self.timeout)
+            data, addr = self.clock.get(self.receivebuffer, self.timeout)
             
         #check if header is long enough
         if len(data) < 16:
@@ -449,13 +455,13 @@ class Btcp:
         header = sock.build_segment_header(syn_number + 1, 0, False, True, True, self.window, 0, checksum)
         
         #send packet
-        self.sendbuffer.put((header + payload, destination))
+        self.io.send(header + payload, destination, control=True)
     
         #! RECEIVING ACK AND TERMINATING SERVER
 
         #get data and address again
         with contextlib.suppress(queue.Empty):
-            data, addr = self.receivebuffer.get(True, self.timeout)
+            data, addr = self.clock.get(self.receivebuffer, self.timeout)
 
         #check if header is long enough
         if len(data) < 16:
@@ -1,22 +1,33 @@
 #!/usr/local/bin/python3
 import socket, argparse
+import functools
+import itertools
+import os
 from struct import *
 import btcp_implementation
-from Packet import Header, Packet, Payload
 import queue
-import Runners
 import time
 from btcp.btcp_socket import BTCPSocket, BTCPStates
 from btcp.lossy_layer import LossyLayer
 from btcp.constants import *
+from btcp.delta import receive_delta
+from btcp.file_io import BufferedSink, OffsetWriter, receive_file, receive_file_direct
+from btcp.resume import ResumableReceiver
+from btcp.server_pool import ServerPool, STATS_INTERVAL
+from btcp.server_socket import BTCPListenSocket, BTCPServerSocket
+from btcp.striping import receive_striped
 
 class bTCP_server(btcp_implementation.Btcp):
 
-    def __init__(self, source, window = 100, timeout = 10):
-        super().__init__(source, window, timeout)
+    #write every segment straight to its offset in the output file instead of
+    #keeping out of order segments in memory until the gap before them fills
+    direct_io = False
+
+    def __init__(self, source, window = 100, timeout = 10, clock = None):
+        super().__init__(source, window, timeout, clock)
         self.reassembleQueue = queue.PriorityQueue()
         self.reassemblesyns = []
-        self.data = []
+        self.data = None
         self.finished = False
 
     def begin(self):
@@ -49,7 +60,13 @@ class bTCP_server(btcp_implementation.Btcp):
         
     def receive_file(self, file):
         print("Start receiving file")
-        self.data = []
+        self.firstack = self.acknumber
+        if self.direct_io:
+            # Segments go to their offset in the file, in any order.
+            self.data = OffsetWriter(file.path, 1000)
+        else:
+            # In-order data goes straight to the file, through a write buffer.
+            self.data = BufferedSink(file.path)
 
         while self.connected and not self.finished:
 
@@ -57,7 +74,7 @@ class bTCP_server(btcp_implementation.Btcp):
             sock = BTCPSocket(self.window, self.timeout)
         
             #get information
-            data, addr = self.receivebuffer.get()
+            data, addr = self.clock.get(self.receivebuffer)
 
             #check if header is long enough
             if len(data) < 16:
@@ -107,23 +124,21 @@ class bTCP_server(btcp_implementation.Btcp):
                     self.add_data(header_temp, payload)
                     self.send_ack()
                     
-        timeout = time.time() + 2*self.timeout
-        while not self.finished and time.time() < timeout:
+        timeout = self.clock.time() + 2*self.timeout
+        while not self.finished and self.clock.time() < timeout:
             self.finished = self.respond_termination(addr, headr, payload)
         if not self.finished:
             print("Terminated because of timeout. No ACK packet received from client.")
 
         print("All data has been received.")
-        print("Starting writing data to file")
-        file.from_packets(file.path, self.data)
+        self.data.close()
 
-        self.sender.stop()
-        self.receiver.stop()
-        self.sender.join()
-        self.receiver.join()
-        self.sock.close()
+        self.close()
 
     def add_data(self, header, payload):
+        if self.direct_io:
+            return self.add_data_direct(header, payload)
+
         #unpack header
         syn_number = header[0]
         ack_number = header[1]
@@ -140,7 +155,7 @@ class bTCP_server(btcp_implementation.Btcp):
                 if syn_number == self.acknumber:
                     
                     #add data till length
-                    self.data.append(payload[:length])
+                    self.data.write(payload[:length])
                     
                     #increment ack
                     self.acknumber += 1
@@ -167,6 +182,19 @@ class bTCP_server(btcp_implementation.Btcp):
             print("Error")
         return
 
+    def add_data_direct(self, header, payload):
+        #unpack header
+        syn_number = header[0]
+        length = header[4]
+
+        #segment number within the file, from the first data segment on
+        index = BTCPSocket.unwrap_seqnum(syn_number, self.firstack + self.data.contiguous) - self.firstack
+        if index >= 0:
+            self.data.write(index, payload[:length])
+
+            #ack everything up to the first gap
+            self.acknumber = (self.firstack + self.data.contiguous) & 0xFFFF
+
     def send_ack(self):
         #create default payload
         payload = bytes(1000)
@@ -182,7 +210,23 @@ class bTCP_server(btcp_implementation.Btcp):
         header = sock.build_segment_header(self.synnumber, self.acknumber, False, True, false, self.window, 0, checksum)
         
         #send packet
-        self.sendbuffer.put((header + payload, self.peer))
+        self.io.send(header + payload, self.peer)
+
+
+_connection_numbers = itertools.count()
+
+
+def save_connection(output, connection, received):
+    """ServerPool handler: write everything received on connection to a file
+    of its own, named after output, the worker's pid and a counter."""
+    path = "{}.{}.{}".format(output, os.getpid(), next(_connection_numbers))
+    with open(path, "wb") as file:
+        while True:
+            data = connection.recv()
+            if not data:
+                return
+            file.write(data)
+            received(len(data))
 
 
 if __name__ == "__main__":
@@ -197,7 +241,60 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output",
                         help="Where to store the file",
                         default="output.file")
+    parser.add_argument("-n", "--workers",
+                        help="Serve many clients with this many worker processes sharing the port",
+                        type=int, default=0)
+    parser.add_argument("--direct",
+                        help="Write segments to their place in the output file as they arrive",
+                        action="store_true")
+    parser.add_argument("--resume",
+                        help="Keep a checkpoint of the output, so an interrupted transfer can be resumed",
+                        action="store_true")
+    parser.add_argument("--striped",
+                        help="Receive one file sent striped over several connections",
+                        action="store_true")
+    parser.add_argument("--delta",
+                        help="Update the existing output file with only the differences the sender sends",
+                        action="store_true")
     args = parser.parse_args()
 
-    serverrunner = Runners.ServerRunner(args.window, args.timeout, args.output)
-    serverrunner.start()
+    if args.resume:
+        receiver = ResumableReceiver(args.output)
+        server = BTCPServerSocket(args.window, args.timeout)
+        server.handshake = receiver.handshake
+        server.accept()
+        if not receiver.receive(server):
+            print("Transfer interrupted; run again to resume it.")
+        server.close()
+    elif args.delta:
+        server = BTCPServerSocket(args.window, args.timeout)
+        server.accept()
+        if not receive_delta(server, args.output, args.output):
+            print("Delta transfer failed; the output file is unchanged.")
+        server.close()
+    elif args.striped:
+        listener = BTCPListenSocket(args.window, args.timeout)
+        data = receive_striped(listener)
+        listener.close()
+        with open(args.output, "wb") as file:
+            file.write(data)
+    elif args.workers:
+        pool = ServerPool(args.workers, args.window, args.timeout,
+                          handler=functools.partial(save_connection, args.output))
+        pool.start()
+        try:
+            while True:
+                pool.poll(STATS_INTERVAL)
+                print(pool.stats())
+        except KeyboardInterrupt:
+            pool.stop()
+            print(pool.stats())
+    elif args.direct:
+        server = BTCPServerSocket(args.window, args.timeout)
+        print("Received {} bytes.".format(receive_file_direct(server, args.output)))
+        server.close()
+    else:
+        server = BTCPServerSocket(args.window, args.timeout)
+        server.accept()
+        print("Received {} bytes.".format(receive_file(server, args.output)))
+        server.close()
@@ -1,31 +1,26 @@
 #!/usr/local/bin/python3
 
 import socket, argparse
-from Packet import Header, Packet, Payload
 import queue
 import btcp_implementation
 import time
-import Runners
 from btcp.btcp_socket import BTCPSocket, BTCPStates
 from btcp.lossy_layer import LossyLayer
 from btcp.constants import *
+from btcp.client_socket import BTCPClientSocket
+from btcp.delta import send_delta
+from btcp.file_io import MappedFile, send_file
+from btcp.resume import send_resumable
+from btcp.striping import send_striped
 import contextlib
-"""This exposes a constant bytes object called TEST_BYTES_128MIB which, as the
-name suggests, is 128 MiB in size. You can send it, receive it, and check it
-for equality on the receiving end.
 
-Pycharm may complain about an unresolved reference. This is a lie. It simply
-cannot deal with a python source file this large so it cannot resolve the
-reference. Python itself will run it fine, though.
-
-You can also use the file large_input.py as-is for file transfer.
-"""
-from large_input import TEST_BYTES_128MIB
+#zero padding of payloads shorter than 1000 bytes, sliced without copying
+PADDING = memoryview(bytes(1000))
 
 class bTCP_client(btcp_implementation.Btcp):
 
-    def __init__(self, source, destination, window, timeout = 10):
-        super().__init__(source, window, timeout)
+    def __init__(self, source, destination, window, timeout = 10, clock = None):
+        super().__init__(source, window, timeout, clock)
         self.destination = destination
         self.file = None
         self.data = []
@@ -60,7 +55,8 @@ class bTCP_client(btcp_implementation.Btcp):
 
     def set_file(self, file2):
         self.file = file2
-        self.data = file2.to_packets()
+        # Payloads are slices of the memory mapped file, never copies.
+        self.data = MappedFile(file2.path, 1000)
         self.filepointer = 0
 
     def send_file(self):
@@ -79,7 +75,7 @@ class bTCP_client(btcp_implementation.Btcp):
                 syn, data = self.dupAckQueue.get_nowait()
                 
                 #send data away
-                self.sendbuffer.put((data, self.peer))
+                self.send_mapped(data)
                 self.retransmissionQueue.put((syn, data))
                 print(f"Retry of segment {str(syn)}")
                 if self.process_ack(self.timeout) is False:
@@ -93,7 +89,7 @@ class bTCP_client(btcp_implementation.Btcp):
                         packets.append(self.retransmissionQueue.get_nowait())
                         it += 1
                 for syn, packet in packets:
-                    self.sendbuffer.put((packet.to_bytes(), self.peer))
+                    self.send_mapped(packet)
                     self.retransmissionQueue.put((syn, packet))
                     print(f"Sent segment with sequence number {str(syn)} again")
 
@@ -104,60 +100,72 @@ class bTCP_client(btcp_implementation.Btcp):
             # Packets have been added to the buffer once. Now check for Ack packets.
             self.process_acks(self.timeout)
 
+            # Everything before the oldest unacked segment is done with.
+            with contextlib.suppress(IndexError):
+                syn, (header, index) = self.retransmissionQueue.queue[0]
+                self.data.release(index)
+
         terminated = self.start_termination(self.destination)
         while not terminated:
             terminated = self.start_termination(self.destination)
 
-        self.sender.stop()
-        self.receiver.stop()
-        self.sender.join()
-        self.receiver.join()
-        self.sock.close()
+        self.data.close()
+        self.close()
         return True
 
     def get_next_packet(self):
         if self.filepointer >= self.data.__len__():
-            return False
+            return False, None
         
         #create socket
         sock = BTCPSocket(self.window, self.timeout)
         
-        #create payload
-        payload = self.data[self.filepointer] + bytes(1000 - len(self.data[self.filepointer]))
+        #payload is a memoryview into the mapped file; the zero padding
+        #does not change the checksum
+        payload = self.data[self.filepointer]
             
         #create checksum
-        checksum = sock.in_cksum(sock.build_segment_header(self.synnumber, self.acknumber, False, False, False, self.window, len(self.data[self.filepointer]), 0)
-                                 + payload)
+        checksum = sock.in_cksum_parts(sock.build_segment_header(self.synnumber, self.acknumber, False, False, False, self.window, len(payload), 0),
+                                       payload)
         
         #build header including checksum
-        header = sock.build_segment_header(self.synnumber, self.acknumber, False, False, False, self.window, len(self.data[self.filepointer]), checksum)
+        header = sock.build_segment_header(self.synnumber, self.acknumber, False, False, False, self.window, len(payload), checksum)
         
         #header = Header(self.id, self.synnumber, self.acknumber, 0b0, self.window, len(self.data[self.filepointer]), 0)
         #packet = Packet(header, Payload(self.data[self.filepointer]))
         #packet.payload.fill()
         #packet.set_checksum()
 
+        #a segment is its header and the index of its payload, which is all
+        #the retransmission queue needs to keep
+        segment = (header, self.filepointer)
         self.filepointer += 1
-        return header+payload, self.synnumber
+        return segment, self.synnumber
+
+    def send_mapped(self, segment):
+        #header, payload and padding go out as one datagram (scatter I/O)
+        header, index = segment
+        payload = self.data[index]
+        self.io.sendmsg((header, payload, PADDING[:1000 - len(payload)]), self.peer)
 
     def send_next_packet(self):
         packet, syn = self.get_next_packet()
         if packet is False:
             return False
-        self.sendbuffer.put((packet, self.peer))
+        self.send_mapped(packet)
         self.retransmissionQueue.put((syn, packet))
         # print("Sent segment with a sequence number of " + str(self.synnumber))
         self.synnumber += 1
         return packet
 
     def process_acks(self, timeout):
-        self.timelimit = time.time() + timeout
+        self.timelimit = self.clock.time() + timeout
         duplicateack = False
         i = self.retransmissionQueue.qsize()
         
-        while (not self.retransmissionQueue.empty()) and time.time() <= self.timelimit and i > 0:
+        while (not self.retransmissionQueue.empty()) and self.clock.time() <= self.timelimit and i > 0:
             with contextlib.suppress(queue.Empty):
-                data, addr = self.receivebuffer.get(True, self.timelimit - time.time())
+                data, addr = self.clock.get(self.receivebuffer, self.timelimit - self.clock.time())
                 
                 #build socket
                 sock = BTCPSocket(self.window, self.timeout)
@@ -197,7 +205,7 @@ class bTCP_client(btcp_implementation.Btcp):
                 # print("Received ACK with an ack-number of " + str(packet.header.acknumber))
                 if (checksum == checksum_comp 
                     and ackf 
-                    and time.time() <= self.timelimit):
+                    and self.clock.time() <= self.timelimit):
                     i -= 1
 
                     if ack_number == self.lastack\
@@ -216,9 +224,9 @@ class bTCP_client(btcp_implementation.Btcp):
                     self.lastack = ack_number
 
     def process_ack(self, timeout):
-        self.timelimit = time.time() + timeout
+        self.timelimit = self.clock.time() + timeout
         try:
-            data, addr = self.receivebuffer.get(True, self.timelimit - time.time())
+            data, addr = self.clock.get(self.receivebuffer, self.timelimit - self.clock.time())
             
             #build socket
             sock = BTCPSocket(self.window, self.timeout)
@@ -257,7 +265,7 @@ class bTCP_client(btcp_implementation.Btcp):
             # print("Received ACK with an ack-number of " + str(packet.header.acknumber))
             if (checksum == checksum_comp 
                 and ackf 
-                and time.time() <= self.timelimit):
+                and self.clock.time() <= self.timelimit):
 
                 if ack_number >= self.synnumber:
                     return True
@@ -293,7 +301,43 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--input",
                         help="File to send",
                         default="large_input.py")
+    parser.add_argument("--resume",
+                        help="Only send what the receiver's checkpoint is missing",
+                        action="store_true")
+    parser.add_argument("--delta",
+                        help="Only send what differs from the receiver's existing copy",
+                        action="store_true")
+    parser.add_argument("-n", "--stripes",
+                        help="Send the file striped over this many connections at once",
+                        type=int, default=0)
     args = parser.parse_args()
 
-    clientrunner = Runners.ClientRunner(args.window, args.timeout, args.input)
-    clientrunner.start()
+    if args.resume:
+        client = BTCPClientSocket(args.window, args.timeout)
+        if send_resumable(client, args.input) is None:
+            print("Could not connect.")
+        else:
+            client.shutdown()
+        client.close()
+    elif args.delta:
+        client = BTCPClientSocket(args.window, args.timeout)
+        literal = send_delta(client, args.input)
+        if literal is None:
+            print("Could not connect.")
+        else:
+            print("Sent {} bytes of literal data.".format(literal))
+            client.shutdown()
+        client.close()
+    elif args.stripes:
+        with open(args.input, "rb") as file:
+            data = file.read()
+        if not send_striped(data, args.stripes, args.window, args.timeout):
+            print("Not every stripe could be delivered.")
+    else:
+        client = BTCPClientSocket(args.window, args.timeout)
+        if not client.connect():
+            print("Could not connect.")
+        else:
+            print("Sent {} bytes.".format(send_file(client, args.input)))
+            client.shutdown()
+        client.close()
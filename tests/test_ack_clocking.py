@@ -0,0 +1,43 @@
+import functools
+import random
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork, simulate
+
+
+class TestAckClocking(unittest.TestCase):
+    """New data sent as ACKs free the window, not on ticks"""
+
+    def test_a_window_per_round_trip(self):
+        # Ten windows of ten segments, 20 ms round trips; sending on ticks
+        # would add up to TIMER_TICK to every one of them.
+        data = random.Random(0).randbytes(100 * PAYLOAD_SIZE)
+        for pacing in (False, True):
+            with self.subTest(pacing=pacing):
+                result = simulate(data, window=10, delay=0.01, pacing=pacing)
+                self.assertTrue(result.correct)
+                self.assertLess(result.duration, 11 * 0.02)
+
+    def test_data_on_an_idle_connection_goes_right_away(self):
+        clock = VirtualClock()
+        layer = functools.partial(SimulatedLossyLayer, SimulatedNetwork(clock, delay=0.01))
+        server = BTCPServerSocket(50, 100, layer, clock)
+        client = BTCPClientSocket(50, 100, layer, clock)
+        try:
+            self.assertTrue(client.connect())
+            clock.sleep(0.5 * TIMER_TICK / 1000)
+            sent = clock.time()
+            client.send(b'data')
+            self.assertEqual(clock.get(server._recvbuf, timeout=1.0), b'data')
+            self.assertAlmostEqual(clock.time() - sent, 0.01)
+        finally:
+            client.close()
+            server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import random
+import unittest
+
+from btcp.adaptive import MIN_PAYLOAD, UDP_OVERHEAD, best_payload
+from btcp.constants import *
+from btcp.simulation import simulate
+
+
+class TestBestPayload(unittest.TestCase):
+    """The payload size with the best goodput for a corruption rate"""
+
+    def test_bounds(self):
+        self.assertEqual(best_payload(0.0, SEGMENT_SIZE, UDP_OVERHEAD, PAYLOAD_SIZE),
+                         PAYLOAD_SIZE)
+        self.assertEqual(best_payload(1.0, SEGMENT_SIZE, UDP_OVERHEAD, PAYLOAD_SIZE),
+                         MIN_PAYLOAD)
+
+    def test_link_limited(self):
+        # At a bit error rate of 1e-4, a full segment is corrupted more often
+        # than not; the optimum for 38 bytes of overhead is near 200 bytes.
+        corruption = 1 - (1 - 1e-4) ** (8 * SEGMENT_SIZE)
+        size = best_payload(corruption, SEGMENT_SIZE, UDP_OVERHEAD + HEADER_SIZE, PAYLOAD_SIZE)
+        self.assertTrue(180 < size < 220, size)
+
+    def test_shrinks_with_corruption(self):
+        sizes = [best_payload(corruption, SEGMENT_SIZE, UDP_OVERHEAD, PAYLOAD_SIZE)
+                 for corruption in (0.01, 0.1, 0.5)]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        # Per window slot, the most intact data per segment is worth more.
+        self.assertGreater(best_payload(0.5, SEGMENT_SIZE, None, PAYLOAD_SIZE), sizes[2])
+
+
+class TestAdaptation(unittest.TestCase):
+    """Adapting the payload size to the corruption the server reports"""
+
+    def test_faster_under_bit_errors(self):
+        data = random.Random(0).randbytes(200_000)
+        fixed = simulate(data, delay=0.01, rate=1e6, bit_error=1e-4)
+        adaptive = simulate(data, delay=0.01, rate=1e6, bit_error=1e-4, adaptive=True)
+        self.assertTrue(fixed.correct)
+        self.assertTrue(adaptive.correct)
+        self.assertLess(adaptive.chunk_size, PAYLOAD_SIZE // 2)
+        self.assertLess(adaptive.duration, fixed.duration * 0.8)
+        # The estimate follows the corruption of the segments sent.
+        self.assertLess(adaptive.corruption_estimate, 0.7)
+
+    def test_clean_link_keeps_full_segments(self):
+        data = random.Random(0).randbytes(100_000)
+        result = simulate(data, delay=0.01, rate=1e6, adaptive=True)
+        self.assertTrue(result.correct)
+        self.assertEqual(result.corruption_estimate, 0.0)
+        self.assertEqual(result.chunk_size, PAYLOAD_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import asyncio
+import random
+import unittest
+
+from btcp.aio import AsyncBTCPClientSocket, AsyncBTCPServerSocket
+
+
+class TestAsyncSockets(unittest.TestCase):
+    """The state machines on an asyncio event loop"""
+
+    def test_transfer(self):
+        data = random.Random(0).randbytes(200_000)
+
+        async def transfer():
+            server = AsyncBTCPServerSocket(50, 100)
+            client = AsyncBTCPClientSocket(50, 100)
+            try:
+                accepted = asyncio.ensure_future(server.accept())
+                # Let the server open its endpoint before the SYN goes out.
+                await asyncio.sleep(0)
+                self.assertTrue(await client.connect())
+                await accepted
+                received = bytearray()
+                async def read():
+                    async for chunk in server:
+                        received.extend(chunk)
+                reader = asyncio.ensure_future(read())
+                self.assertEqual(await client.send(data), len(data))
+                self.assertTrue(await client.shutdown())
+                await asyncio.wait_for(reader, 10)
+                return bytes(received)
+            finally:
+                client.close()
+                server.close()
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(transfer(), 30)), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import random
+import threading
+import unittest
+
+from btcp.btcp_socket import BTCPSocket
+from btcp.client_socket import BTCPClientSocket
+from btcp.constants import *
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+ALGORITHMS = (INTERNET_CHECKSUM, CRC32_CHECKSUM, ADLER32_CHECKSUM)
+
+
+class TestChecksums(unittest.TestCase):
+    """Segments checksummed with each algorithm"""
+
+    def test_segment_size_is_kept(self):
+        for algorithm in ALGORITHMS:
+            with self.subTest(algorithm=algorithm):
+                data = bytes(BTCPSocket.payload_size(algorithm))
+                segment = BTCPSocket.build_segment(1, 2, data=data, algorithm=algorithm)
+                self.assertEqual(len(segment), SEGMENT_SIZE)
+                self.assertEqual(segment[4] & CHECKSUM_MASK, algorithm)
+                self.assertTrue(BTCPSocket.verify_segment(segment))
+
+    def test_trailer_detects_swapped_words(self):
+        data = random.Random(0).randbytes(1000)
+        swapped = data[2:4] + data[0:2] + data[4:]
+        for algorithm, detected in ((INTERNET_CHECKSUM, False), (CRC32_CHECKSUM, True)):
+            with self.subTest(algorithm=algorithm):
+                segment = bytearray(BTCPSocket.build_segment(1, 2, data=data, algorithm=algorithm))
+                segment[HEADER_SIZE:HEADER_SIZE + len(data)] = swapped
+                self.assertEqual(BTCPSocket.verify_segment(segment), not detected)
+
+    def test_unknown_algorithm(self):
+        segment = bytearray(BTCPSocket.build_segment(1, 2, data=b'data', algorithm=CRC32_CHECKSUM))
+        segment[4] |= CHECKSUM_MASK
+        self.assertFalse(BTCPSocket.verify_segment(segment))
+
+
+class TestNegotiation(unittest.TestCase):
+    """The checksum algorithm agreed on in the handshake"""
+
+    def _transfer(self, algorithm, checksums=None):
+        data = random.Random(0).randbytes(100_000)
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        if checksums is not None:
+            server.checksums = checksums
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        received = bytearray()
+        def read():
+            server.accept()
+            while True:
+                chunk = server.recv()
+                if not chunk:
+                    break
+                received.extend(chunk)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            self.assertTrue(client.connect(checksum=algorithm))
+            agreed = client._checksum, server._checksum
+            client.sendall(data)
+            self.assertTrue(client.shutdown())
+            reader.join(10)
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(bytes(received), data)
+        return agreed
+
+    def test_agreed(self):
+        for algorithm in ALGORITHMS:
+            with self.subTest(algorithm=algorithm):
+                self.assertEqual(self._transfer(algorithm), (algorithm, algorithm))
+
+    def test_fallback(self):
+        self.assertEqual(self._transfer(CRC32_CHECKSUM, checksums={ADLER32_CHECKSUM}),
+                         (INTERNET_CHECKSUM, INTERNET_CHECKSUM))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import functools
+import random
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork, simulate, simulate_messages
+
+
+class TestCoalescing(unittest.TestCase):
+    """Small writes gathered into segments, and the nodelay switch"""
+
+    def arrivals(self, writes, nodelay):
+        """Make the writes 1 ms apart on an idle connection with a 10 ms
+        delay each way, and return the (size, time) of every chunk the
+        server received, from the first write on."""
+        clock = VirtualClock()
+        layer = functools.partial(SimulatedLossyLayer, SimulatedNetwork(clock, delay=0.01))
+        server = BTCPServerSocket(50, 100, layer, clock)
+        client = BTCPClientSocket(50, 100, layer, clock)
+        client.nodelay = nodelay
+        arrivals = []
+        try:
+            self.assertTrue(client.connect())
+            clock.sleep(0.05)
+            start = clock.time()
+            for data in writes:
+                client.send(data)
+                clock.sleep(0.001)
+            while sum(size for size, time in arrivals) < sum(map(len, writes)):
+                chunk = clock.get(server._recvbuf, timeout=1.0)
+                arrivals.append((len(chunk), round(clock.time() - start, 6)))
+        finally:
+            client.close()
+            server.close()
+        return arrivals
+
+    def test_small_writes_wait_for_the_ack(self):
+        writes = [b'a' * 100, b'b' * 100, b'c' * 100]
+        # The first goes right away, the others together once it is
+        # acknowledged.
+        self.assertEqual(self.arrivals(writes, False), [(100, 0.01), (200, 0.03)])
+        self.assertEqual(self.arrivals(writes, True), [(100, 0.01), (100, 0.011), (100, 0.012)])
+
+    def test_short_end_of_a_large_write_is_not_held(self):
+        data = bytes(2 * PAYLOAD_SIZE + 500)
+        self.assertEqual(self.arrivals([data], False),
+                         [(PAYLOAD_SIZE, 0.01), (PAYLOAD_SIZE, 0.01), (500, 0.01)])
+
+    def test_fewer_segments(self):
+        data = random.Random(0).randbytes(100_000)
+        coalesced = simulate(data, delay=0.01, write_size=100, write_interval=0.0001)
+        nodelay = simulate(data, delay=0.01, write_size=100, write_interval=0.0001, nodelay=True)
+        self.assertTrue(coalesced.correct and nodelay.correct)
+        self.assertLess(coalesced.segments_sent * 4, nodelay.segments_sent)
+        self.assertLess(coalesced.duration, nodelay.duration * 1.1)
+
+    def test_message_latency(self):
+        coalesced = simulate_messages(50, 100, 0.005, delay=0.01)
+        nodelay = simulate_messages(50, 100, 0.005, nodelay=True, delay=0.01)
+        self.assertTrue(coalesced.correct and nodelay.correct)
+        self.assertLess(nodelay.percentile(0.5), 0.011)
+        self.assertLess(coalesced.segments_sent, nodelay.segments_sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import random
+import threading
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.compression import FRAME, RAW, StreamCompressor, StreamDecompressor
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+TEXT = b''.join(b"line %d of a compressible text\n" % i for i in range(5000))
+
+
+class TestFraming(unittest.TestCase):
+    """Frames of compressed and raw data"""
+
+    def test_round_trip_in_pieces(self):
+        compressor = StreamCompressor()
+        decompressor = StreamDecompressor()
+        messages = [TEXT[:40_000], random.Random(0).randbytes(20_000), TEXT[40_000:], b'']
+        stream = b''.join(compressor.compress(message) for message in messages)
+        self.assertEqual(compressor.consumed, sum(len(message) for message in messages))
+        self.assertEqual(compressor.produced, len(stream))
+        output = bytearray()
+        for offset in range(0, len(stream), 333):
+            output += decompressor.decompress(stream[offset:offset + 333])
+        self.assertEqual(bytes(output), b''.join(messages))
+
+    def test_incompressible_data_is_sent_raw(self):
+        data = random.Random(0).randbytes(10_000)
+        frame = StreamCompressor().compress(data)
+        self.assertEqual(FRAME.unpack_from(frame), (RAW, len(data)))
+        self.assertEqual(frame[FRAME.size:], data)
+
+    def test_frames_decompress_as_they_complete(self):
+        frame = StreamCompressor().compress(TEXT)
+        decompressor = StreamDecompressor()
+        self.assertEqual(decompressor.decompress(frame[:-1]), b'')
+        self.assertEqual(decompressor.decompress(frame[-1:]), TEXT)
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            StreamDecompressor().decompress(FRAME.pack(7, 1) + b'x')
+
+
+class TestCompressedConnection(unittest.TestCase):
+    """Compression negotiated in the handshake"""
+
+    def _transfer(self, compression, server_agrees=True):
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        server.compression = server_agrees
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        received = bytearray()
+        def read():
+            server.accept()
+            while True:
+                chunk = server.recv()
+                if not chunk:
+                    break
+                received.extend(chunk)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            self.assertTrue(client.connect(compression=compression))
+            client.sendall(TEXT)
+            self.assertTrue(client.shutdown())
+            reader.join(10)
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(bytes(received), TEXT)
+        return client.bytes_acknowledged
+
+    def test_compressed(self):
+        self.assertLess(self._transfer(6), len(TEXT) // 4)
+
+    def test_server_declines(self):
+        self.assertEqual(self._transfer(6, server_agrees=False), len(TEXT))
+
+    def test_not_asked_for(self):
+        self.assertEqual(self._transfer(None), len(TEXT))
+
+
+if __name__ == "__main__":
+    unittest.main()
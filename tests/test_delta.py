@@ -0,0 +1,86 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.delta import (DELTA_HEADER, DELTA_MAGIC, DeltaPatcher, delta, parse_signatures,
+                        receive_delta, send_delta, signatures, strong_hash)
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+class TestDelta(unittest.TestCase):
+    """Delta encoding against the signatures of an old copy"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        generator = random.Random(7)
+        self.old_data = generator.randbytes(200000)
+        new = bytearray(self.old_data)
+        new[50000:51000] = generator.randbytes(1000)
+        new[120000:120000] = b'inserted'
+        self.new_data = bytes(new[:-3000])
+        self.old = self._write("old", self.old_data)
+        self.new = self._write("new", self.new_data)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+
+    def test_round_trip(self):
+        # The header send_delta puts in front, which the result is checked
+        # against.
+        block_size, table = parse_signatures(signatures(self.old, 4096))
+        output = os.path.join(self.directory.name, "output")
+        patcher = DeltaPatcher(self.old, output)
+        patcher.feed(DELTA_HEADER.pack(DELTA_MAGIC, len(self.new_data), block_size,
+                                       strong_hash(self.new_data)))
+        literal = 0
+        for header, literal_data in delta(self.new_data, block_size, table):
+            patcher.feed(header + literal_data)
+            literal += len(literal_data)
+        self.assertTrue(patcher.close())
+        with open(output, "rb") as file:
+            self.assertEqual(file.read(), self.new_data)
+        # Only the blocks around the changes travel as literal data.
+        self.assertLess(literal, 4 * 4096)
+
+
+    def test_missing_old_copy(self):
+        block_size, table = parse_signatures(signatures(os.path.join(self.directory.name, "none")))
+        self.assertEqual(table, {})
+        records = list(delta(self.new_data, block_size, table))
+        self.assertEqual(b''.join(data for _, data in records), self.new_data)
+
+
+    def test_over_one_connection(self):
+        destination = self._write("destination", self.old_data)
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        result = []
+        def receive():
+            server.accept()
+            result.append(receive_delta(server, destination, destination))
+        reader = threading.Thread(target=receive)
+        reader.start()
+        try:
+            literal = send_delta(client, self.new)
+            client.shutdown()
+            reader.join()
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(result, [True])
+        self.assertLess(literal, 4 * 4096)
+        with open(destination, "rb") as file:
+            self.assertEqual(file.read(), self.new_data)
@@ -0,0 +1,122 @@
+import functools
+import os
+import random
+import tempfile
+import unittest
+
+import client_app
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.file_io import OffsetWriter
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork
+
+
+class DirectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "output")
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def contents(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+
+class TestOffsetWriter(DirectTestCase):
+    """Segments written at their offsets, with only a bitmap in memory"""
+
+    def test_out_of_order(self):
+        writer = OffsetWriter(self.path, 4)
+        self.assertTrue(writer.write(2, b'cccc'))
+        self.assertTrue(writer.write(1, b'bbbb'))
+        self.assertEqual(writer.contiguous, 0)
+        self.assertTrue(writer.write(0, b'aaaa'))
+        self.assertEqual(writer.contiguous, 3)
+        self.assertFalse(writer.write(1, b'bbbb'))
+        self.assertTrue(writer.write(4, b'ee'))
+        self.assertEqual(writer.contiguous, 3)
+        self.assertTrue(writer.write(3, b'dddd'))
+        self.assertEqual((writer.contiguous, writer.size), (5, 18))
+        writer.close()
+        self.assertEqual(self.contents(), b'aaaabbbbccccddddee')
+
+
+    def test_short_segment_in_the_middle(self):
+        # Segment 1 turns out to be short, so segment 2 and 3 were written in
+        # the wrong place and have to be written again.
+        writer = OffsetWriter(self.path, 4)
+        writer.write(2, b'cccc')
+        writer.write(3, b'dd')
+        writer.write(0, b'aaaa')
+        writer.write(1, b'bb')
+        self.assertEqual((writer.contiguous, writer.size), (2, 6))
+        self.assertNotIn(2, writer)
+        self.assertNotIn(3, writer)
+        self.assertTrue(writer.write(3, b'dd'))
+        self.assertTrue(writer.write(2, b'cc'))
+        self.assertEqual((writer.contiguous, writer.size), (4, 10))
+        writer.close()
+        self.assertEqual(self.contents(), b'aaaabbccdd')
+
+
+    def test_larger_segments(self):
+        writer = OffsetWriter(self.path, 2)
+        writer.write(0, b'aaaa')
+        writer.write(2, b'cccc')
+        writer.write(1, b'bbbb')
+        writer.close()
+        self.assertEqual(self.contents(), b'aaaabbbbcccc')
+
+
+    def test_legacy_acknumber_wraps(self):
+        # The old application's direct mode, across sequence number 0xFFFF.
+        server = client_app.bTCP_server.__new__(client_app.bTCP_server)
+        server.firstack = server.acknumber = 0xFFF0
+        server.data = OffsetWriter(self.path, 1000)
+        payloads = [bytes([i]) * 1000 for i in range(40)]
+        order = list(range(40))
+        random.Random(1).shuffle(order)
+        for i in order:
+            server.add_data_direct(((0xFFF0 + i) & 0xFFFF, 0, 0, 0, 1000, 0), payloads[i])
+        server.data.close()
+        self.assertEqual(server.acknumber, (0xFFF0 + 40) & 0xFFFF)
+        self.assertEqual(self.contents(), b''.join(payloads))
+
+
+class TestDirectServer(DirectTestCase):
+    """A BTCPServerSocket writing straight to disk, over a simulated network"""
+
+    def transfer(self, data, nodelay=False, **network):
+        clock = VirtualClock()
+        layer = functools.partial(SimulatedLossyLayer, SimulatedNetwork(clock, **network))
+        server = BTCPServerSocket(50, 100, layer, clock)
+        client = BTCPClientSocket(50, 100, layer, clock)
+        client.nodelay = nodelay
+        writer = server.writer = OffsetWriter(self.path)
+        self.assertTrue(client.connect(compression=6))
+        view = memoryview(data)
+        sent = 0
+        while sent < len(data):
+            sent += client.send(view[sent:sent + random.Random(sent).randrange(1, 3000)])
+            clock.sleep(0.001)
+        self.assertTrue(client.shutdown())
+        client.close()
+        server.close()
+        writer.close()
+        self.assertEqual(self.contents(), data)
+
+
+    def test_loss_and_reordering(self):
+        self.transfer(random.Random(2).randbytes(400000), delay=0.01, jitter=0.005,
+                      loss=0.05, seed=3)
+
+
+    def test_short_segments(self):
+        self.transfer(random.Random(4).randbytes(100000), nodelay=True, delay=0.01,
+                      jitter=0.005, loss=0.05, seed=5)
@@ -0,0 +1,87 @@
+import functools
+import queue
+import random
+import unittest
+
+from btcp.btcp_socket import BTCPStates
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork
+
+
+class TestServerSender(unittest.TestCase):
+    """The server sends its data the way the client does"""
+
+    def transfer(self, server_data, client_data=b'', options={}, **network):
+        """Send server_data to the client and client_data the other way at
+        the same time, over a simulated network, with the server attributes
+        in options set. Returns the server socket and how long sending took,
+        once both arrived intact."""
+        clock = VirtualClock()
+        layer = functools.partial(SimulatedLossyLayer, SimulatedNetwork(clock, **network))
+        server = BTCPServerSocket(50, 100, layer, clock)
+        client = BTCPClientSocket(50, 100, layer, clock)
+        for name, value in options.items():
+            setattr(server, name, value)
+        self.assertTrue(client.connect())
+
+        # The client application writes and reads every millisecond.
+        received = bytearray()
+        written = [0]
+        def client_app():
+            written[0] += client.send(client_data[written[0]:])
+            try:
+                while True:
+                    received.extend(client._recvbuf.get_nowait())
+            except queue.Empty:
+                pass
+            if client._lossy_layer is not None:
+                clock.call_later(0.001, client_app)
+        client_app()
+        # The client's data completes the handshake if its ACK got lost.
+        while server._state != BTCPStates.ESTABLISHED:
+            clock.sleep(0.001)
+
+        start = clock.time()
+        self.assertEqual(server.sendall(server_data), len(server_data))
+        echoed = bytearray()
+        while len(echoed) < len(client_data):
+            echoed.extend(server.recv())
+        while len(received) < len(server_data):
+            clock.sleep(0.001)
+        duration = clock.time() - start
+        self.assertTrue(client.shutdown())
+        client.close()
+        server.close()
+        self.assertEqual(bytes(received), server_data)
+        self.assertEqual(bytes(echoed), client_data)
+        return server, duration
+
+
+    def test_naks(self):
+        server, duration = self.transfer(random.Random(1).randbytes(300000),
+                               delay=0.01, loss=0.05, seed=2)
+        self.assertGreater(server.naks_received, 0)
+        self.assertGreater(server.retransmissions, 0)
+
+
+    def test_failures_reported_on_duplex_connection(self):
+        # The client's ACKs ride on its data segments, which have no room
+        # for its checksum failure count; it still reaches the server.
+        server, duration = self.transfer(random.Random(3).randbytes(400000),
+                                         random.Random(4).randbytes(400000),
+                                         {"adaptive": True},
+                                         delay=0.01, bit_error=1e-4, seed=5)
+        self.assertGreater(server._failures_reported, 0)
+        self.assertGreater(server.corruption_estimate, 0)
+        self.assertLess(server.chunk_size, PAYLOAD_SIZE)
+
+
+    def test_rate_limit(self):
+        server, duration = self.transfer(random.Random(6).randbytes(100000),
+                                         options={"rate_limit": 200000}, delay=0.01)
+        self.assertGreater(duration, 0.4)
+        server, duration = self.transfer(random.Random(6).randbytes(100000), delay=0.01)
+        self.assertLess(duration, 0.2)
@@ -0,0 +1,58 @@
+import functools
+import random
+import unittest
+
+from btcp.fec import (FEC_TARGET, GROUP_SIZES, group_size, pack_group, payload_value,
+                      unpack_group, value_payload)
+from btcp.simulation import simulate
+
+
+class TestParity(unittest.TestCase):
+    """XOR parity groups"""
+
+    def test_pack_group(self):
+        for n, k, j in ((1, 1, 0), (16, 4, 3), (256, 16, 15)):
+            with self.subTest(n=n, k=k, j=j):
+                field = pack_group(n, k, j)
+                self.assertLessEqual(field, 0xFFFF)
+                self.assertEqual(unpack_group(field), (n, k, j))
+
+    def test_group_size(self):
+        self.assertEqual(group_size(0.0), GROUP_SIZES[0])
+        self.assertEqual(group_size(0.5), GROUP_SIZES[-1])
+        sizes = [group_size(loss / 1000) for loss in range(0, 200, 5)]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        # Two losses in a group of the size chosen are unlikely enough.
+        loss = 0.01
+        n = group_size(loss) + 1
+        self.assertLessEqual(1 - (1 - loss) ** n - n * loss * (1 - loss) ** (n - 1), FEC_TARGET)
+
+    def test_rebuild(self):
+        generator = random.Random(0)
+        group = [generator.randbytes(1000), generator.randbytes(1000), generator.randbytes(700)]
+        parity = functools.reduce(lambda a, b: a ^ b, map(payload_value, group))
+        lengths = functools.reduce(lambda a, b: a ^ b, map(len, group))
+        # Lose the short one: the others and the parity give it back.
+        value = parity ^ payload_value(group[0]) ^ payload_value(group[1])
+        length = lengths ^ len(group[0]) ^ len(group[1])
+        self.assertEqual(value_payload(value, length), group[2])
+
+
+class TestFecTransfer(unittest.TestCase):
+    """Transfers with parity over a lossy simulated network"""
+
+    data = random.Random(0).randbytes(300_000)
+
+    def test_parity_saves_retransmissions(self):
+        plain = simulate(self.data, delay=0.01, loss=0.05)
+        fec = simulate(self.data, delay=0.01, loss=0.05, fec=True)
+        self.assertTrue(fec.correct)
+        self.assertLess(fec.retransmissions, plain.retransmissions)
+        self.assertLess(fec.duration, plain.duration)
+
+    def test_clean(self):
+        self.assertTrue(simulate(self.data, delay=0.01, fec=True).correct)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import random
+import tempfile
+import unittest
+
+from btcp.constants import *
+from btcp.file_io import BufferedSink, send_file
+
+
+class FakeClient:
+    """Stands in for a connected BTCPClientSocket, acknowledging everything
+    it is handed at once."""
+
+    def __init__(self, window, accept=None):
+        self._window = window
+        self.bytes_acknowledged = 0
+        self.blocks = []
+        self._accept = accept
+
+
+    def sendall(self, block):
+        self.blocks.append(bytes(block))
+        sent = len(block) if self._accept is None else min(len(block), self._accept)
+        self.bytes_acknowledged += sent
+        return sent
+
+
+class TestFileStreaming(unittest.TestCase):
+    """Files streamed with bounded memory"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "file")
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def test_sink_writes_when_full(self):
+        sink = BufferedSink(self.path, 1000)
+        sink.write(b'a' * 600)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        sink.write(b'b' * 600)
+        self.assertEqual(os.path.getsize(self.path), 1200)
+        sink.write(b'c' * 10)
+        sink.close()
+        self.assertEqual(sink.written, 1210)
+        with open(self.path, "rb") as file:
+            self.assertEqual(file.read(), b'a' * 600 + b'b' * 600 + b'c' * 10)
+
+
+    def test_send_file_in_blocks(self):
+        data = random.Random(0).randbytes(10 * PAYLOAD_SIZE + 1)
+        with open(self.path, "wb") as file:
+            file.write(data)
+        # One window's worth at a time, unless told otherwise.
+        for window, read_ahead, block_size in ((4, None, 4 * PAYLOAD_SIZE),
+                                               (4, 2, 2 * PAYLOAD_SIZE)):
+            with self.subTest(window=window, read_ahead=read_ahead):
+                client = FakeClient(window)
+                self.assertEqual(send_file(client, self.path, read_ahead), len(data))
+                self.assertTrue(all(len(block) <= block_size for block in client.blocks))
+                self.assertEqual(b''.join(client.blocks), data)
+
+
+    def test_send_file_stops_when_connection_does(self):
+        with open(self.path, "wb") as file:
+            file.write(bytes(10 * PAYLOAD_SIZE))
+        client = FakeClient(2, accept=PAYLOAD_SIZE)
+        self.assertEqual(send_file(client, self.path), PAYLOAD_SIZE)
+        self.assertEqual(len(client.blocks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import functools
+import queue
+import unittest
+
+from btcp.btcp_socket import BTCPStates
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPListenSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork
+
+
+class TestListenSocket(unittest.TestCase):
+    """Many clients on one address"""
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        network = SimulatedNetwork(self.clock, delay=0.005, loss=0.02)
+        self.layer = functools.partial(SimulatedLossyLayer, network)
+
+    def client(self, i):
+        return BTCPClientSocket(50, 100, self.layer, self.clock,
+                                local_address=(CLIENT_IP, CLIENT_PORT + i))
+
+    def test_clients_get_their_own_connection(self):
+        listener = BTCPListenSocket(50, 100, layer=self.layer, clock=self.clock)
+        payloads = [bytes([i]) * 30_000 for i in range(5)]
+        clients = [self.client(i) for i in range(5)]
+
+        # The server application accepts and reads every millisecond.
+        received = []
+        def serve():
+            while True:
+                connection = listener.accept(0)
+                if connection is None:
+                    break
+                received.append((connection, bytearray()))
+            for connection, data in received:
+                try:
+                    while True:
+                        data.extend(connection._recvbuf.get_nowait())
+                except queue.Empty:
+                    pass
+            self.clock.call_later(0.001, serve)
+        serve()
+
+        for client, payload in zip(clients, payloads):
+            client._start_connect()
+            def send(client=client, payload=payload, sent=0):
+                if client._state == BTCPStates.ESTABLISHED:
+                    sent += client.send(payload[sent:])
+                    if sent == len(payload):
+                        client._start_shutdown()
+                if client._state != BTCPStates.CLOSED:
+                    self.clock.call_later(0.001, send, client, payload, sent)
+            send()
+
+        self.clock.run(until=30, stop=lambda: all(client._state == BTCPStates.CLOSED
+                                                  for client in clients))
+        listener.close()
+        self.assertEqual(sorted(bytes(data) for connection, data in received), payloads)
+
+    def test_backlog(self):
+        listener = BTCPListenSocket(50, 100, backlog=2, layer=self.layer, clock=self.clock)
+        clients = [self.client(i) for i in range(4)]
+        for client in clients:
+            client._start_connect()
+        # Nobody accepts: only two connections get a SYN|ACK.
+        self.clock.run(until=0.05)
+        self.assertGreaterEqual(listener.syns_dropped, 2)
+        self.assertEqual(sum(client._state == BTCPStates.ESTABLISHED for client in clients), 2)
+        # Once those are accepted, the others get in when they try again.
+        accepted = [listener.accept(0), listener.accept(0)]
+        self.assertNotIn(None, accepted)
+        while len(accepted) < 4 and self.clock.time() < 10:
+            connection = listener.accept(0.01)
+            if connection is not None:
+                accepted.append(connection)
+        self.assertEqual(len(accepted), 4)
+        listener.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import random
+import threading
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+class TestLoopbackLayer(unittest.TestCase):
+    """Endpoints in one process, paired by address"""
+
+    def test_transfer(self):
+        data = random.Random(0).randbytes(200_000)
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        received = bytearray()
+        def read():
+            while len(received) < len(data):
+                chunk = server.recv()
+                if not chunk:
+                    break
+                received.extend(chunk)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            self.assertTrue(client.connect())
+            client.sendall(data)
+            client.shutdown()
+            reader.join(10)
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(bytes(received), data)
+
+    def test_address_in_use(self):
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        try:
+            with self.assertRaises(OSError):
+                BTCPServerSocket(50, 100, LoopbackLayer)
+        finally:
+            server.close()
+        BTCPServerSocket(50, 100, LoopbackLayer).close()
+
+    def test_nobody_bound(self):
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        try:
+            # Dropped, like a UDP datagram to a closed port.
+            client._lossy_layer.send_segment(b'segment')
+        finally:
+            client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
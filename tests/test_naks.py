@@ -0,0 +1,89 @@
+import functools
+import queue
+import random
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.constants import *
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork, simulate
+
+
+class DroppingNetwork(SimulatedNetwork):
+    """Simulated network that loses the segments other than SYNs and FINs
+    the client sends with the given transmission numbers (counting from 1),
+    and nothing else."""
+
+    def __init__(self, clock, drop, **options):
+        super().__init__(clock, **options)
+        self._drop = set(drop)
+        self.data_sent = 0
+
+    def transmit(self, source, destination, segment):
+        if source == (CLIENT_IP, CLIENT_PORT) and segment[4] & (SYN_FLAG | FIN_FLAG) == 0:
+            self.data_sent += 1
+            if self.data_sent in self._drop:
+                self.segments_sent += 1
+                self.segments_lost += 1
+                return
+        super().transmit(source, destination, segment)
+
+
+def transfer(data, drop, naks=True, tail_loss_probe=True):
+    """Send data from client to server over a DroppingNetwork with 10 ms of
+    delay each way. Returns the client and the time from the first byte sent
+    to the last byte received."""
+    clock = VirtualClock()
+    layer = functools.partial(SimulatedLossyLayer, DroppingNetwork(clock, drop, delay=0.01))
+    server = BTCPServerSocket(50, 100, layer, clock)
+    client = BTCPClientSocket(50, 100, layer, clock)
+    server.naks = naks
+    client.tail_loss_probe = tail_loss_probe
+    assert client.connect()
+    start = clock.time()
+    client.sendall(data)
+    received = bytearray()
+    while len(received) < len(data):
+        try:
+            received.extend(clock.get(server._recvbuf, timeout=1.0))
+        except queue.Empty:
+            break
+    duration = clock.time() - start
+    client.shutdown()
+    client.close()
+    server.close()
+    assert bytes(received) == data
+    return client, duration
+
+
+class TestNaks(unittest.TestCase):
+    """Missing segments named by the server"""
+
+    data = random.Random(0).randbytes(20 * PAYLOAD_SIZE)
+
+    def test_gaps_are_repaired_before_the_timeout(self):
+        # The ACK of the handshake is the client's first transmission.
+        client, duration = transfer(self.data, {5, 8, 11})
+        self.assertGreater(client.naks_received, 0)
+        self.assertEqual(client.retransmissions, 3)
+        self.assertLess(duration, 0.1)
+
+    def test_without_naks_gaps_wait_for_the_timeout(self):
+        # Duplicate ACKs only bring back the first missing segment.
+        client, duration = transfer(self.data, {5, 8, 11}, naks=False)
+        self.assertEqual(client.naks_received, 0)
+        self.assertGreater(client.retransmissions, 3)
+        self.assertGreater(duration, 0.1)
+
+    def test_faster_under_loss(self):
+        data = random.Random(0).randbytes(300_000)
+        with_naks = simulate(data, delay=0.01, loss=0.05)
+        without = simulate(data, delay=0.01, loss=0.05, naks=False)
+        self.assertTrue(with_naks.correct)
+        self.assertLess(with_naks.duration, without.duration)
+        self.assertLess(with_naks.retransmissions, without.retransmissions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import random
+import unittest
+
+from btcp.constants import *
+from btcp.pacing import TokenBucket, limit_process, process_bucket
+from btcp.simulation import simulate
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Rate and burst of a token bucket"""
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(1000, 500)
+        self.assertEqual(bucket.ready_at(0.0), 0.0)
+        bucket.spend(0.0, 500)
+        self.assertEqual(bucket.ready_at(0.0), 0.0)
+        # In debt: ready once the debt is paid off at the rate.
+        bucket.spend(0.0, 300)
+        self.assertAlmostEqual(bucket.ready_at(0.1), 0.3)
+        self.assertEqual(bucket.ready_at(0.4), 0.4)
+
+    def test_fills_up_to_burst(self):
+        bucket = TokenBucket(1000, 500)
+        bucket.spend(0.0, 500)
+        bucket.spend(10.0, 500)
+        bucket.spend(10.0, 1)
+        self.assertAlmostEqual(bucket.ready_at(10.0), 10.001)
+
+    def test_time_going_back(self):
+        bucket = TokenBucket(1000, 500)
+        bucket.spend(1.0, 600)
+        # An earlier time (another thread's clock reading) fills nothing.
+        self.assertAlmostEqual(bucket.ready_at(0.5), 0.6)
+
+
+class TestPacing(unittest.TestCase):
+    """Paced and rate limited senders on a link with a small buffer"""
+
+    data = random.Random(0).randbytes(300_000)
+    link = {"delay": 0.01, "rate": 1e6, "buffer": 32 * 1024}
+
+    def tearDown(self):
+        limit_process(None)
+
+    def test_paced_bursts_are_small(self):
+        back_to_back = simulate(self.data, pacing=False, **self.link)
+        paced = simulate(self.data, **self.link)
+        self.assertTrue(paced.correct)
+        self.assertLessEqual(paced.max_burst, 5)
+        self.assertGreater(back_to_back.max_burst, 5 * paced.max_burst)
+        self.assertLess(paced.segments_lost, back_to_back.segments_lost)
+
+    def test_rate_limit_below_the_link_loses_nothing(self):
+        result = simulate(self.data, rate_limit=0.95e6, **self.link)
+        self.assertTrue(result.correct)
+        self.assertEqual(result.segments_lost, 0)
+        self.assertGreater(result.duration, len(self.data) / 0.95e6)
+
+    def test_process_limit(self):
+        limit_process(0.5e6)
+        self.assertIsNotNone(process_bucket())
+        result = simulate(self.data, delay=0.01)
+        self.assertTrue(result.correct)
+        # The cap starts out full, with a tenth of a second's worth.
+        self.assertGreater(result.duration, (len(self.data) - 0.05e6) / 0.5e6)
+        limit_process(None)
+        self.assertIsNone(process_bucket())
+
+
+if __name__ == "__main__":
+    unittest.main()
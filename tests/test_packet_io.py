@@ -0,0 +1,78 @@
+import unittest
+
+from btcp.poster import packet_io
+
+
+ADDRESS = ("localhost", 20000)
+
+
+class FakeSocket:
+    """A non-blocking socket that would block while blocked is set."""
+
+    def __init__(self):
+        self.blocked = False
+        self.sent = []
+
+    def setblocking(self, flag):
+        pass
+
+    def sendmsg(self, buffers, ancdata, flags, address):
+        if self.blocked:
+            raise BlockingIOError
+        self.sent.append(b''.join(buffers))
+
+
+class TestControlPriority(unittest.TestCase):
+    """Control segments ahead of backlogged data"""
+
+    def setUp(self):
+        self.socket = FakeSocket()
+        # Driven from the test; the thread isn't started.
+        self.io = packet_io(lambda item: None, self.socket)
+
+    def test_sent_right_away(self):
+        self.io.send(b'data', ADDRESS)
+        self.io.send(b'ack', ADDRESS, control=True)
+        self.assertEqual(self.socket.sent, [b'data', b'ack'])
+        self.assertEqual((self.io.data_delay.count, self.io.data_delay.max), (1, 0.0))
+        self.assertEqual((self.io.control_delay.count, self.io.control_delay.max), (1, 0.0))
+
+    def test_control_passes_backlogged_data(self):
+        self.socket.blocked = True
+        self.io.send(b'data 1', ADDRESS)
+        self.io.send(b'data 2', ADDRESS)
+        self.socket.blocked = False
+        # The socket has room again before the thread flushed: the ACK
+        # doesn't wait, the data does.
+        self.io.send(b'ack', ADDRESS, control=True)
+        self.io.send(b'data 3', ADDRESS)
+        self.assertEqual(self.socket.sent, [b'ack'])
+        self.io.flush()
+        self.assertEqual(self.socket.sent, [b'ack', b'data 1', b'data 2', b'data 3'])
+        self.assertEqual(self.io.data_delay.count, 3)
+        self.assertGreater(self.io.data_delay.max, 0.0)
+
+    def test_flush_sends_control_first(self):
+        self.socket.blocked = True
+        self.io.send(b'data', ADDRESS)
+        self.io.send(b'syn', ADDRESS, control=True)
+        self.io.send(b'fin', ADDRESS, control=True)
+        self.socket.blocked = False
+        # Neither class jumps backlogged control segments.
+        self.io.send(b'more data', ADDRESS)
+        self.io.send(b'ack', ADDRESS, control=True)
+        self.io.flush()
+        self.assertEqual(self.socket.sent, [b'syn', b'fin', b'ack', b'data', b'more data'])
+        self.assertFalse(self.io.backlog or self.io.control_backlog)
+
+    def test_flush_stops_when_blocked(self):
+        self.socket.blocked = True
+        self.io.send(b'ack', ADDRESS, control=True)
+        self.io.send(b'data', ADDRESS)
+        self.io.flush()
+        self.assertEqual(self.socket.sent, [])
+        self.assertEqual((len(self.io.control_backlog), len(self.io.backlog)), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import random
+import threading
+import unittest
+
+from btcp.client_socket import BTCPClientSocket, probe_sizes
+from btcp.constants import *
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+PATH_SIZE = 9000
+
+
+class PathLayer(LoopbackLayer):
+    """Loopback layer on a path that drops segments over PATH_SIZE bytes."""
+
+    def send_segment_to(self, segment, address):
+        if len(segment) <= PATH_SIZE:
+            super().send_segment_to(segment, address)
+
+
+class TestPayloadSize(unittest.TestCase):
+    """The payload size agreed on in the handshake"""
+
+    def test_probe_sizes(self):
+        self.assertEqual(probe_sizes(PAYLOAD_SIZE), [PAYLOAD_SIZE])
+        self.assertEqual(probe_sizes(5000), [PAYLOAD_SIZE, 2016, 4032, 5000])
+
+    def _transfer(self, layer=LoopbackLayer, server_max=None, **options):
+        data = random.Random(0).randbytes(200_000)
+        server = BTCPServerSocket(50, 100, layer)
+        if server_max is not None:
+            server.max_payload = server_max
+        client = BTCPClientSocket(50, 100, layer)
+        received = bytearray()
+        def read():
+            server.accept()
+            while True:
+                chunk = server.recv()
+                if not chunk:
+                    break
+                received.extend(chunk)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            self.assertTrue(client.connect(**options))
+            client.sendall(data)
+            self.assertTrue(client.shutdown())
+            reader.join(10)
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(bytes(received), data)
+        return client._segment_payload
+
+    def test_default(self):
+        self.assertEqual(self._transfer(), PAYLOAD_SIZE)
+
+    def test_larger(self):
+        self.assertEqual(self._transfer(max_payload=16384), 16384)
+
+    def test_server_limit(self):
+        self.assertEqual(self._transfer(server_max=4000, max_payload=16384), 4000)
+
+    def test_request_halved_until_answered(self):
+        self.assertEqual(self._transfer(PathLayer, max_payload=32768), 8192)
+
+    def test_probe(self):
+        self.assertEqual(self._transfer(PathLayer, max_payload=32768, probe=True), 8064)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.loopback_layer import LoopbackLayer
+from btcp.resume import ResumableReceiver, checkpoint_path, missing_ranges, send_resumable
+from btcp.server_socket import BTCPServerSocket
+
+
+class TestMissingRanges(unittest.TestCase):
+    """Gaps between the ranges a receiver has"""
+
+    def test_missing_ranges(self):
+        self.assertEqual(missing_ranges(100, []), [(0, 100)])
+        self.assertEqual(missing_ranges(100, [(0, 100)]), [])
+        self.assertEqual(missing_ranges(100, [(60, 10), (10, 20)]), [(0, 10), (30, 30), (70, 30)])
+        # Overlapping and adjacent ranges.
+        self.assertEqual(missing_ranges(100, [(0, 50), (20, 10), (50, 20)]), [(70, 30)])
+        self.assertEqual(missing_ranges(0, []), [])
+
+
+class TestResumableTransfer(unittest.TestCase):
+    """A transfer that dies half way and is resumed"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source")
+        self.destination = os.path.join(self.directory.name, "destination")
+        self.data = random.Random(0).randbytes(300_000)
+        with open(self.source, "wb") as file:
+            file.write(self.data)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def _transfer(self, limit=None):
+        """Send the source, or its first limit bytes, to a fresh receiver.
+        Returns (bytes sent, file complete, bytes the receiver resumed from)."""
+        receiver = ResumableReceiver(self.destination, checkpoint_interval=50_000)
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        server.handshake = receiver.handshake
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        result = []
+        def receive():
+            server.accept()
+            result.append(receiver.receive(server))
+        reader = threading.Thread(target=receive)
+        reader.start()
+        try:
+            sent = send_resumable(client, self.source, limit)
+            client.shutdown()
+            reader.join()
+        finally:
+            client.close()
+            server.close()
+        return sent, result[0], receiver.resumed
+
+
+    def test_resume(self):
+        self.assertEqual(self._transfer(limit=120_000), (120_000, False, 0))
+        self.assertTrue(os.path.exists(checkpoint_path(self.destination)))
+
+        sent, complete, resumed = self._transfer()
+        self.assertTrue(complete)
+        self.assertEqual(resumed, 120_000)
+        self.assertEqual(sent, len(self.data) - 120_000)
+        self.assertFalse(os.path.exists(checkpoint_path(self.destination)))
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), self.data)
+
+
+    def test_damaged_range_is_sent_again(self):
+        self._transfer(limit=120_000)
+        with open(self.destination, "r+b") as file:
+            file.seek(1000)
+            file.write(b'damaged')
+        sent, complete, resumed = self._transfer()
+        self.assertTrue(complete)
+        self.assertEqual((sent, resumed), (len(self.data), 0))
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
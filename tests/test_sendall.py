@@ -0,0 +1,48 @@
+import functools
+import queue
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.clock import VirtualClock
+from btcp.server_socket import BTCPServerSocket
+from btcp.simulation import SimulatedLossyLayer, SimulatedNetwork
+
+
+class TestSendall(unittest.TestCase):
+    """BTCPSocket.sendall on a simulated connection"""
+
+    def setUp(self):
+        self.clock = VirtualClock()
+        network = SimulatedNetwork(self.clock, delay=0.01, loss=0.05, seed=1)
+        layer = functools.partial(SimulatedLossyLayer, network)
+        self.server = BTCPServerSocket(50, 100, layer, self.clock)
+        self.client = BTCPClientSocket(50, 100, layer, self.clock)
+        self.received = bytearray()
+        self._read()
+
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+
+    def _read(self):
+        try:
+            while True:
+                self.received.extend(self.server._recvbuf.get_nowait())
+        except queue.Empty:
+            pass
+        if self.server._lossy_layer is not None:
+            self.clock.call_later(0.001, self._read)
+
+
+    def test_more_than_the_send_buffer(self):
+        data = bytes(range(256)) * 8000
+        self.assertTrue(self.client.connect())
+        self.assertEqual(self.client.sendall(data), len(data))
+        self.assertTrue(self.client.shutdown())
+        self.assertEqual(bytes(self.received), data)
+
+
+    def test_connection_down(self):
+        self.assertEqual(self.client.sendall(b'x' * 10000), 0)
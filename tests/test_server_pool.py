@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.constants import *
+from btcp.server_pool import ServerPool
+
+
+ADDRESS = (SERVER_IP, SERVER_PORT + 100)
+
+
+class TestServerPool(unittest.TestCase):
+    """Worker processes sharing one address"""
+
+    def setUp(self):
+        self.pool = ServerPool(2, 50, 100, address=ADDRESS, interval=0.1)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_clients_are_served(self):
+        data = random.Random(0).randbytes(100_000)
+        for i in range(3):
+            client = BTCPClientSocket(50, 100, local_address=(CLIENT_IP, CLIENT_PORT + 100 + i),
+                                      remote_address=ADDRESS)
+            try:
+                self.assertTrue(client.connect())
+                self.assertEqual(client.sendall(data), len(data))
+                client.shutdown()
+            finally:
+                client.close()
+        # The workers report every 0.1 seconds.
+        for attempt in range(50):
+            self.pool.poll(0.1)
+            stats = self.pool.stats()
+            if stats["bytes"] == 3 * len(data):
+                break
+        self.assertEqual(stats["connections"], 3)
+        self.assertEqual(stats["bytes"], 3 * len(data))
+
+    def test_dead_worker_is_restarted(self):
+        self.pool._processes[0].terminate()
+        self.pool._processes[0].join()
+        self.pool.poll()
+        self.assertEqual(self.pool.restarts, 1)
+        self.pool.poll(0.5)
+        self.assertEqual(self.pool.stats()["workers"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
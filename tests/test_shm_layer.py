@@ -0,0 +1,73 @@
+import os
+import select
+import threading
+import time
+import unittest
+
+from btcp.shm_layer import WAITING_OFFSET, SharedMemoryRing, ring_name
+
+
+class TestSharedMemoryRing(unittest.TestCase):
+    """The ring of segments between a producer and a consumer"""
+
+    def setUp(self):
+        name = ring_name("test", os.getpid())
+        self.consumer = SharedMemoryRing(name, create=True, slots=4)
+        self.producer = SharedMemoryRing(name, slots=4)
+
+    def tearDown(self):
+        self.producer.close()
+        self.consumer.close()
+
+    def pending_wakeup(self):
+        rlist, wlist, elist = select.select([self.consumer], [], [], 0)
+        return bool(rlist)
+
+    def test_get_is_a_view_until_released(self):
+        self.assertIsNone(self.consumer.get())
+        self.assertTrue(self.producer.put(b'first'))
+        self.assertTrue(self.producer.put(b'second'))
+        segment = self.consumer.get()
+        self.assertIsInstance(segment, memoryview)
+        self.assertEqual(segment, b'first')
+        self.assertIs(self.consumer.get(), segment)
+        self.consumer.release()
+        self.assertEqual(self.consumer.get(), b'second')
+        self.consumer.release()
+        self.assertIsNone(self.consumer.get())
+
+    def test_full_ring_drops(self):
+        for i in range(4):
+            self.assertTrue(self.producer.put(bytes([i])))
+        self.assertFalse(self.producer.put(b'dropped'))
+        self.consumer.get()
+        # The slot is only free once released.
+        self.assertFalse(self.producer.put(b'dropped'))
+        self.consumer.release()
+        self.assertTrue(self.producer.put(b'fits'))
+
+    def test_no_wakeup_unless_waiting(self):
+        self.producer.put(b'segment')
+        self.assertFalse(self.pending_wakeup())
+        # A consumer about to sleep finds the segment instead.
+        self.assertTrue(self.consumer.sleep(0))
+        self.consumer.get()
+        self.consumer.release()
+        self.assertFalse(self.consumer.sleep(0))
+
+    def test_one_wakeup_per_sleep(self):
+        woken = []
+        sleeper = threading.Thread(target=lambda: woken.append(self.consumer.sleep(5)))
+        sleeper.start()
+        while not self.consumer._get(WAITING_OFFSET):
+            time.sleep(0.001)
+        for i in range(3):
+            self.producer.put(bytes([i]))
+        sleeper.join()
+        self.assertEqual(woken, [True])
+        # The wakeup was consumed, and the others didn't write any.
+        self.assertFalse(self.pending_wakeup())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import queue
+import random
+import unittest
+
+from btcp.btcp_socket import BTCPSocket
+from btcp.clock import VirtualClock
+from btcp.simulation import simulate
+
+
+class TestVirtualClock(unittest.TestCase):
+    """Discrete-event time"""
+
+    def test_events_run_in_order(self):
+        clock = VirtualClock()
+        ran = []
+        clock.call_at(2.0, ran.append, "b")
+        clock.call_later(1.0, ran.append, "a")
+        clock.call_at(2.0, ran.append, "c")
+        clock.cancel(clock.call_at(1.5, ran.append, "cancelled"))
+        clock.run()
+        self.assertEqual(ran, ["a", "b", "c"])
+        self.assertEqual(clock.time(), 2.0)
+        self.assertFalse(clock.pending())
+
+    def test_sleep_runs_events_in_between(self):
+        clock = VirtualClock()
+        ran = []
+        clock.call_at(0.5, ran.append, 1)
+        clock.call_at(3.0, ran.append, 2)
+        clock.sleep(1.0)
+        self.assertEqual(ran, [1])
+        self.assertEqual(clock.time(), 1.0)
+
+    def test_get(self):
+        clock = VirtualClock()
+        buf = queue.Queue()
+        clock.call_at(5.0, buf.put, "item")
+        self.assertEqual(clock.get(buf), "item")
+        self.assertEqual(clock.time(), 5.0)
+        clock.call_at(10.0, buf.put, "late")
+        with self.assertRaises(queue.Empty):
+            clock.get(buf, timeout=1.0)
+        self.assertEqual(clock.time(), 6.0)
+        clock.run()
+        # Nothing left that could fill the queue.
+        buf.get_nowait()
+        with self.assertRaises(queue.Empty):
+            clock.get(buf)
+
+
+class TestUnwrapSeqnum(unittest.TestCase):
+    """16 bit sequence numbers onto unbounded ones"""
+
+    def test_unwrap(self):
+        self.assertEqual(BTCPSocket.unwrap_seqnum(5, 3), 5)
+        self.assertEqual(BTCPSocket.unwrap_seqnum(1, 3), 1)
+        # Across the wrap, both ways.
+        self.assertEqual(BTCPSocket.unwrap_seqnum(2, 0xFFFE), 0x10002)
+        self.assertEqual(BTCPSocket.unwrap_seqnum(0xFFFE, 0x10002), 0xFFFE)
+        self.assertEqual(BTCPSocket.unwrap_seqnum(0x1234, 5 * 0x10000), 5 * 0x10000 + 0x1234)
+
+
+class TestSimulate(unittest.TestCase):
+    """Transfers over the simulated network"""
+
+    data = random.Random(0).randbytes(300_000)
+
+    def test_clean(self):
+        result = simulate(self.data, delay=0.01)
+        self.assertTrue(result.correct)
+        self.assertEqual(result.retransmissions, 0)
+
+    def test_impairments(self):
+        for network in ({"loss": 0.05}, {"loss": 0.1, "loss_correlation": 0.25},
+                        {"jitter": 0.005, "duplicate": 0.05}, {"rate": 1e6, "buffer": 20_000}):
+            with self.subTest(**network):
+                result = simulate(self.data, delay=0.01, **network)
+                self.assertTrue(result.correct)
+
+    def test_loss_costs_retransmissions(self):
+        result = simulate(self.data, delay=0.01, loss=0.05)
+        self.assertGreater(result.retransmissions, 0)
+        self.assertGreater(result.duration, simulate(self.data, delay=0.01).duration)
+
+    def test_deterministic(self):
+        first = simulate(self.data, delay=0.01, loss=0.05, seed=3)
+        second = simulate(self.data, delay=0.01, loss=0.05, seed=3)
+        self.assertEqual(first.duration, second.duration)
+        self.assertEqual(first.retransmissions, second.retransmissions)
+
+
+if __name__ == "__main__":
+    unittest.main()
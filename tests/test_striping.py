@@ -0,0 +1,74 @@
+import random
+import unittest
+
+from btcp.simulation import simulate, simulate_striped
+from btcp.striping import STRIPE_HEADER, StripeAssembler, split
+
+
+class TestSplit(unittest.TestCase):
+    """Stripe bounds"""
+
+    def test_split(self):
+        self.assertEqual(split(10, 3), [(0, 3), (3, 3), (6, 4)])
+        self.assertEqual(split(2, 4), [(0, 1), (1, 1)])
+        self.assertEqual(split(0, 4), [(0, 0)])
+        for size, stripes in ((1000, 7), (12345, 4), (1, 1)):
+            with self.subTest(size=size, stripes=stripes):
+                bounds = split(size, stripes)
+                self.assertEqual(sum(length for offset, length in bounds), size)
+                self.assertEqual([offset for offset, length in bounds],
+                                 [sum(length for offset, length in bounds[:i])
+                                  for i in range(len(bounds))])
+
+
+class TestStripeAssembler(unittest.TestCase):
+    """Reassembly from stripes in any order"""
+
+    def test_reassembly(self):
+        data = random.Random(0).randbytes(10_000)
+        assembler = StripeAssembler()
+        streams = []
+        for offset, length in split(len(data), 3):
+            streams.append((assembler.stream(),
+                            STRIPE_HEADER.pack(len(data), offset, length)
+                            + data[offset:offset + length]))
+        # Interleave the stripes in pieces that split the headers as well.
+        position = 0
+        while position < max(len(stripe) for stream, stripe in streams):
+            for stream, stripe in reversed(streams):
+                stream.feed(stripe[position:position + 7])
+            self.assertEqual(assembler.complete(), position + 7 >= len(streams[-1][1]))
+            position += 7
+        self.assertEqual(bytes(assembler.data), data)
+
+    def test_empty(self):
+        assembler = StripeAssembler()
+        assembler.stream().feed(STRIPE_HEADER.pack(0, 0, 0))
+        self.assertTrue(assembler.complete())
+        self.assertEqual(bytes(assembler.data), b'')
+
+    def test_size_mismatch(self):
+        assembler = StripeAssembler()
+        assembler.stream().feed(STRIPE_HEADER.pack(100, 0, 50))
+        with self.assertRaises(ValueError):
+            assembler.stream().feed(STRIPE_HEADER.pack(200, 50, 50))
+
+
+class TestSimulateStriped(unittest.TestCase):
+    """Striped transfers over the simulated network"""
+
+    data = random.Random(0).randbytes(300_000)
+
+    def test_transfer(self):
+        for stripes in (1, 4):
+            with self.subTest(stripes=stripes):
+                self.assertTrue(simulate_striped(self.data, stripes, delay=0.01).correct)
+
+    def test_stripes_beat_one_connection_under_loss(self):
+        striped = simulate_striped(self.data, 4, delay=0.01, loss=0.05)
+        self.assertTrue(striped.correct)
+        self.assertLess(striped.duration, simulate(self.data, delay=0.01, loss=0.05).duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import random
+import unittest
+
+from btcp.constants import *
+from test_naks import transfer
+
+
+class TestTailLossProbe(unittest.TestCase):
+    """Losses at the end of a transfer found by probing"""
+
+    # Five segments, the ACK of the handshake being transmission 1.
+    data = random.Random(0).randbytes(5 * PAYLOAD_SIZE)
+
+    def test_lost_tail_is_probed(self):
+        client, duration = transfer(self.data, {6})
+        self.assertEqual(client.tail_probes, 1)
+        self.assertEqual(client.retransmissions, 1)
+        self.assertLess(duration, 0.1)
+
+    def test_without_probe_the_tail_waits_for_the_timeout(self):
+        client, duration = transfer(self.data, {6}, tail_loss_probe=False)
+        self.assertEqual(client.tail_probes, 0)
+        self.assertGreater(duration, 0.1)
+
+    def test_probe_answered_with_a_nak(self):
+        # The probe gets through and the NAK it draws names the rest.
+        client, duration = transfer(self.data, {2, 3, 4, 5, 6})
+        self.assertEqual(client.tail_probes, 1)
+        self.assertGreater(client.naks_received, 0)
+        self.assertLess(duration, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
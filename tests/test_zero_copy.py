@@ -0,0 +1,118 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from btcp.btcp_socket import BTCPSocket
+from btcp.client_socket import BTCPClientSocket
+from btcp.constants import *
+from btcp.file_io import MappedFile, receive_file, send_file
+from btcp.loopback_layer import LoopbackLayer
+from btcp.server_socket import BTCPServerSocket
+
+
+class TestSegmentParts(unittest.TestCase):
+    """Segments built and checksummed without copying their data"""
+
+    def test_in_cksum_parts(self):
+        generator = random.Random(1)
+        for length in (0, 1, 2, 9, 10, 11, 1008, 1009):
+            data = generator.randbytes(length)
+            for split in range(0, length + 1, 2):
+                self.assertEqual(BTCPSocket.in_cksum_parts(data[:split], data[split:]),
+                                 BTCPSocket.in_cksum(data))
+
+
+    def test_parts_join_to_segment(self):
+        generator = random.Random(2)
+        for algorithm in (INTERNET_CHECKSUM, CRC32_CHECKSUM, ADLER32_CHECKSUM):
+            for length in (0, 1, 500, 1004, 1008, 3000):
+                data = generator.randbytes(length)
+                for payload_size in (0, PAYLOAD_SIZE):
+                    segment = BTCPSocket.build_segment(7, 8, window=9, data=data,
+                                                       algorithm=algorithm,
+                                                       payload_size=payload_size)
+                    parts = BTCPSocket.build_segment_parts(7, 8, window=9,
+                                                           data=memoryview(data),
+                                                           algorithm=algorithm,
+                                                           payload_size=payload_size)
+                    self.assertEqual(b''.join(parts), segment)
+                    self.assertTrue(BTCPSocket.verify_segment(segment))
+
+
+    def test_corruption_detected_in_place(self):
+        segment = bytearray(BTCPSocket.build_segment(1, 2, data=b'payload'))
+        segment[12] ^= 0x10
+        self.assertFalse(BTCPSocket.verify_segment(memoryview(segment)))
+
+
+class TestMappedSend(unittest.TestCase):
+    """send_file from a memory mapping, over the loopback layer"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source")
+        self.destination = os.path.join(self.directory.name, "destination")
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def _transfer(self, data):
+        with open(self.source, "wb") as file:
+            file.write(data)
+        server = BTCPServerSocket(50, 100, LoopbackLayer)
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        def receive():
+            server.accept()
+            receive_file(server, self.destination)
+        reader = threading.Thread(target=receive)
+        reader.start()
+        try:
+            self.assertTrue(client.connect())
+            self.assertEqual(send_file(client, self.source), len(data))
+            self.assertTrue(client.shutdown())
+            reader.join()
+        finally:
+            client.close()
+            server.close()
+        self.assertEqual(client.bytes_acknowledged, len(data))
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+
+    def test_file(self):
+        self._transfer(random.Random(3).randbytes(300001))
+
+
+    def test_empty_file(self):
+        self._transfer(b'')
+
+
+    def test_chunks(self):
+        with open(self.source, "wb") as file:
+            file.write(bytes(range(256)) * 10)
+        mapped = MappedFile(self.source, 1000)
+        self.assertEqual(len(mapped), 3)
+        self.assertEqual(bytes(mapped[2]), (bytes(range(256)) * 10)[2000:])
+        with self.assertRaises(IndexError):
+            mapped[3]
+        mapped.close()
+
+
+    def test_read_only_data_is_not_copied(self):
+        client = BTCPClientSocket(50, 100, LoopbackLayer)
+        def buffered():
+            chunks = []
+            while not client._sendbuf.empty():
+                chunks.append(client._sendbuf.get_nowait())
+            return chunks
+        try:
+            client.send(bytes(3000))
+            self.assertTrue(all(isinstance(chunk, memoryview) for chunk in buffered()))
+            client.send(bytearray(3000))
+            self.assertTrue(all(isinstance(chunk, bytes) for chunk in buffered()))
+        finally:
+            client.close()